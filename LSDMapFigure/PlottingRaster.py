@@ -35,18 +35,35 @@ class BaseRaster(object):
     Args:
         RasterName (str): The name of the rasters (with extension). It is read by gdal so should cope with mulitple formats
         Directory (str): The path to the raster. Needs to have the trailing slash
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize) to read. If None the whole raster is read.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax] in map coordinates to read. Ignored if window is given.
+        target_width_pixels (int): The number of pixels the raster will be drawn across. If given, the raster is decimated while it is read so no more pixels are read than can be shown. If None the raster is read at full resolution.
+        resampling (str): "nearest" or "average", for decimated reads. If None, integer rasters use nearest and others use average.
     """
-    def __init__(self, RasterName, Directory):
+    def __init__(self, RasterName, Directory, window = None, bbox = None,
+                 target_width_pixels = None, resampling = None):
 
         self._RasterFileName = RasterName
         self._RasterDirectory = Directory
         self._FullPathRaster = self._RasterDirectory + self._RasterFileName
 
+        # Work out how much to decimate the raster
+        self._decimation = 1
+        if target_width_pixels is not None:
+            self._decimation = LSDP.LSDMap_IO.GetDisplayDecimation(self._FullPathRaster, target_width_pixels,
+                                                                   window = window, bbox = bbox)
+        if resampling is None:
+            resampling = LSDP.LSDMap_IO.GetDisplayResampling(self._FullPathRaster)
+        if self._decimation > 1:
+            print("I am reading every "+str(self._decimation)+" pixels of "+RasterName+" using "+resampling+" resampling")
+
         # I think the BaseRaster should contain a numpy array of the Raster
-        self._RasterArray = LSDP.ReadRasterArrayBlocks(self._FullPathRaster)
+        # Only the pixels in the window are read
+        self._RasterArray = LSDP.ReadRasterArrayBlocks(self._FullPathRaster, window = window, bbox = bbox,
+                                                       decimation = self._decimation, resampling = resampling)
 
         # Get the extents as a list
-        self._RasterExtents = LSDP.GetRasterExtent(self._FullPathRaster)
+        self._RasterExtents = LSDP.GetRasterWindowExtent(self._FullPathRaster, window = window, bbox = bbox)
         self._RasterAspectRatio = (self._RasterExtents[1]-self._RasterExtents[0])/(self._RasterExtents[3]-self._RasterExtents[2])
 
         # set the default colourmap
@@ -60,6 +77,10 @@ class BaseRaster(object):
     def extents(self):
         return self._RasterExtents
 
+    @property
+    def decimation(self):
+        return self._decimation
+
     @property
     def fullpath_to_raster(self):
         return self._FullPathRaster
@@ -175,9 +196,16 @@ class MapFigure(object):
     At the moment the4 axes contain typically a colourbar and a main image axis.
     The function also contains routines for sizing, draping, adding point data,
     etc.
+
+    By default the rasters are read at full resolution. If you give the figure width
+    (fig_width_inches) or the resolution (dpi) the figure will be saved at, the rasters
+    are decimated while they are read to the most pixels that can be drawn across the
+    map (fig_width_inches times dpi, with 4 inches or 300 dpi for the one not given),
+    which is much faster for big rasters. full_resolution = True always reads every pixel.
     """
     def __init__(self, BaseRasterName, Directory,
-                 coord_type="UTM", colourbar_location = "None",*args, **kwargs):
+                 coord_type="UTM", colourbar_location = "None", bbox = None,
+                 fig_width_inches = None, dpi = None, full_resolution = False, *args, **kwargs):
 
         # A map figure has one figure
         #self.fig = plt.figure(1, facecolor='white',figsize=(6,3))
@@ -232,8 +260,24 @@ class MapFigure(object):
         # The way this is going to work is that you can have many rasters in the
         # plot that get appended into a list. Each one has its own colourmap
         # and properties
+        # If there is a bounding box ([XMin, XMax, YMin, YMax]) only that part
+        # of the base raster and of every drape is read
+        self._bbox = bbox
+
+        # The number of pixels the map can show across. None means read at full resolution,
+        # which is what you get unless you say how big the figure will be
+        if full_resolution or (fig_width_inches is None and dpi is None):
+            self._target_width_pixels = None
+        else:
+            if fig_width_inches is None:
+                fig_width_inches = 4
+            if dpi is None:
+                dpi = 300
+            self._target_width_pixels = int(fig_width_inches*dpi)
+
         self._RasterList = []
-        self._RasterList.append(BaseRaster(BaseRasterName,Directory))
+        self._RasterList.append(BaseRaster(BaseRasterName,Directory,bbox = self._bbox,
+                                           target_width_pixels = self._target_width_pixels))
 
         # The coordinate type. UTM and UTM with tick in km are supported at the moment
         self._set_coord_type(coord_type)
@@ -264,10 +308,10 @@ class MapFigure(object):
 
         if self._coord_type == "UTM":
             self.tick_xlocs,self.tick_ylocs,self.tick_x_labels,self.tick_y_labels = LSDP.GetTicksForUTMNoInversion(self._BaseRasterFullName,self._xmax,self._xmin,
-                             self._ymax,self._ymin,self._n_target_ticks)
+                             self._ymax,self._ymin,self._n_target_ticks,bbox = self._bbox)
         elif self._coord_type == "UTM_km":
             self.tick_xlocs,self.tick_ylocs,self.tick_x_labels,self.tick_y_labels = LSDP.GetTicksForUTMNoInversion(self._BaseRasterFullName,self._xmax,self._xmin,
-                             self._ymax,self._ymin,self._n_target_ticks)
+                             self._ymax,self._ymin,self._n_target_ticks,bbox = self._bbox)
             n_hacked_digits = 3
             self.tick_x_labels = LSDP.TickLabelShortenizer(self.tick_x_labels,n_hacked_digits)
             self.tick_y_labels = LSDP.TickLabelShortenizer(self.tick_y_labels,n_hacked_digits)
@@ -381,12 +425,27 @@ class MapFigure(object):
     def add_drape_image(self,RasterName,Directory,colourmap = "gray",
                         alpha=0.5,
                         show_colourbar = False,
-                        colorbarlabel = "Colourbar", norm = "None"):
+                        colorbarlabel = "Colourbar", norm = "None",
+                        resampling = None):
+        """
+        This drapes a raster over the base image.
+
+        Args:
+            RasterName (str): The name of the raster (with extension)
+            Directory (str): The path to the raster. Needs to have the trailing slash
+            colourmap (str or colourmap): The colourmap of the drape
+            alpha (float): The transparency of the drape
+            show_colourbar (bool): Not used; the colourbar depends on the colourbar_location of the figure
+            colorbarlabel (str): The label of the colourbar
+            norm (float list): [vmin, vmax] of the colourmap, or "None"
+            resampling (str): How the drape is decimated for display: "nearest" (for categories) or "average". If None, integer rasters use nearest and others use average.
+        """
 
         print("N axes are: "+str(len(self.ax_list)))
         print(self.ax_list[0])
 
-        self.ax_list = self._add_drape_image(self.ax_list,RasterName,Directory,colourmap,alpha,colorbarlabel,norm)
+        self.ax_list = self._add_drape_image(self.ax_list,RasterName,Directory,colourmap,alpha,colorbarlabel,norm,
+                                             resampling)
         #print("Getting axis limits in drape function: ")
         #print(self.ax_list[0].get_xlim())
 
@@ -394,9 +453,11 @@ class MapFigure(object):
     def _add_drape_image(self,ax_list,RasterName,Directory,
                          colourmap = "gray",
                          alpha=0.5,
-                         colorbarlabel = "Colourbar", nroma = "None"):
+                         colorbarlabel = "Colourbar", nroma = "None", resampling = None):
 
-        self._RasterList.append(BaseRaster(RasterName,Directory))
+        self._RasterList.append(BaseRaster(RasterName,Directory,bbox = self._bbox,
+                                           target_width_pixels = self._target_width_pixels,
+                                           resampling = resampling))
         self._RasterList[-1].set_colourmap(colourmap)
 
         # We need to initiate with a figure
@@ -466,7 +527,15 @@ class MapFigure(object):
                        scale_points = False,column_for_scaling = "None",
                        scaled_data_in_log = False,
                        max_point_size = 5,
-                       min_point_size = 0.5, coulor_log = False, coulor_manual_scale = [], manual_size = 0.5, alpha = 1, minimum_log_scale_cut_off = -10):
+                       min_point_size = 0.5, coulor_log = False, coulor_manual_scale = [], manual_size = 0.5, alpha = 1, minimum_log_scale_cut_off = -10,
+                       aggregation_threshold = None, aggregation_method = "mean"):
+        """
+        This plots point data over the map. If there are more points than the
+        aggregation threshold (LSDP.POINT_AGGREGATION_THRESHOLD if it is None) they are
+        binned into an image with as many pixels across as the rasters were read at,
+        and aggregated with aggregation_method ("mean", "max", "min", "count", or "last"
+        for categories). The points are then not scaled by size.
+        """
 
         # Get the axis limits to assert after
         this_xlim = self.ax_list[0].get_xlim()
@@ -475,6 +544,11 @@ class MapFigure(object):
         EPSG_string = self._RasterList[0]._EPSGString
         print("I am going to plot some points for you. The EPSG string is:"+EPSG_string)
 
+        # Only the points on the map are styled and drawn. The clipping uses the
+        # spatial index of the point data, so it doesn't change the caller's data.
+        extent = [min(this_xlim), max(this_xlim), min(this_ylim), max(this_ylim)]
+        thisPointData = thisPointData.GetClippedCopy(EPSG_string, extent)
+
         # convert to easting and northing
         [easting,northing] = thisPointData.GetUTMEastingNorthing(EPSG_string)
 
@@ -523,7 +597,28 @@ class MapFigure(object):
         else:
             point_scale = manual_size
 
-        if len(this_data) == 0 or len(this_data) != len(easting):
+        if aggregation_threshold is None:
+            aggregation_threshold = LSDP.POINT_AGGREGATION_THRESHOLD
+
+        if len(easting) > aggregation_threshold:
+            if self._target_width_pixels is None:
+                n_pixels = self._RasterList[0]._RasterArray.shape[1]
+            else:
+                n_pixels = self._target_width_pixels
+
+            if len(this_data) == 0 or len(this_data) != len(easting):
+                print("I am only plotting the points.")
+                sc = LSDP.PlotPointsOrAggregate(self.ax_list[0], easting, northing, None, extent, n_pixels,
+                                                _mcolors.ListedColormap(["blue"]), method = "count",
+                                                aggregation_threshold = aggregation_threshold, alpha = alpha)
+            else:
+                cNorm = None
+                if(len(coulor_manual_scale) == 2):
+                    cNorm  = _mcolors.Normalize(vmin=coulor_manual_scale[0], vmax=coulor_manual_scale[1])
+                sc = LSDP.PlotPointsOrAggregate(self.ax_list[0], easting, northing, this_data, extent, n_pixels,
+                                                this_colourmap, norm = cNorm, method = aggregation_method,
+                                                aggregation_threshold = aggregation_threshold, alpha = alpha)
+        elif len(this_data) == 0 or len(this_data) != len(easting):
             print("I am only plotting the points.")
             sc = self.ax_list[0].scatter(easting,northing,s=point_scale, c="blue",cmap=this_colourmap,edgecolors='none', alpha = alpha)
         else:
@@ -575,11 +670,11 @@ class MapFigure(object):
             print("There is no data with the column name: "+column_for_plotting)
         else:
 
-            # Thin the data
+            # Thin the data. This works on a copy so the caller's point data is left intact
             if len(selection_criteria) == 1:
-                thisPointData.ThinData(column_for_plotting,selection_criteria)
+                thisPointData = thisPointData.GetThinnedData(column_for_plotting,selection_criteria[0])
             elif len(selection_criteria) >1:
-                thisPointData.ThinDataSelection(column_for_plotting,selection_criteria)
+                thisPointData = thisPointData.GetThinnedDataSelection(column_for_plotting,selection_criteria)
 
             # get the easting and northing
             EPSG_string = self._RasterList[0]._EPSGString
@@ -636,6 +731,11 @@ class MapFigure(object):
         fig.set_size_inches(fig_size_inches[0], fig_size_inches[1])
         self.ax_list[0].set_position(map_axes)
 
+        # Check that the rasters were read at a high enough resolution for this figure
+        if self._target_width_pixels is not None and fig_width_inches*Fig_dpi > self._target_width_pixels:
+            print("Warning: the rasters were read for "+str(self._target_width_pixels)+" pixels across but this figure has "
+                  +str(int(fig_width_inches*Fig_dpi))+". Use the fig_width_inches and dpi (or full_resolution) arguments of MapFigure.")
+
         # Annoying but the scatter plot resets the extens so you need to reassert them
         self.ax_list[0].set_xlim(self._xmin,self._xmax)
         self.ax_list[0].set_ylim(self._ymax,self._ymin)
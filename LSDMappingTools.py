@@ -584,14 +584,11 @@ def read_headers(input_file):
         return [float(h) if not h.isalpha() else h for h in [l.split()[1] for l in f.readlines()]]  #isdigit() does not catch floats      
 
 def read_bin(filename):
-    import sys
     import numpy as np
 
-    with open(filename + '.flt', "rb") as f:
-        raster_data = np.fromstring(f.read(), 'f')
-
-    if sys.byteorder == 'big':
-        raster_data = raster_data.byteswap()  #ensures data is little endian
+    # memory map the file rather than reading a copy of it. The data are
+    # little endian whatever the byte order of this machine.
+    raster_data = np.memmap(filename + '.flt', dtype='<f4', mode='r')
 
     return raster_data
     
@@ -7,19 +7,78 @@
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+import hashlib
+import multiprocessing
 import numpy as np
+from multiprocessing.pool import ThreadPool
+from osgeo import gdal, osr
 from . import LSDMap_OSystemTools as LSDOst
 from . import LSDMap_GDALIO as LSDMap_IO
+from . import LSDMap_RasterCalculator as LSDMap_RC
 from pyproj import Proj, transform
 
+# pyproj 2.1 and later have Transformer objects, which are much faster than
+# building Proj objects and calling transform for every coordinate
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
+
+# One transformer for each (source, target) pair, shared by the whole process
+_TransformerCache = {}
+
+def GetCoordinateTransformer(source_EPSG_string, target_EPSG_string):
+    """This returns a cached transformer between two coordinate systems.
+    It is built the first time a pair is requested and reused after that.
+
+    Args:
+        source_EPSG_string (str): The EPSG code of the input coordinates, e.g. 'epsg:4326'
+        target_EPSG_string (str): The EPSG code of the output coordinates, e.g. 'epsg:32611'
+
+    Returns:
+        A pyproj Transformer, or a (Proj, Proj) tuple for old versions of pyproj
+    """
+    key = (source_EPSG_string.strip().lower(), target_EPSG_string.strip().lower())
+    if key not in _TransformerCache:
+        if Transformer is not None:
+            _TransformerCache[key] = Transformer.from_crs(key[0], key[1], always_xy=True)
+        else:
+            _TransformerCache[key] = (Proj(init=key[0]), Proj(init=key[1]))
+    return _TransformerCache[key]
+
+def TransformCoordinates(source_EPSG_string, target_EPSG_string, x, y):
+    """This transforms coordinates from one system to another. x and y can be
+    single values or arrays; arrays are transformed in one vectorised call.
+
+    Args:
+        source_EPSG_string (str): The EPSG code of the input coordinates
+        target_EPSG_string (str): The EPSG code of the output coordinates
+        x (float or array): The x coordinates (longitude for geographic coordinates)
+        y (float or array): The y coordinates (latitude for geographic coordinates)
+
+    Returns:
+        x,y The transformed coordinates. Arrays if the input was not a scalar
+    """
+    this_transformer = GetCoordinateTransformer(source_EPSG_string, target_EPSG_string)
+
+    if not (np.isscalar(x) and np.isscalar(y)):
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+
+    if Transformer is not None:
+        return this_transformer.transform(x,y)
+    else:
+        return transform(this_transformer[0],this_transformer[1],x,y)
+
 
 def GetUTMEastingNorthing(EPSG_string,latitude,longitude):
     """This returns the easting and northing for a given latitude and longitide
 
     Args:
         ESPG_string (str): The ESPG code. 326XX is for UTM north and 327XX is for UTM south
-        latitude (float): The latitude in WGS84
-        longitude (float): The longitude in WGS84
+        latitude (float): The latitude in WGS84. Can also be an array.
+        longitude (float): The longitude in WGS84. Can also be an array.
 
     Returns:
         easting,northing The easting and northing in the UTM zone of your selection
@@ -27,13 +86,10 @@ def GetUTMEastingNorthing(EPSG_string,latitude,longitude):
     Author:
         Simon M Mudd
     """
-        
-    #print "Yo, getting this stuff: "+EPSG_string
+
     # The lat long are in epsg 4326 which is WGS84
-    inProj = Proj(init='epsg:4326')
-    outProj = Proj(init=EPSG_string)
-    ea,no = transform(inProj,outProj,longitude,latitude)
-        
+    ea,no = TransformCoordinates('epsg:4326',EPSG_string,longitude,latitude)
+
     return ea,no
 
 
@@ -77,20 +133,10 @@ def SetNoDataBelowThreshold(raster_filename,new_raster_filename, threshold = 0,
 
     Author: SMM
     """
-
-
-    
-    # read the data
-    rasterArray = LSDMap_IO.ReadRasterArrayBlocks(raster_filename)
-    print("Read the data")
-    
-    # set any point on the raster below the threshold as nodata
-    rasterArray[rasterArray <= threshold] = NoDataValue
-    print("Reset raster values")
-    
-    # write the data to a new file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,rasterArray,driver_name, NoDataValue)
-    print("Wrote raster")
+    # set any point on the raster below the threshold as nodata, a strip at a time
+    LSDMap_RC.RasterCalculator("where(a <= threshold, nan, a)", [raster_filename], new_raster_filename,
+                               constants = {"threshold": threshold},
+                               driver_name = driver_name, NoDataValue = NoDataValue)
 #==============================================================================
 
 #==============================================================================
@@ -116,47 +162,445 @@ def SetToConstantValue(raster_filename,new_raster_filename, constant_value, driv
 
     # get the nodata value
     NoDataValue =  LSDMap_IO.getNoDataValue(raster_filename)
-               
-    # read the data
-    rasterArray = LSDMap_IO.ReadRasterArrayBlocks(raster_filename)
-    print("Read the data")   
-    
-    # set any nodata to a constant value
-    rasterArray[rasterArray != NoDataValue] = constant_value
-    print("Changed to a constant value")
-    
-    # write the data to a new file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,rasterArray,driver_name, NoDataValue)
-    print("Wrote raster")
+    if NoDataValue is None:
+        NoDataValue = -9999
+
+    # set anything that isn't nodata to a constant value, a strip at a time. Nodata stays nodata.
+    LSDMap_RC.RasterCalculator("a*0 + constant_value", [raster_filename], new_raster_filename,
+                               constants = {"constant_value": constant_value},
+                               driver_name = driver_name, NoDataValue = NoDataValue)
 
 #==============================================================================
 # This function calcualtes a hillshade and writes to file
 #==============================================================================    
-def GetHillshade(raster_filename,new_raster_filename, azimuth = 315, angle_altitude = 45, driver_name = "ENVI", NoDataValue = -9999):
-    """This calls the hillshade function from the basic manipulation package, but then prints the resulting raster to file.  
-   
+#==============================================================================
+# These compute hillshades. The raster is processed in strips of rows, each
+# with a one pixel halo so that the gradients at the edges of the strips are
+# the same as those of the whole raster.
+#==============================================================================
+
+# The azimuths used for multidirectional hillshades
+MULTIDIRECTIONAL_AZIMUTHS = [225, 270, 315, 360]
+
+def HillshadeArray(array, azimuth = 315, angle_altitude = 45, z_factor = 1,
+                   cellsize = (1,1), multidirectional = False, halo = (0,0)):
+    """This computes the hillshade of an array in float32. It works in a few
+    buffers that are updated in place, so it doesn't need the pile of full size
+    temporaries that the straightforward version does. The input array is not changed.
+
+    Args:
+        array (np.array): The elevations. Nodata should be nan.
+        azimuth (float): Azimuth of sunlight. Ignored if multidirectional.
+        angle_altitude (float): Angle altitude of sun
+        z_factor (float): The vertical exaggeration
+        cellsize (float tuple): The (row, column) spacing of the cells. (1,1) gives the hillshade in pixel units.
+        multidirectional (bool): If true, combines the hillshades from MULTIDIRECTIONAL_AZIMUTHS, each weighted by how much the slope faces across the light.
+        halo (int tuple): The number of rows at the (top, bottom) of array that are only there for the gradients. They are not returned.
+
+    Returns:
+        np.array: The hillshade, from 0 to 255, in float32
+    """
+    array = np.asarray(array, dtype = np.float32)
+    n_rows = array.shape[0]
+
+    # The gradients: x is along the rows and y is along the columns
+    x, y = np.gradient(array, float(cellsize[0]), float(cellsize[1]))
+    x = np.asarray(x[halo[0]:n_rows-halo[1]], dtype = np.float32)
+    y = np.asarray(y[halo[0]:n_rows-halo[1]], dtype = np.float32)
+
+    # slope = pi/2 - arctan(z*sqrt(x^2+y^2))
+    slope = np.multiply(x, x)
+    buff = np.multiply(y, y)
+    np.add(slope, buff, out = slope)
+    np.sqrt(slope, out = slope)
+    np.multiply(slope, z_factor, out = slope)
+    np.arctan(slope, out = slope)
+    np.subtract(np.pi/2., slope, out = slope)
+
+    # aspect = arctan2(-x,y). This goes into x, which isn't needed any more
+    np.negative(x, out = x)
+    aspect = np.arctan2(x, y, out = x)
+
+    # shaded = sin(alt)*sin(slope) + cos(alt)*cos(slope)*cos(az - aspect)
+    altituderad = angle_altitude*np.pi / 180.
+    sin_term = np.sin(slope, out = buff)
+    np.multiply(sin_term, np.sin(altituderad), out = sin_term)
+    cos_term = np.cos(slope, out = slope)
+    np.multiply(cos_term, np.cos(altituderad), out = cos_term)
+
+    if multidirectional:
+        azimuth_list = MULTIDIRECTIONAL_AZIMUTHS
+    else:
+        azimuth_list = [azimuth]
+
+    if len(azimuth_list) == 1:
+        shaded = np.subtract(azimuth_list[0]*np.pi / 180., aspect, out = y)
+        np.cos(shaded, out = shaded)
+        np.multiply(shaded, cos_term, out = shaded)
+        np.add(shaded, sin_term, out = shaded)
+    else:
+        # The weights are sin^2(az - aspect), so each light counts most on the
+        # slopes it lights from the side
+        shaded = np.zeros_like(aspect)
+        weight_sum = np.zeros_like(aspect)
+        angle = np.empty_like(aspect)
+        weight = np.empty_like(aspect)
+        for this_azimuth in azimuth_list:
+            np.subtract(this_azimuth*np.pi / 180., aspect, out = angle)
+            np.sin(angle, out = weight)
+            np.multiply(weight, weight, out = weight)
+            np.add(weight_sum, weight, out = weight_sum)
+            np.cos(angle, out = angle)
+            np.multiply(angle, cos_term, out = angle)
+            np.add(angle, sin_term, out = angle)
+            np.multiply(angle, weight, out = angle)
+            np.add(shaded, angle, out = shaded)
+        np.maximum(weight_sum, np.finfo(np.float32).tiny, out = weight_sum)
+        np.divide(shaded, weight_sum, out = shaded)
+
+    # Rescale from -1..1 to 0..255
+    np.add(shaded, 1, out = shaded)
+    np.multiply(shaded, 127.5, out = shaded)
+    return shaded
+
+def TiledHillshade(raster_filename, new_raster_filename = None, azimuth = 315,
+                   angle_altitude = 45, z_factor = 1, multidirectional = False,
+                   scale_by_cellsize = True, tile_rows = 512, n_threads = None,
+                   driver_name = "ENVI", NoDataValue = -9999):
+    """This makes a hillshade of a raster a strip of rows at a time. Strips are read
+    with a one pixel halo and shaded on a pool of threads (numpy releases the GIL
+    for the heavy lifting). If you give a new raster name the strips are written
+    straight to it, so only a few strips are ever in memory.
+
+    Args:
+        raster_filename (str): The raster's name with full path and extension
+        new_raster_filename (str): The name of the hillshade raster to write. If None, the hillshade is returned as an array.
+        azimuth (float): Azimuth angle (compass direction) of the sun (in degrees).
+        angle_altitude (float): Altitude angle of the sun.
+        z_factor (float): The vertical exaggeration
+        multidirectional (bool): If true, combines hillshades lit from several directions.
+        scale_by_cellsize (bool): If true, the gradients use the cell size from the geotransform so slopes are real slopes.
+        tile_rows (int): The number of rows in each strip
+        n_threads (int): The number of threads. If None, uses the number of cores.
+        driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
+        NoDataValue (float): The nodata value of the new raster.
+
+    Returns:
+        The hillshade array if new_raster_filename is None, otherwise None but prints a new raster to file.
+    """
+    if os.path.exists(raster_filename) is False:
+        raise Exception('[Errno 2] No such file or directory: \'' + raster_filename + '\'')
+
+    dataset = gdal.Open(raster_filename, gdal.GA_ReadOnly)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+
+    band = dataset.GetRasterBand(1)
+    InNoDataValue = band.GetNoDataValue()
+    n_cols = dataset.RasterXSize
+    n_rows = dataset.RasterYSize
+    geotransform = dataset.GetGeoTransform()
+
+    if scale_by_cellsize:
+        cellsize = (abs(geotransform[5]), abs(geotransform[1]))
+    else:
+        cellsize = (1,1)
+
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+    tile_rows = max(int(tile_rows),2)
+
+    # Set up the output: either a raster or an array
+    if new_raster_filename is not None:
+        driver = gdal.GetDriverByName(driver_name)
+        outRaster = driver.Create(new_raster_filename, n_cols, n_rows, 1, gdal.GDT_Float32)
+        outRaster.SetGeoTransform(geotransform)
+        outRasterSRS = osr.SpatialReference()
+        outRasterSRS.ImportFromWkt(dataset.GetProjectionRef())
+        outRaster.SetProjection(outRasterSRS.ExportToWkt())
+        outband = outRaster.GetRasterBand(1)
+        outband.SetNoDataValue(NoDataValue)
+        hillshade = None
+    else:
+        hillshade = np.empty((n_rows,n_cols), dtype = np.float32)
+
+    def ReadTile(first_row):
+        # Read the strip plus a halo row on each side (where there is one)
+        last_row = min(first_row+tile_rows, n_rows)
+        read_first = max(first_row-1, 0)
+        read_last = min(last_row+1, n_rows)
+        tile = np.empty((read_last-read_first, n_cols), dtype = np.float32)
+        band.ReadAsArray(0, read_first, n_cols, read_last-read_first, buf_obj = tile)
+        if InNoDataValue is not None:
+            tile[tile == InNoDataValue] = np.nan
+        return tile, (first_row-read_first, read_last-last_row)
+
+    def ShadeTile(tile_and_halo):
+        tile, halo = tile_and_halo
+        return HillshadeArray(tile, azimuth, angle_altitude, z_factor, cellsize,
+                              multidirectional, halo)
+
+    # Work through the strips a batch at a time. Reading and writing stay on this
+    # thread because gdal datasets shouldn't be shared between threads.
+    print("Making a hillshade in strips of "+str(tile_rows)+" rows on "+str(n_threads)+" threads")
+    pool = ThreadPool(n_threads)
+    try:
+        tile_starts = list(range(0, n_rows, tile_rows))
+        for batch_start in range(0, len(tile_starts), n_threads):
+            batch = tile_starts[batch_start:batch_start+n_threads]
+            tiles = [ReadTile(first_row) for first_row in batch]
+            shaded_tiles = pool.map(ShadeTile, tiles)
+            for first_row, shaded in zip(batch, shaded_tiles):
+                if hillshade is None:
+                    shaded[np.isnan(shaded)] = NoDataValue
+                    outband.WriteArray(shaded, 0, first_row)
+                else:
+                    hillshade[first_row:first_row+shaded.shape[0]] = shaded
+    finally:
+        pool.close()
+        pool.join()
+
+    if hillshade is None:
+        outband.FlushCache()
+        outRaster = None
+    else:
+        return hillshade
+
+def GetHillshade(raster_filename,new_raster_filename, azimuth = 315, angle_altitude = 45, driver_name = "ENVI", NoDataValue = -9999,
+                 z_factor = 1, multidirectional = False, scale_by_cellsize = False, n_threads = None):
+    """This makes a hillshade and prints the resulting raster to file. The raster is shaded in strips
+    that are written as they are finished, so big rasters don't need to fit in memory.
+
    Args:
         raster_filename (str): The raster's name with full path and extension
         new_raster_filename (str): The name of the raster to be printed
-        azimuth (float): Azimuth angle (compass direction) of the sun (in degrees). 
-        angle_altitude (float):Altitude angle of the sun. 
+        azimuth (float): Azimuth angle (compass direction) of the sun (in degrees).
+        angle_altitude (float):Altitude angle of the sun.
         driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
         NoDataValue (float): The nodata value. Usually set to -9999.
+        z_factor (float): The vertical exaggeration
+        multidirectional (bool): If true, combines hillshades lit from several directions.
+        scale_by_cellsize (bool): If true, the gradients use the cell size of the raster. The default (False) is the pixel units hillshade we have always made.
+        n_threads (int): The number of threads. If None, uses the number of cores.
 
     Returns:
         None, but prints a new raster to file.
 
     Author: SMM
     """
-    # avoid circular import
-    from . import LSDMap_BasicPlotting as LSDMBP
-    # get the hillshade
-    hillshade_raster = LSDMBP.Hillshade(raster_filename, azimuth, angle_altitude)
+    TiledHillshade(raster_filename, new_raster_filename, azimuth = azimuth,
+                   angle_altitude = angle_altitude, z_factor = z_factor,
+                   multidirectional = multidirectional, scale_by_cellsize = scale_by_cellsize,
+                   n_threads = n_threads, driver_name = driver_name, NoDataValue = NoDataValue)
+
+
+
+#==============================================================================
+# These keep derived rasters (hillshade, slope, aspect, curvature) in a cache
+# directory so that each one is only computed once per DEM. The cache is keyed
+# on the DEM's path, modification time and size (and those of its georeferencing
+# sidecar files) and on the parameters used,
+# and the least recently used files are deleted when it gets too big.
+#==============================================================================
+
+# The settings of the derived raster cache. Change them with SetDerivedRasterCache
+DerivedRasterCacheSettings = {"directory": os.environ.get("LSDMT_CACHE_DIR",
+                                  os.path.join(os.path.expanduser("~"), ".lsdmappingtools", "derived_rasters")),
+                              "max_size_MB": 2048,
+                              "enabled": True}
+
+# The derived rasters the cache knows how to make
+DERIVED_RASTERS = ["hillshade", "slope", "aspect", "curvature"]
+
+def SetDerivedRasterCache(directory = None, max_size_MB = None, enabled = None):
+    """This changes the settings of the derived raster cache.
+
+    Args:
+        directory (str): The directory where derived rasters are kept. The default is ~/.lsdmappingtools/derived_rasters, or the LSDMT_CACHE_DIR environment variable.
+        max_size_MB (float): When the cache gets bigger than this the least recently used rasters are deleted.
+        enabled (bool): If False, derived rasters are always computed and never stored.
+
+    Returns:
+        None, but changes the cache settings
+    """
+    if directory is not None:
+        DerivedRasterCacheSettings["directory"] = directory
+    if max_size_MB is not None:
+        DerivedRasterCacheSettings["max_size_MB"] = max_size_MB
+    if enabled is not None:
+        DerivedRasterCacheSettings["enabled"] = enabled
+
+def ClearDerivedRasterCache():
+    """This deletes everything in the derived raster cache.
+    """
+    TrimDerivedRasterCache(0)
+
+def TrimDerivedRasterCache(max_size_MB = None):
+    """This deletes the least recently used rasters in the cache until it is smaller than max_size_MB.
+
+    Args:
+        max_size_MB (float): The size to trim to. If None, the size from the cache settings.
+    """
+    if max_size_MB is None:
+        max_size_MB = DerivedRasterCacheSettings["max_size_MB"]
+    directory = DerivedRasterCacheSettings["directory"]
+    if not os.path.isdir(directory):
+        return
+
+    # The modification times are updated whenever a raster is used
+    cache_files = []
+    total_size = 0
+    for name in os.listdir(directory):
+        if name.endswith(".npy"):
+            this_file = os.path.join(directory,name)
+            this_stat = os.stat(this_file)
+            cache_files.append((this_stat.st_mtime,this_stat.st_size,this_file))
+            total_size = total_size+this_stat.st_size
+    cache_files.sort()
+
+    max_size = max_size_MB*1024*1024
+    for mtime,size,this_file in cache_files:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(this_file)
+            total_size = total_size-size
+        except OSError:
+            pass
+
+# The sidecar files that hold the georeferencing of a raster. They are part of the cache key
+RASTER_SIDECAR_EXTENSIONS = [".hdr", ".prj", ".aux.xml", ".tfw", ".blw", ".bpw", ".fpw"]
+
+def _GetRasterSidecarStamps(raster_file):
+    """This gets the name, modification time and size of each sidecar file of a raster
+    (e.g. the .hdr of an ENVI raster), so that changing one changes the cache key.
+    """
+    raster_root = os.path.splitext(raster_file)[0]
+    stamps = []
+    for extension in RASTER_SIDECAR_EXTENSIONS:
+        for sidecar in sorted(set([raster_root+extension, raster_file+extension])):
+            if os.path.exists(sidecar):
+                this_stat = os.stat(sidecar)
+                stamps.append((os.path.basename(sidecar), this_stat.st_mtime, this_stat.st_size))
+    return stamps
+
+def GetCachedDerivedRaster(raster_file, derivative, compute_function, parameters):
+    """This gets a derived raster from the cache, or computes it with compute_function
+    and stores it if it isn't there yet.
+
+    Args:
+        raster_file (str): The name of the raster the derivative is computed from
+        derivative (str): The name of the derivative, used in the key
+        compute_function (function): A function with no arguments that returns the derived array
+        parameters (dict): Everything else that changes the result. Used in the key.
+
+    Returns:
+        np.array: The derived raster
+    """
+    if not DerivedRasterCacheSettings["enabled"]:
+        return compute_function()
+
+    this_stat = os.stat(raster_file)
+    key_string = repr((os.path.abspath(raster_file), this_stat.st_mtime, this_stat.st_size,
+                       _GetRasterSidecarStamps(raster_file),
+                       derivative, sorted((str(k),repr(v)) for k,v in parameters.items())))
+    key = hashlib.sha1(key_string.encode("utf-8")).hexdigest()
+
+    directory = DerivedRasterCacheSettings["directory"]
+    cache_name = os.path.join(directory, derivative+"_"+key+".npy")
+
+    if os.path.exists(cache_name):
+        try:
+            derived = np.load(cache_name)
+            # touch the file so it counts as recently used
+            os.utime(cache_name, None)
+            print("I got the "+derivative+" from the cache")
+            return derived
+        except (IOError, OSError, ValueError) as e:
+            print("I could not read the cached "+derivative+": "+str(e))
+
+    derived = compute_function()
+
+    # Write to a temporary file of our own and then move it into place in one step,
+    # so a half written raster is never read, even with several processes writing it
+    temp_name = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_name = LSDOst.MakeTempFileNextTo(cache_name)
+        with open(temp_name, "wb") as cache_file:
+            np.save(cache_file, derived)
+        LSDOst.ReplaceFile(temp_name, cache_name)
+        TrimDerivedRasterCache()
+    except (IOError, OSError) as e:
+        print("I could not write the "+derivative+" to the cache: "+str(e))
+        if temp_name is not None and os.path.exists(temp_name):
+            os.remove(temp_name)
+
+    return derived
+
+def GetDerivedRaster(raster_file, derivative = "hillshade", azimuth = 315, angle_altitude = 45,
+                     z_factor = 1, multidirectional = False, scale_by_cellsize = False,
+                     NoDataValue = -9999, window = None, bbox = None, use_cache = True):
+    """This gets a raster derived from a DEM: its hillshade, slope, aspect or curvature.
+    These are kept in the derived raster cache, so a multi panel figure or a batch of
+    figures only computes each one once.
+
+    Args:
+        raster_file (str): The name of the DEM with path and extension.
+        derivative (str): "hillshade", "slope" (in degrees), "aspect" (in degrees, the convention of the hillshade) or "curvature" (the laplacian)
+        azimuth (float): Azimuth of sunlight (hillshade only)
+        angle_altitude (float): Angle altitude of sun (hillshade only)
+        z_factor (float): The vertical exaggeration
+        multidirectional (bool): If true, combines hillshades lit from several directions (hillshade only)
+        scale_by_cellsize (bool): If true, the gradients use the cell size of the raster, otherwise they are in pixel units.
+        NoDataValue (float): Values in the DEM that are also treated as nodata
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize) to read.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax] to read. Ignored if window is given.
+        use_cache (bool): If false, the raster is computed and the cache is left alone.
+
+    Returns:
+        np.array: The derived raster
+    """
+    if derivative not in DERIVED_RASTERS:
+        raise Exception("I don't know how to make a "+derivative+". I can make: "+str(DERIVED_RASTERS))
+
+    def ComputeDerivedRaster():
+        array = LSDMap_IO.ReadRasterArrayBlocks(raster_file,raster_band=1,window=window,bbox=bbox)
+        array[array == NoDataValue] = np.nan
+
+        cellsize = (1,1)
+        if scale_by_cellsize:
+            GeoT = LSDMap_IO.GetGeoInfo(raster_file)[3]
+            cellsize = (abs(GeoT[5]), abs(GeoT[1]))
+
+        if derivative == "hillshade":
+            return HillshadeArray(array, azimuth, angle_altitude, z_factor, cellsize, multidirectional)
+
+        array = np.asarray(array, dtype = np.float32)
+        x, y = np.gradient(array, float(cellsize[0]), float(cellsize[1]))
+        if derivative == "slope":
+            return np.degrees(np.arctan(z_factor*np.sqrt(x*x + y*y)))
+        elif derivative == "aspect":
+            return np.mod(np.degrees(np.arctan2(-x, y)), 360)
+        else:
+            xx = np.gradient(x, float(cellsize[0]), axis = 0)
+            yy = np.gradient(y, float(cellsize[1]), axis = 1)
+            return z_factor*(xx+yy)
+
+    if not use_cache:
+        return ComputeDerivedRaster()
+
+    parameters = {"z_factor": z_factor, "scale_by_cellsize": scale_by_cellsize,
+                  "NoDataValue": NoDataValue, "window": window, "bbox": bbox}
+    if derivative == "hillshade":
+        parameters["azimuth"] = azimuth
+        parameters["angle_altitude"] = angle_altitude
+        parameters["multidirectional"] = multidirectional
+
+    return GetCachedDerivedRaster(raster_file, derivative, ComputeDerivedRaster, parameters)
+
 
-    # write to file
-    LSDMap_IO.array2raster(raster_filename,new_raster_filename,hillshade_raster,driver_name, NoDataValue)         
-    
- 
 
 #==============================================================================
 # This takes a grouping list of basin keys and transforms it into a list
@@ -397,13 +841,245 @@ def RasterMeanValue(path, file1):
 # if axis is 0, this is along x axis, if axis is 1, is along y axis
 # otherwise will throw error
 #==============================================================================         
-def SimpleSwath(path, file1, axis):
+#==============================================================================
+# These compute swath statistics in a single pass through the raster, a block
+# of rows at a time, so the raster never has to fit in memory
+#==============================================================================
+def _PolylineSwathCoordinates(x, y, polyline, half_width):
+    """This projects points onto a polyline.
+
+    Args:
+        x, y (np.array): The coordinates of the points
+        polyline (np.array): The vertices of the line, shape (n,2)
+        half_width (float): Points further than this from the line are not in the swath
+
+    Returns:
+        The distance along the line of each point, and a boolean array that is True for points in the swath
+    """
+    best_distance = np.full(x.shape, np.inf)
+    along = np.zeros(x.shape)
+    in_ends = np.zeros(x.shape, dtype = bool)
+
+    n_segments = len(polyline)-1
+    start_distance = 0.0
+    for seg in range(n_segments):
+        x0,y0 = polyline[seg]
+        x1,y1 = polyline[seg+1]
+        dx = x1-x0
+        dy = y1-y0
+        seg_length = np.sqrt(dx*dx+dy*dy)
+        if seg_length == 0:
+            continue
+
+        # the position along the segment (0 to 1) of the closest point
+        t = ((x-x0)*dx + (y-y0)*dy)/(seg_length*seg_length)
+        t_clipped = np.clip(t,0,1)
+        distance = np.hypot(x-(x0+t_clipped*dx), y-(y0+t_clipped*dy))
+
+        closer = distance < best_distance
+        best_distance[closer] = distance[closer]
+        along[closer] = start_distance+t_clipped[closer]*seg_length
+
+        # Points beyond the two ends of the line are not in the swath
+        inside = np.ones(x.shape, dtype = bool)
+        if seg == 0:
+            inside &= t >= 0
+        if seg == n_segments-1:
+            inside &= t <= 1
+        in_ends[closer] = inside[closer]
+
+        start_distance = start_distance+seg_length
+
+    return along, (best_distance <= half_width) & in_ends
+
+def SwathStatistics(raster_file, axis = 0, polyline = None, half_width = None, bin_width = None,
+                    percentiles = [25,50,75], exact_percentiles = False, n_histogram_bins = 1024,
+                    block_rows = 512, window = None, bbox = None, raster_band = 1):
+    """This computes swath statistics in one pass through a raster. The raster is read a block
+    of rows at a time, so it doesn't have to fit in memory.
+
+    The swath is either along one of the axes of the raster (like SimpleSwath) or along
+    a polyline. The mean and standard deviation are exact (the blocks are combined with
+    Welford's method). The percentiles are interpolated from a histogram of each swath bin,
+    between the minimum and maximum of the bin (filled in a second pass), which is accurate to
+    a small fraction of the range of the bin, unless exact_percentiles is True, in which case
+    the data in the swath is kept in memory and sorted.
+
+    Args:
+        raster_file (str): The name of the raster with path and extension.
+        axis (int): For swaths along an axis: 0 gives statistics for each column (over the rows) and 1 gives statistics for each row.
+        polyline (float list): The vertices [[x0,y0],[x1,y1],...] of a line, in map coordinates. If given the swath follows this line.
+        half_width (float): For polyline swaths, the distance from the line (in map units) that is in the swath.
+        bin_width (float): For polyline swaths, the width of the swath bins along the line. Default is the cell size.
+        percentiles (float list): The percentiles to compute (0 to 100)
+        exact_percentiles (bool): If True the percentiles are exact, but the swath data has to fit in memory.
+        n_histogram_bins (int): The number of histogram bins used for the approximate percentiles.
+        block_rows (int): The number of rows read at a time
+        window (int tuple): For swaths along an axis, a pixel window (xoff, yoff, xsize, ysize) to restrict the swath to.
+        bbox (float list): For swaths along an axis, a bounding box [XMin, XMax, YMin, YMax] to restrict the swath to. Ignored if window is given.
+        raster_band (int): The band of the raster
+
+    Returns:
+        dict: Arrays with one element per swath bin. The keys are "distance" (the coordinate of the bin, or the distance along the polyline),
+        "count", "mean", "std", "min", "max", and "percentile_X" for each percentile X. Bins without data are nan.
+    """
+    if os.path.exists(raster_file) is False:
+        raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')
+
+    dataset = gdal.Open(raster_file, gdal.GA_ReadOnly)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    band = dataset.GetRasterBand(raster_band)
+    NDV = band.GetNoDataValue()
+    GeoT = dataset.GetGeoTransform()
+
+    # Work out which part of the raster to read, and the swath bins
+    if polyline is not None:
+        polyline = np.asarray(polyline, dtype = float)
+        if half_width is None:
+            raise Exception("You need to give a half_width for a swath along a polyline")
+        if bin_width is None:
+            bin_width = abs(GeoT[1])
+        swath_bbox = [polyline[:,0].min()-half_width, polyline[:,0].max()+half_width,
+                      polyline[:,1].min()-half_width, polyline[:,1].max()+half_width]
+        xoff, yoff, win_xsize, win_ysize = LSDMap_IO._GetPixelWindow(dataset, bbox = swath_bbox)
+        line_length = np.sum(np.hypot(np.diff(polyline[:,0]),np.diff(polyline[:,1])))
+        n_bins = max(int(np.ceil(line_length/bin_width)),1)
+        distance = (np.arange(n_bins)+0.5)*bin_width
+    else:
+        xoff, yoff, win_xsize, win_ysize = LSDMap_IO._GetPixelWindow(dataset, window, bbox)
+        if axis == 0:
+            n_bins = win_xsize
+            distance = GeoT[0]+(xoff+np.arange(n_bins)+0.5)*GeoT[1]
+        else:
+            n_bins = win_ysize
+            distance = GeoT[3]+(yoff+np.arange(n_bins)+0.5)*GeoT[5]
+
+    # The x coordinates of the columns, for polyline swaths
+    x_coords = GeoT[0]+(xoff+np.arange(win_xsize)+0.5)*GeoT[1]
+
+    block_rows = max(int(block_rows),1)
+    def IterateBlockValues():
+        # This yields the swath bin and value of each valid pixel, a block of rows at a time
+        for first_row in range(yoff, yoff+win_ysize, block_rows):
+            n_rows = min(block_rows, yoff+win_ysize-first_row)
+            block = np.empty((n_rows,win_xsize), dtype = np.float64)
+            band.ReadAsArray(xoff, first_row, win_xsize, n_rows, buf_obj = block)
+
+            valid = np.isfinite(block)
+            if NDV is not None:
+                valid &= block != NDV
+
+            # Get the bin of each valid pixel
+            if polyline is not None:
+                y_coords = GeoT[3]+(first_row+np.arange(n_rows)+0.5)*GeoT[5]
+                X, Y = np.meshgrid(x_coords, y_coords)
+                along, in_swath = _PolylineSwathCoordinates(X, Y, polyline, half_width)
+                valid &= in_swath
+                bins = np.minimum((along[valid]/bin_width).astype(np.int64), n_bins-1)
+            elif axis == 0:
+                bins = np.nonzero(valid)[1]
+            else:
+                bins = np.nonzero(valid)[0]+(first_row-yoff)
+            values = block[valid]
+            if len(values) > 0:
+                yield bins, values
+
+    # The running statistics of each bin
+    count = np.zeros(n_bins)
+    mean = np.zeros(n_bins)
+    M2 = np.zeros(n_bins)
+    minimum = np.full(n_bins, np.inf)
+    maximum = np.full(n_bins, -np.inf)
+
+    if exact_percentiles:
+        kept_bins = []
+        kept_values = []
+
+    for bins, values in IterateBlockValues():
+        # The statistics of this block, then merged with the running statistics
+        block_count = np.bincount(bins, minlength = n_bins).astype(np.float64)
+        has_data = block_count > 0
+        block_mean = np.zeros(n_bins)
+        block_mean[has_data] = np.bincount(bins, weights = values, minlength = n_bins)[has_data]/block_count[has_data]
+        deviation = values-block_mean[bins]
+        block_M2 = np.bincount(bins, weights = deviation*deviation, minlength = n_bins)
+
+        new_count = count+block_count
+        delta = block_mean-mean
+        mean[has_data] += delta[has_data]*block_count[has_data]/new_count[has_data]
+        M2[has_data] += block_M2[has_data] + delta[has_data]**2*count[has_data]*block_count[has_data]/new_count[has_data]
+        count = new_count
+
+        np.minimum.at(minimum, bins, values)
+        np.maximum.at(maximum, bins, values)
+
+        if exact_percentiles:
+            kept_bins.append(bins)
+            kept_values.append(values)
+
+    if not exact_percentiles and len(percentiles) > 0:
+        # A second pass fills a histogram of each swath bin between the exact
+        # minimum and maximum of that bin, so no values are clipped into the end bins
+        value_min = np.where(count > 0, minimum, 0)
+        histogram_width = np.where(count > 0, maximum-value_min, 1)/n_histogram_bins
+        histogram_width[histogram_width <= 0] = 1./n_histogram_bins
+        histograms = np.zeros(n_bins*n_histogram_bins, dtype = np.int64)
+        for bins, values in IterateBlockValues():
+            h_bins = np.clip(((values-value_min[bins])/histogram_width[bins]).astype(np.int64), 0, n_histogram_bins-1)
+            histograms += np.bincount(bins*n_histogram_bins+h_bins, minlength = n_bins*n_histogram_bins)
+
+    # Now the final statistics
+    has_data = count > 0
+    Swath = {"distance": distance, "count": count}
+    Swath["mean"] = np.where(has_data, mean, np.nan)
+    Swath["std"] = np.full(n_bins, np.nan)
+    Swath["std"][has_data] = np.sqrt(M2[has_data]/count[has_data])
+    Swath["min"] = np.where(has_data, minimum, np.nan)
+    Swath["max"] = np.where(has_data, maximum, np.nan)
+
+    if exact_percentiles:
+        if kept_values:
+            all_bins = np.concatenate(kept_bins)
+            all_values = np.concatenate(kept_values)
+            order = np.lexsort((all_values, all_bins))
+            all_values = all_values[order]
+        starts = np.concatenate(([0],np.cumsum(count)[:-1])).astype(np.int64)
+        for percentile in percentiles:
+            these_percentiles = np.full(n_bins, np.nan)
+            if kept_values:
+                # linear interpolation between the ranks, like np.percentile
+                position = starts[has_data]+(count[has_data]-1)*percentile/100.
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                these_percentiles[has_data] = all_values[lower]+(all_values[upper]-all_values[lower])*(position-lower)
+            Swath["percentile_"+str(percentile)] = these_percentiles
+    elif len(percentiles) > 0:
+        histograms = histograms.reshape((n_bins,n_histogram_bins))
+        cumulative = np.cumsum(histograms, axis = 1)
+        rows = np.arange(n_bins)
+        for percentile in percentiles:
+            rank = count*percentile/100.
+            # the first histogram bin that reaches the rank, and where the rank falls in it
+            h_bin = np.argmax(cumulative >= rank[:,np.newaxis], axis = 1)
+            below = cumulative[rows,h_bin]-histograms[rows,h_bin]
+            fraction = (rank-below)/np.maximum(histograms[rows,h_bin],1)
+            these_percentiles = value_min+(h_bin+fraction)*histogram_width
+            these_percentiles = np.clip(these_percentiles, Swath["min"], Swath["max"])
+            Swath["percentile_"+str(percentile)] = np.where(has_data, these_percentiles, np.nan)
+
+    return Swath
+
+def SimpleSwath(path, file1, axis, window = None, bbox = None, exact_percentiles = True):
     """This function averages all the data along one of the directions
     
     Args:
         path (str): The path to the files
         file1 (str): The name of the first raster.
         axis (int): Either 0 (rows) or 1 (cols)
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize) to restrict the swath to.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax] to restrict the swath to. Ignored if window is given.
+        exact_percentiles (bool): If True (the default) the medians and percentiles are exact. If False they come from histograms, so the swath doesn't need to fit in memory. See SwathStatistics.
         
     Returns:
         float: A load of information about the swath.
@@ -414,7 +1090,7 @@ def SimpleSwath(path, file1, axis):
         * twentyfifth_percentile
         * seventyfifth_percentile
         
-        at each node across the axis of the swath. 
+        at each node across the axis of the swath. These are masked where there is no data.
     
     Author: SMM
     """
@@ -424,59 +1100,31 @@ def SimpleSwath(path, file1, axis):
     
     raster_file1 = NewPath+file1
 
-    # get some information about the raster 
-    NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(raster_file1)
-    
-    print("NDV is: ")
-    print(NDV)
-    
-    if NDV == None:
-        NDV = -9999
-        print("No NDV defined")
-    
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
-    
-    
-    #nan_raster = Raster1[Raster1==NDV]=np.nan 
-    #print nan_raster
-    
-    #now mask the nodata
-    masked_Raster1  = np.ma.masked_values(Raster1, NDV)
+    Swath = SwathStatistics(raster_file1, axis = axis, percentiles = [25,50,75],
+                            exact_percentiles = exact_percentiles, window = window, bbox = bbox)
+
+    means = np.ma.masked_invalid(Swath["mean"])
+    medians = np.ma.masked_invalid(Swath["percentile_50"])
+    std_deviations = np.ma.masked_invalid(Swath["std"])
+    twentyfifth_percentile = np.ma.masked_invalid(Swath["percentile_25"])
+    seventyfifth_percentile = np.ma.masked_invalid(Swath["percentile_75"])
     
-    means = np.mean(masked_Raster1, axis)
-    medians = np.median(masked_Raster1, axis)
-    std_deviations = np.std(masked_Raster1, axis)
-    twentyfifth_percentile = np.percentile(masked_Raster1, 25, axis)
-    seventyfifth_percentile = np.percentile(masked_Raster1, 75, axis)
- 
-    # This stuff only works with numpy 1.8 or later, wich we don't have
-    #means = np.nanmean(nan_raster, axis)
-    #medians = np.nanmedian(nan_raster, axis)
-    #std_deviations = np.nanstd(nan_raster, axis)
-    #twentyfifth_percentile = np.nanpercentile(nan_raster, 25, axis)
-    #seventyfifth_percentile = np.nanpercentile(nan_raster, 75, axis)
-   
-    #print means
-    #print medians
-    #print std_deviations
-    #print twentyfifth_percentile
-    #print seventyfifth_percentile    
-    
-    
-    return means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile   
+    return means,medians,std_deviations,twentyfifth_percentile,seventyfifth_percentile
 
         
 #==============================================================================
 # This does a basic mass balance. 
 # Assumes all units are metres
 #==============================================================================         
-def BasicMassBalance(path, file1, file2):
+def BasicMassBalance(path, file1, file2, window = None, bbox = None):
     """This function checks the difference in "volume" between two rasters.
     
     Args:
         path (str): The path to the files
         file1 (str): The name of the first raster.
         file2 (str): The name of the second raster
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize). Only this part of the rasters is used.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax]. Ignored if window is given.
         
     Returns:
         float: The differnece in the volume betweeen the two rasters
@@ -494,13 +1142,12 @@ def BasicMassBalance(path, file1, file2):
     print("PixelArea is: " + str(PixelArea)) 
     
     print("The formatted path is: " + NewPath)
-    Raster1 = LSDMap_IO.ReadRasterArrayBlocks(raster_file1,raster_band=1)
-    Raster2 = LSDMap_IO.ReadRasterArrayBlocks(raster_file2,raster_band=1)
-    
-    NewRaster = np.subtract(Raster2,Raster1)
-    
-    mass_balance = np.sum(NewRaster)*PixelArea
 
-    print("linear dif " + str(np.sum(NewRaster)))    
+    # The difference is summed a strip at a time. Pixels that are nodata in either raster are left out.
+    linear_dif, n_pixels = LSDMap_RC.RasterCalculatorSum("b - a", [raster_file1, raster_file2],
+                                                         window = window, bbox = bbox)
+    mass_balance = linear_dif*PixelArea
+
+    print("linear dif " + str(linear_dif))
         
     return mass_balance       
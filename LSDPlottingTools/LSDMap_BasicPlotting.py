@@ -13,6 +13,7 @@ from .adjust_text import adjust_text
 import LSDPlottingTools.LSDMap_GDALIO as LSDMap_IO
 import LSDPlottingTools.LSDMap_BasicManipulation as LSDMap_BM
 import LSDPlottingTools.LSDMap_OSystemTools as LSDOst
+import LSDPlottingTools.LSDMap_PointTools as LSDMap_PD
 from scipy import signal
 import matplotlib.pyplot as plt
 from LSDPlottingTools import colours
@@ -187,7 +188,7 @@ def TickConverter(x_min,x_max,n_target_tics):
 # x_max, x_min, y_max, y_min are the extent of the plotting area (NOT the DEM)
 # n_target ticks are the number of ticks for plotting
 #------------------------------------------------------------------------------
-def GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics):
+def GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics, bbox = None):
     """This fuction is used to set tick locations for UTM maps. It tries to optimise the spacing of these ticks.
 
     Args:
@@ -196,6 +197,7 @@ def GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics):
         y_min (float): The minimum value on the y axis (in metres).
         y_max (float): The maximum value on the y axis (in metres).
         n_target_ticks (int): The number of ticks you want on the axis (this is optimised so you may not get exactly this number)
+        bbox (float list): If the raster was read with a bounding box ([XMin, XMax, YMin, YMax]) pass it here so the ticks match the window.
 
     Returns:
         new_xlocs (float list): List of locations of the ticks in metres.
@@ -208,6 +210,8 @@ def GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics):
 
     CellSize,XMin,XMax,YMin,YMax = LSDMap_IO.GetUTMMaxMin(FileName)
     NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(FileName)
+    if bbox is not None:
+        XMin,XMax,YMin,YMax = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     #print("Getting ticks. YMin: "+str(YMin)+" and YMax: "+str(YMax))
 
@@ -342,7 +346,7 @@ def GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics):
 # x_max, x_min, y_max, y_min are the extent of the plotting area (NOT the DEM)
 # n_target ticks are the number of ticks for plotting
 #------------------------------------------------------------------------------
-def GetTicksForUTMNoInversion(FileName,x_max,x_min,y_max,y_min,n_target_tics):
+def GetTicksForUTMNoInversion(FileName,x_max,x_min,y_max,y_min,n_target_tics, bbox = None):
     """This fuction is used to set tick locations for UTM maps. It tries to optimise the spacing of these ticks.
 
     Args:
@@ -351,6 +355,7 @@ def GetTicksForUTMNoInversion(FileName,x_max,x_min,y_max,y_min,n_target_tics):
         y_min (float): The minimum value on the y axis (in metres).
         y_max (float): The maximum value on the y axis (in metres).
         n_target_ticks (int): The number of ticks you want on the axis (this is optimised so you may not get exactly this number)
+        bbox (float list): If the raster was read with a bounding box ([XMin, XMax, YMin, YMax]) pass it here so the ticks match the window.
 
     Returns:
         new_xlocs (float list): List of locations of the ticks in metres.
@@ -363,6 +368,8 @@ def GetTicksForUTMNoInversion(FileName,x_max,x_min,y_max,y_min,n_target_tics):
 
     CellSize,XMin,XMax,YMin,YMax = LSDMap_IO.GetUTMMaxMin(FileName)
     NDV, xsize, ysize, GeoT, Projection, DataType = LSDMap_IO.GetGeoInfo(FileName)
+    if bbox is not None:
+        XMin,XMax,YMin,YMax = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     #print("Getting ticks. YMin: "+str(YMin)+" and YMax: "+str(YMax))
 
@@ -607,7 +614,8 @@ def BasicDensityPlot(FileName, thiscmap='gray',colorbarlabel='Elevation in meter
 #==============================================================================
 def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
                             colorbarlabel='Elevation in meters',clim_val = (0,0),
-                            drape_alpha = 0.6,FigFileName = 'Image.pdf',FigFormat = 'show', dpi_save = 250):
+                            drape_alpha = 0.6,FigFileName = 'Image.pdf',FigFormat = 'show', dpi_save = 250,
+                            bbox = None):
     """This creates a draped plot of a raster. It uses AxisGrid to ensure proper placment of the raster.
 
     Args:
@@ -620,6 +628,7 @@ def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gra
         drape_alpha (float): The alpha value (transparency) of the drape
         FigFilename (str): The name of the figure (with extension)
         FigFormat (str): the format of the figure (e.g., jpg, png, pdf). If "show" then the figure is plotted to screen.
+        bbox (float list): If given, only this bounding box ([XMin, XMax, YMin, YMax], in map coordinates) of the rasters is read and plotted.
 
     Returns:
         A density plot of the draped raster
@@ -638,7 +647,7 @@ def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gra
     rcParams['font.size'] = label_size
 
     # get the data
-    raster = LSDMap_IO.ReadRasterArrayBlocks(FileName)
+    raster = LSDMap_IO.ReadRasterArrayBlocks(FileName, bbox = bbox)
 
     from scipy import ndimage
     if DrapeName == "None":
@@ -646,10 +655,10 @@ def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gra
         #filtered = signal.wiener(raster)
         raster_drape = Hillshade(raster)
     else:
-        raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName)
+        raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName, bbox = bbox)
 
     # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(FileName)
+    extent_raster = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     x_min = extent_raster[0]
     x_max = extent_raster[1]
@@ -664,7 +673,7 @@ def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gra
 
     # now get the tick marks
     n_target_tics = 5
-    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics)
+    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics,bbox = bbox)
 
     im1 = ax.imshow(raster[::-1], thiscmap, extent = extent_raster, interpolation="nearest")
 
@@ -728,7 +737,7 @@ def BasicDrapedPlotGridPlot(FileName, DrapeName, thiscmap='gray',drape_cmap='gra
 def DrapedOverHillshade(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
                             colorbarlabel='Elevation in meters',clim_val = (0,0),
                             drape_alpha = 0.6, ShowColorbar = False,
-                            ShowDrapeColorbar=False, drape_cbarlabel=None):
+                            ShowDrapeColorbar=False, drape_cbarlabel=None, bbox = None):
     """This creates a draped plot of a raster.
 
     It uses AxisGrid to ensure proper placment of the raster.
@@ -747,6 +756,7 @@ def DrapedOverHillshade(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
         drape_alpha (float): The alpha value (transparency) of the drape
         ShowColorbar (bool): Whether you want to show the colorbar
         drape_cbarlabel (str): The label of the drape colourbar
+        bbox (float list): If given, only this bounding box ([XMin, XMax, YMin, YMax], in map coordinates) of the rasters is read and plotted.
 
     Returns:
         A density plot of the draped raster
@@ -768,13 +778,13 @@ def DrapedOverHillshade(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
     rcParams['font.sans-serif'] = ['arial']
     rcParams['font.size'] = label_size
 
-    hillshade = Hillshade(FileName)
+    hillshade = Hillshade(FileName, bbox = bbox)
 
     # DAV - option to supply array directly (after masking for example, rather
     # than reading directly from a file. Should not break anyone's code)
     # (You can't overload functions in Python...)
     if isinstance(DrapeName, str):
-      raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName)
+      raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName, bbox = bbox)
     elif isinstance(DrapeName, np.ndarray):
       raster_drape = DrapeName
     else:
@@ -783,7 +793,7 @@ def DrapedOverHillshade(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
       or a numpy ndarray type. Please try again.')
 
     # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(FileName)
+    extent_raster = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     x_min = extent_raster[0]
     x_max = extent_raster[1]
@@ -815,7 +825,7 @@ def DrapedOverHillshade(FileName, DrapeName, thiscmap='gray',drape_cmap='gray',
 
     # now get the tick marks
     n_target_tics = 5
-    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics)
+    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics,bbox = bbox)
 
     im = grid[0].imshow(hillshade[::-1], thiscmap, extent = extent_raster, interpolation="nearest")
     #im = grid[0].imshow(raster, thiscmap, interpolation="nearest")
@@ -860,7 +870,8 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
                                    category_min_max, thiscmap='gray',
                                    drape_cmap='gray', clim_val=(0, 0),
                                    drape_alpha=0.6, ShowDrapeColorbar=False,
-                                   drape_cbarlabel=None, category_labels=None):
+                                   drape_cbarlabel=None, category_labels=None,
+                                   bbox=None):
     """This creates a draped plot of a categorical raster.
 
     It uses AxisGrid to ensure proper placment of the raster.
@@ -882,6 +893,7 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
         ShowDrapeColorbar (bool): Toggles the display of a categorical colorbar.
         drape_cbarlabel (str): The label of the drape colourbar.
         category_labels (list): List of strings used as category labels.
+        bbox (float list): If given, only this bounding box ([XMin, XMax, YMin, YMax], in map coordinates) of the rasters is read and plotted.
 
     Returns:
         A density plot of the draped categorical raster
@@ -900,13 +912,13 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
     rcParams['font.sans-serif'] = ['arial']
     rcParams['font.size'] = label_size
 
-    hillshade = Hillshade(FileName)
+    hillshade = Hillshade(FileName, bbox = bbox)
 
     # DAV - option to supply array directly (after masking for example, rather
     # than reading directly from a file. Should not break anyone's code)
     # (You can't overload functions in Python...)
     if isinstance(DrapeName, str):
-        raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName)
+        raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName, bbox = bbox)
     elif isinstance(DrapeName, np.ndarray):
         raster_drape = DrapeName
     else:
@@ -915,7 +927,7 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
                          ' or a numpy ndarray type. Please try again.')
 
     # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(FileName)
+    extent_raster = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     x_min = extent_raster[0]
     x_max = extent_raster[1]
@@ -952,7 +964,8 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
                                                               x_min,
                                                               y_max,
                                                               y_min,
-                                                              n_target_tics)
+                                                              n_target_tics,
+                                                              bbox=bbox)
 
     im = grid[0].imshow(hillshade[::-1], thiscmap, extent=extent_raster,
                         interpolation="nearest")
@@ -995,7 +1008,7 @@ def DrapedOverHillshade_Categories(FileName, DrapeName, nCategories,
 def DrapedOverFancyHillshade(FileName, HSName, DrapeName, thiscmap='gray',drape_cmap='gray',
                             colorbarlabel='Basin number',clim_val = (0,0),
                             drape_alpha = 0.6,FigFileName = 'Image.pdf',FigFormat = 'show',
-                            elevation_threshold = 0):
+                            elevation_threshold = 0, bbox = None):
     """This creates a draped plot of a raster. It uses AxisGrid to ensure proper placment of the raster. It also includes a hillshde to make the figure look nicer (so there are three raster layers). In this case you need to tell it the name of the hillshade raster.
 
     Args:
@@ -1010,6 +1023,7 @@ def DrapedOverFancyHillshade(FileName, HSName, DrapeName, thiscmap='gray',drape_
         FigFilename (str): The name of the figure (with extension)
         FigFormat (str): the format of the figure (e.g., jpg, png, pdf). If "show" then the figure is plotted to screen.
         elevation_threshold (float): If raster values are less than this threshold they become nodata.
+        bbox (float list): If given, only this bounding box ([XMin, XMax, YMin, YMax], in map coordinates) of the rasters is read and plotted.
 
     Returns:
         A density plot of the draped raster
@@ -1026,12 +1040,12 @@ def DrapedOverFancyHillshade(FileName, HSName, DrapeName, thiscmap='gray',drape_
     rcParams['font.size'] = label_size
 
     # get the data
-    raster = LSDMap_IO.ReadRasterArrayBlocks(FileName)
-    raster_HS = LSDMap_IO.ReadRasterArrayBlocks(HSName)
-    raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName)
+    raster = LSDMap_IO.ReadRasterArrayBlocks(FileName, bbox = bbox)
+    raster_HS = LSDMap_IO.ReadRasterArrayBlocks(HSName, bbox = bbox)
+    raster_drape = LSDMap_IO.ReadRasterArrayBlocks(DrapeName, bbox = bbox)
 
     # now get the extent
-    extent_raster = LSDMap_IO.GetRasterExtent(FileName)
+    extent_raster = LSDMap_IO.GetRasterWindowExtent(FileName, bbox = bbox)
 
     x_min = extent_raster[0]
     x_max = extent_raster[1]
@@ -1049,7 +1063,7 @@ def DrapedOverFancyHillshade(FileName, HSName, DrapeName, thiscmap='gray',drape_
 
     # now get the tick marks
     n_target_tics = 5
-    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics)
+    xlocs,ylocs,new_x_labels,new_y_labels = GetTicksForUTM(FileName,x_max,x_min,y_max,y_min,n_target_tics,bbox = bbox)
     im1 = ax.imshow(raster[::-1], thiscmap, extent = extent_raster, interpolation="nearest")
 
     # set the colour limits
@@ -1382,9 +1396,71 @@ def BasinsOverFancyHillshade(FileName, HSName, BasinName, Basin_csv_name, basin_
 
 
 
+#==============================================================================
+# Very large point sets (e.g. every channel node of a big DEM) are drawn as
+# an image of the points binned at the resolution of the figure, since a
+# scatter plot draws a marker for every point even if many fall in one pixel
+#==============================================================================
+# Point sets with more points than this are aggregated
+POINT_AGGREGATION_THRESHOLD = 200000
+
+def GetAxisWidthPixels(ax, dpi):
+    """This gets the number of pixels across an axis when its figure is saved.
+
+    Args:
+        ax (axis object): the matplotlib axis object
+        dpi (int): The resolution the figure is saved at
+
+    Returns:
+        int: The width of the axis in pixels
+    """
+    axis_width_inches = ax.get_position().width*ax.figure.get_figwidth()
+    return max(int(axis_width_inches*dpi),1)
+
+def PlotPointsOrAggregate(ax, x, y, values, extent, n_pixels, cmap,
+                          norm = None, method = "mean", aggregation_threshold = None,
+                          s = 0.5, alpha = 1):
+    """This draws points as a scatter plot, or if there are more points than the
+    aggregation threshold, as an image of the points binned into a grid with n_pixels
+    columns. The image looks the same as the scatter plot at that resolution
+    but it is much faster to draw and the files are much smaller.
+
+    Args:
+        ax (axis object): the matplotlib axis object
+        x (np.array): The x coordinates of the points
+        y (np.array): The y coordinates of the points
+        values (np.array): The data that is coloured
+        extent (float list): The extent of the axis as [XMin, XMax, YMin, YMax]
+        n_pixels (int): The number of pixels across the axis, e.g. from GetAxisWidthPixels
+        cmap (colourmap): The colourmap
+        norm (Normalize): The normalisation of the colours
+        method (str): How the points in each pixel are aggregated. See LSDMap_PointTools.AggregatePointsToGrid. Use "last" for categories.
+        aggregation_threshold (int): The number of points above which they are aggregated. None uses POINT_AGGREGATION_THRESHOLD.
+        s (float): The size of the points if they are not aggregated
+        alpha (float): The transparency
+
+    Returns:
+        The scatter plot or the image, e.g. for a colourbar
+    """
+    if aggregation_threshold is None:
+        aggregation_threshold = POINT_AGGREGATION_THRESHOLD
+
+    if len(x) <= aggregation_threshold:
+        return ax.scatter(x,y,s=s,c=values,cmap=cmap,norm=norm,edgecolors='none',alpha=alpha)
+
+    print("There are "+str(len(x))+" points so I am aggregating them into "+str(n_pixels)+" pixels across")
+    grid = LSDMap_PD.AggregatePointsToGrid(x, y, extent, n_pixels, values = values, method = method)
+    grid = np.ma.masked_invalid(grid)
+    # imshow would reset the aspect of the axes, which stretches maps, so the aspect is kept
+    return ax.imshow(grid, origin = "upper", extent = extent, cmap = cmap, norm = norm,
+                     interpolation = "nearest", alpha = alpha, aspect = ax.get_aspect())
+#==============================================================================
+
 #==============================================================================
 # Make a simple hillshade plot
-def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -9999,z_factor = 1):
+def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -9999,z_factor = 1,
+              window = None, bbox = None, multidirectional = False, scale_by_cellsize = False,
+              use_cache = True):
     """Creates a hillshade raster
 
     Args:
@@ -1392,6 +1468,12 @@ def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -99
         azimuth (float): Azimuth of sunlight
         angle_altitude (float): Angle altitude of sun
         NoDataValue (float): The nodata value of the raster
+        z_factor (float): The vertical exaggeration
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize) to read if raster_file is a filename.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax] to read if raster_file is a filename. Ignored if window is given.
+        multidirectional (bool): If true, combines hillshades lit from several directions.
+        scale_by_cellsize (bool): If true, and raster_file is a filename, the gradients use the cell size of the raster.
+        use_cache (bool): If true, and raster_file is a filename, the hillshade is kept in the derived raster cache (see LSDMap_BasicManipulation.SetDerivedRasterCache) so it is only computed once per DEM.
 
     Returns:
         HSArray (numpy.array): The hillshade array
@@ -1401,14 +1483,20 @@ def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -99
     """
 
     #print("The raster file is: "+raster_file)
+    cellsize = (1,1)
 
     # You have passed a filepath to be read in as a raster
     if isinstance(raster_file, str):
-      array = LSDMap_IO.ReadRasterArrayBlocks(raster_file,raster_band=1)
+      return LSDMap_BM.GetDerivedRaster(raster_file, "hillshade", azimuth, angle_altitude,
+                                        z_factor, multidirectional, scale_by_cellsize,
+                                        NoDataValue, window, bbox, use_cache)
 
     # You already have an array and just want the hill shade
     elif isinstance(raster_file, np.ndarray):
-      array = raster_file
+      # work on a copy so the caller's array isn't changed
+      array = np.array(raster_file, dtype = np.float32)
+      if scale_by_cellsize:
+          print("I can't get the cell size of an array, so the hillshade is in pixel units")
     else:
         print("raster_file must be either a filepath (string) or a numpy array. Try again.")
 
@@ -1416,21 +1504,8 @@ def Hillshade(raster_file, azimuth = 315, angle_altitude = 45, NoDataValue = -99
     nodata_mask = array == NoDataValue
     array[nodata_mask] = np.nan
 
-    x, y = np.gradient(array)
-    slope = np.pi/2. - np.arctan(np.multiply(z_factor,np.sqrt(x*x + y*y)))
-    aspect = np.arctan2(-x, y)
-    azimuthrad = azimuth*np.pi / 180.
-    altituderad = angle_altitude*np.pi / 180.
-
-
-    shaded = np.sin(altituderad) * np.sin(slope)\
-     + np.cos(altituderad) * np.cos(slope)\
-     * np.cos(azimuthrad - aspect)
-
-
-
-    #this_array = 255*(shaded + 1)/2
-    return 255*(shaded + 1)/2
+    return LSDMap_BM.HillshadeArray(array, azimuth, angle_altitude, z_factor,
+                                    cellsize, multidirectional)
 #==============================================================================
 
 
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+LSDMap_BatchDriver.py
+
+These functions run the plotting driver over many parameter files (e.g. one per
+catchment). The parameter files are run by a pool of worker processes, each job
+can be given a time limit and a memory cap, and every job is recorded in a job
+log. If a batch is killed or crashes, running it again with the same job log
+skips the jobs that finished and picks up the rest.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import string
+import sys
+import time
+import traceback
+
+#==============================================================================
+# These make the list of jobs
+#==============================================================================
+def ExpandParameterFiles(patterns):
+    """This turns a list of parameter file names and/or glob patterns into a list of parameter files.
+
+    Args:
+        patterns (str list): Parameter files, or patterns like "catchments/*/Params.param"
+
+    Returns:
+        str list: The parameter files, in the order given (each pattern is sorted), without repeats
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    param_files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            print("I didn't find any parameter files matching "+pattern)
+        for fname in matches:
+            fname = os.path.abspath(fname)
+            if fname not in param_files:
+                param_files.append(fname)
+    return param_files
+
+def WriteParameterFilesFromTemplate(template_file, catchment_table):
+    """This writes a parameter file for each row of a catchment table, by filling in a template.
+
+    The template is a normal parameter file with $column (or ${column}) wherever a value
+    should come from the table, e.g. "file_prefix: $prefix". Each row of the table
+    (a csv file with a header) makes one parameter file. The plotting driver looks for
+    the data in the directory of the parameter file, so if the table has a "directory"
+    column the parameter file is written there, otherwise it goes next to the template.
+
+    Args:
+        template_file (str): The template parameter file (with path and extension)
+        catchment_table (str): The csv file with one row per catchment
+
+    Returns:
+        str list: The parameter files that were written
+    """
+    with open(template_file, "r") as this_file:
+        template = string.Template(this_file.read())
+
+    template_dir = os.path.dirname(os.path.abspath(template_file))
+    template_root = os.path.splitext(os.path.basename(template_file))[0]
+
+    param_files = []
+    with open(catchment_table, "r") as table_file:
+        reader = csv.DictReader(table_file)
+        for row_number, row in enumerate(reader):
+            row = dict([(key.strip(), value.strip()) for key, value in row.items() if key is not None])
+
+            # name the file after the catchment
+            name = row.get("name", row.get("file_prefix", str(row_number)))
+            directory = row.get("directory", template_dir)
+            param_file = os.path.join(directory, template_root+"_"+name+".param")
+
+            contents = template.safe_substitute(row)
+            # Only write the file if it has changed, so an unchanged batch isn't rerun
+            if os.path.isfile(param_file):
+                with open(param_file, "r") as this_file:
+                    if this_file.read() == contents:
+                        param_files.append(os.path.abspath(param_file))
+                        continue
+            with open(param_file, "w") as this_file:
+                this_file.write(contents)
+            param_files.append(os.path.abspath(param_file))
+
+    print("I made "+str(len(param_files))+" parameter files from the template "+template_file)
+    return param_files
+#==============================================================================
+
+#==============================================================================
+# The job log is a text file with one json record per line. Records are only
+# ever appended, so a run that is killed can't leave a half written log.
+#==============================================================================
+def ReadJobLog(job_log):
+    """This reads the job log and gets the last status of each job.
+
+    Args:
+        job_log (str): The name of the job log
+
+    Returns:
+        dict: The last record of each job, keyed by parameter file. Empty if there is no log.
+    """
+    jobs = {}
+    if not os.path.isfile(job_log):
+        return jobs
+
+    with open(job_log, "r") as log_file:
+        for line in log_file:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may be cut off if the run was killed
+                print("Ignoring a broken line in the job log: "+line)
+                continue
+            jobs[record["job"]] = record
+    return jobs
+
+def GetParameterFileHash(param_file):
+    """This gets a hash of the contents of a parameter file, so a job can tell if its
+    parameter file has changed since it last ran.
+
+    Args:
+        param_file (str): The parameter file
+
+    Returns:
+        str: The md5 hash of the file, or None if it can't be read
+    """
+    try:
+        with open(param_file, "rb") as this_file:
+            return hashlib.md5(this_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+def _AppendJobLog(job_log, record):
+    """This appends a record to the job log and makes sure it is on disk.
+    """
+    record["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(job_log, "a") as log_file:
+        log_file.write(json.dumps(record, sort_keys = True)+"\n")
+        log_file.flush()
+        os.fsync(log_file.fileno())
+#==============================================================================
+
+#==============================================================================
+# These run the jobs
+#==============================================================================
+
+# The exit codes of the jobs, and the status they are logged as
+_JOB_EXIT_STATUS = {0: "done", 1: "failed", 2: "failed", 3: "out_of_memory"}
+
+def _RunBatchJob(param_file, force, plot_processes, memory_MB):
+    """This runs one parameter file. It is run in its own process, with its output
+    going to the parameter file name plus .log.
+    """
+    # The job leads its own process group, so if it is stopped its plotting
+    # processes are stopped with it (see _StopBatchJob)
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+    output_file = open(param_file+".log", "w")
+    sys.stdout = output_file
+    sys.stderr = output_file
+
+    # Cap the memory of the job. This only works on unix
+    if memory_MB is not None:
+        try:
+            import resource
+            memory_bytes = int(memory_MB*1024*1024)
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ImportError, ValueError) as error:
+            print("I can't limit the memory of this job: "+str(error))
+
+    exit_code = 0
+    try:
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg")
+        from LSDPlottingTools.LSDMap_PlottingDriver import LSDMap_PlottingDriver
+
+        PD = LSDMap_PlottingDriver(param_file)
+        PD.plot_data(n_processes = plot_processes, force = force)
+    except MemoryError:
+        traceback.print_exc()
+        exit_code = 3
+    except SystemExit:
+        # The driver exits if the parameter file is bad
+        traceback.print_exc()
+        exit_code = 2
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+
+    output_file.flush()
+    output_file.close()
+    sys.exit(exit_code)
+
+def _StopBatchJob(process):
+    """This stops a job and all the processes it started. On systems without process
+    groups (or if the job hasn't made its group yet) only the job itself is stopped.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (AttributeError, OSError):
+        process.terminate()
+    process.join()
+
+def _GetProcessContext():
+    """This gets what the job processes are made with: fork where there is fork,
+    otherwise spawn. Start methods are python 3 only; python 2 forks on unix anyway.
+    """
+    if not hasattr(multiprocessing, "get_context"):
+        return multiprocessing
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+def RunBatch(param_files, job_log, n_workers = None, timeout = None, memory_MB = None,
+             force = False, retry_failed = True, plot_processes = 1):
+    """This runs the plotting driver on a list of parameter files with a pool of worker processes.
+
+    Each job runs in its own process, so a job that crashes, runs out of memory or
+    runs past its time limit doesn't stop the others. Every job start and finish is
+    appended to the job log. If the batch is run again with the same log, jobs that
+    finished are skipped, so a killed batch picks up where it stopped. A finished job
+    is run again if its parameter file has changed since (the log keeps a hash of it).
+
+    Args:
+        param_files (str list): The parameter files (see ExpandParameterFiles and WriteParameterFilesFromTemplate)
+        job_log (str): The name of the job log
+        n_workers (int): The number of jobs run at the same time. If None, one per cpu.
+        timeout (float): The time limit of each job in seconds. If None there is no limit.
+        memory_MB (float): The memory cap of each job in megabytes (unix only). If None there is no cap.
+        force (bool): If True, every figure of every job is remade and finished jobs are run again.
+        retry_failed (bool): If True, jobs that failed (or timed out) last time are run again.
+        plot_processes (int): The number of processes each job uses to make its figures.
+
+    Returns:
+        dict: The status of each job: "done", "failed", "timeout", "out_of_memory" or "skipped" (done in an earlier run)
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(int(n_workers), 1)
+    param_files = [os.path.abspath(param_file) for param_file in param_files]
+
+    # Work out which jobs still need to run
+    previous = ReadJobLog(job_log)
+    statuses = {}
+    pending = []
+    param_hashes = {}
+    for param_file in param_files:
+        param_hashes[param_file] = GetParameterFileHash(param_file)
+        last_record = previous.get(param_file, {})
+        last_status = last_record.get("status")
+        if last_status == "done" and last_record.get("param_hash") != param_hashes[param_file]:
+            print("The parameter file "+param_file+" has changed, so it will run again")
+            last_status = None
+        if not force and last_status == "done":
+            statuses[param_file] = "skipped"
+        elif not force and not retry_failed and last_status not in [None, "started"]:
+            # the job failed last time and isn't retried, so it keeps that status
+            statuses[param_file] = last_status
+        else:
+            pending.append(param_file)
+    print("There are "+str(len(param_files))+" jobs, "+str(len(pending))+" of them need to run.")
+
+    context = _GetProcessContext()
+
+    running = {}
+    try:
+        while len(pending) > 0 or len(running) > 0:
+
+            # start jobs until all the workers are busy
+            while len(pending) > 0 and len(running) < n_workers:
+                param_file = pending.pop(0)
+                process = context.Process(target = _RunBatchJob,
+                                          args = (param_file, force, plot_processes, memory_MB))
+                process.start()
+                running[param_file] = (process, time.time())
+                _AppendJobLog(job_log, {"job": param_file, "status": "started",
+                                        "param_hash": param_hashes[param_file]})
+                print("Started "+param_file)
+
+            # check on the running jobs
+            for param_file in list(running.keys()):
+                process, start_time = running[param_file]
+                run_time = time.time()-start_time
+                if process.is_alive():
+                    if timeout is None or run_time < timeout:
+                        continue
+                    _StopBatchJob(process)
+                    status = "timeout"
+                else:
+                    process.join()
+                    status = _JOB_EXIT_STATUS.get(process.exitcode, "failed")
+
+                del running[param_file]
+                statuses[param_file] = status
+                _AppendJobLog(job_log, {"job": param_file, "status": status, "param_hash": param_hashes[param_file],
+                                        "exit_code": process.exitcode, "run_time": round(run_time, 1)})
+                print("Finished "+param_file+": "+status+" after "+str(round(run_time, 1))+" s")
+
+            time.sleep(0.1)
+    finally:
+        # If the batch is interrupted the running jobs are stopped; they are
+        # logged as started but not finished, so they run again next time
+        for param_file in running:
+            _StopBatchJob(running[param_file][0])
+
+    n_done = len([s for s in statuses.values() if s in ["done", "skipped"]])
+    print("The batch is finished: "+str(n_done)+" of "+str(len(param_files))+" jobs are done.")
+    return statuses
+#==============================================================================
@@ -37,8 +37,7 @@ def ConvertBasinIndexToJunction(BasinPointData,BasinIndexList):
 
 
 
-    these_data = BasinPointData.QueryData("outlet_junction")
-    these_data = [int(x) for x in these_data]
+    these_data = np.asarray(BasinPointData.QueryData("outlet_junction"), dtype=int)
 
     #print("The junctions are: ")
 
@@ -68,56 +67,31 @@ def FindSourceInformation(thisPointData):
     """
 
     # Get the chi, m_chi, basin number, and source ID code
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    fdist = thisPointData.QueryData('flow distance')
-    fdist = [float(x) for x in fdist]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
-    latitude = thisPointData.GetLatitude()
-    longitude = thisPointData.GetLongitude()
-
-
-
-
-    Chi = np.asarray(chi)
-    Elevation = np.asarray(elevation)
-    Fdist = np.asarray(fdist)
-    Source = np.asarray(source)
-    Latitude = np.asarray(latitude)
-    Longitude = np.asarray(longitude)
-
-    n_sources = Source.max()+1
-    print("N sources is: "+str(n_sources))
-
-    # This loops through all the source indices, and then picks out the
-    # Elevation, chi coordinate and flow distance of each node
+    Chi = np.asarray(thisPointData.QueryData('chi'), dtype=float)
+    Elevation = np.asarray(thisPointData.QueryData('elevation'), dtype=float)
+    Fdist = np.asarray(thisPointData.QueryData('flow distance'), dtype=float)
+    Latitude = np.asarray(thisPointData.GetLatitude())
+    Longitude = np.asarray(thisPointData.GetLongitude())
+
+    # This finds the nodes with the highest and lowest chi in every source in one go,
+    # and then picks out the elevation, chi coordinate and flow distance of the nodes.
     # Then it returns a dictionary containing the elements of the node
-    these_source_nodes = {}
-    for src_idx in range(0,n_sources):
-        m = np.ma.masked_where(Source!=src_idx, Source)
+    sources,idx_of_min_Chi,idx_of_max_FD = thisPointData.GetGroupArgMinMax('source_key','chi')
+    print("N sources is: "+str(len(sources)))
 
-        # Mask the unwanted values
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskFlowDistance = np.ma.masked_where(np.ma.getmask(m), Fdist)
-        maskLatitude = np.ma.masked_where(np.ma.getmask(m), Latitude)
-        maskLongitude= np.ma.masked_where(np.ma.getmask(m), Longitude)
+    these_source_nodes = {}
+    for src_idx,min_idx,max_idx in zip(sources.tolist(),idx_of_min_Chi,idx_of_max_FD):
 
         # get the locations of the source
         this_dict = {}
-        idx_of_max_FD = maskX.argmax()
-        this_dict["FlowDistance"]=maskFlowDistance[idx_of_max_FD]
-        this_dict["Chi"]=maskX[idx_of_max_FD]
-        this_dict["Elevation"]=maskElevation[idx_of_max_FD]
-        this_dict["Latitude"]=maskLatitude[idx_of_max_FD]
-        this_dict["Longitude"]=maskLongitude[idx_of_max_FD]
+        this_dict["FlowDistance"]=Fdist[max_idx]
+        this_dict["Chi"]=Chi[max_idx]
+        this_dict["Elevation"]=Elevation[max_idx]
+        this_dict["Latitude"]=Latitude[max_idx]
+        this_dict["Longitude"]=Longitude[max_idx]
 
         # get the minimum of the source
-        idx_of_min_Chi = maskX.argmin()
-        chi_length = maskX[idx_of_max_FD]-maskX[idx_of_min_Chi]
+        chi_length = Chi[max_idx]-Chi[min_idx]
         this_dict["SourceLength"]=chi_length
 
         these_source_nodes[src_idx] = this_dict
@@ -274,9 +248,8 @@ def BasicChiPlotGridPlotKirby(FileName, DrapeName, chi_csv_fname, thiscmap='gray
     Ncoord = np.subtract(extent_raster[3],Ncoord)
     Ncoord = np.add(Ncoord,extent_raster[2])
 
-    M_chi = thisPointData.QueryData('m_chi')
+    M_chi = np.asarray(thisPointData.QueryData('m_chi'), dtype=float)
     #print M_chi
-    M_chi = [float(x) for x in M_chi]
 
 
     # make a color map of fixed colors
@@ -429,8 +402,7 @@ def BasicChiPlotGridPlot(FileName, DrapeName, chi_csv_fname, thisPointData, this
     Ncoord = np.subtract(extent_raster[3],Ncoord)
     Ncoord = np.add(Ncoord,extent_raster[2])
 
-    M_chi = thisPointData.QueryData('m_chi')
-    M_chi = [float(x) for x in M_chi]
+    M_chi = np.asarray(thisPointData.QueryData('m_chi'), dtype=float)
 
 
     log_m_chi = []
@@ -479,7 +451,7 @@ def BasicChiCoordinatePlot(FileName, DrapeName, csvfile, thiscmap='gray',drape_c
                             colorbarlabel='$\chi (m)$',clim_val = (0,0),
                             basin_order_list = [], basin_point_data = "None", basin_raster_name = "None",
                             drape_alpha = 0.6,FigFileName = 'Image.pdf',FigFormat = 'show',
-                            size_format = "ESURF"):
+                            size_format = "ESURF", aggregation_threshold = None):
 
     """This plots the chi coordinate, mimicking Sean Willet et al's plots
 
@@ -498,6 +470,7 @@ def BasicChiCoordinatePlot(FileName, DrapeName, csvfile, thiscmap='gray',drape_c
         FigFileName (str): The name of the figure file
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        aggregation_threshold (int): If there are more channel points than this they are drawn as an image at the resolution of the figure. None uses LSDMap_BP.POINT_AGGREGATION_THRESHOLD.
 
     Returns:
         Prints a plot to file.
@@ -616,13 +589,14 @@ def BasicChiCoordinatePlot(FileName, DrapeName, csvfile, thiscmap='gray',drape_c
     Ncoord = np.subtract(extent_raster[3],Ncoord)
     Ncoord = np.add(Ncoord,extent_raster[2])
 
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
+    chi = np.asarray(thisPointData.QueryData('chi'), dtype=float)
 
 
     #this_cmap = 'brg_r'
     this_cmap = 'CMRmap_r'
-    sc = ax.scatter(easting,Ncoord,s=0.5, c=chi,cmap=this_cmap,edgecolors='none')
+    n_pixels = LSDMap_BP.GetAxisWidthPixels(ax, 750)
+    sc = LSDMap_BP.PlotPointsOrAggregate(ax, easting, Ncoord, chi, extent_raster, n_pixels, this_cmap,
+                                         aggregation_threshold = aggregation_threshold)
 
     # set the colour limits
     sc.set_clim(0, np.nanmax(chi))
@@ -780,9 +754,8 @@ def BasicChannelPlotGridPlotCategories(FileName, DrapeName, chi_csv_fname, thisc
     Ncoord = np.subtract(extent_raster[3],Ncoord)
     Ncoord = np.add(Ncoord,extent_raster[2])
 
-    these_data = thisPointData.QueryData(data_name)
+    these_data = np.asarray(thisPointData.QueryData(data_name), dtype=int)
     #print M_chi
-    these_data = [int(x) for x in these_data]
 
     # make a color map of fixed colors
     NUM_COLORS = 15
@@ -790,7 +763,7 @@ def BasicChannelPlotGridPlotCategories(FileName, DrapeName, chi_csv_fname, thisc
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
     plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-    channel_data = [x % NUM_COLORS for x in these_data]
+    channel_data = these_data % NUM_COLORS
 
     ax.scatter(easting,Ncoord,s=0.5, c=channel_data,norm=cNorm,cmap=this_cmap,edgecolors='none')
 
@@ -819,7 +792,7 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
                             drape_alpha = 0.6,FigFileName = 'Image.pdf',FigFormat = 'show',
                             elevation_threshold = 0, basin_key = 0, data_name = 'source_key',
                             source_thinning_threshold = 0,
-                            size_format = "ESURF"):
+                            size_format = "ESURF", aggregation_threshold = None):
     """This plots the channels over a draped plot, colour coded by source. It masks the data so that the channels
     are only plotted for a specific basin of interest, specified by the basin key from the chi csv file.
 
@@ -839,6 +812,7 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
         data_name (str) = The name of the sources csv
         source_thinning_threshold (float) = Minimum chi length of a source segment. No thinning if 0.
         size_format (str): Can be "big" (16 inches wide), "geomorphology" (6.25 inches wide), or "ESURF" (4.92 inches wide) (defualt esurf).
+        aggregation_threshold (int): If there are more channel points than this they are drawn as an image at the resolution of the figure. None uses LSDMap_BP.POINT_AGGREGATION_THRESHOLD.
 
     Returns:
         Prints a plot to file.
@@ -924,13 +898,9 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
     EPSG_string = LSDMap_IO.GetUTMEPSG(FileName)
     print("EPSG string is: " + EPSG_string)
 
-    thisPointData = LSDMap_PD.LSDMap_PointData(chi_csv_fname)
-
-    # mask for the basin
-    thisPointData.ThinDataSelection("basin_key",basin_key)
-
-    # thin elevation points below the threshold
-    thisPointData.ThinData('elevation',elevation_threshold)
+    # only the points in the basin and above the elevation threshold are loaded
+    thisPointData = GetChiPointData(chi_csv_fname, ranges = {"elevation": (elevation_threshold, None)},
+                                    selections = {"basin_key": basin_key})
 
     # Logic for thinning the sources
     if source_thinning_threshold > 0:
@@ -947,9 +917,8 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
     Ncoord = np.subtract(extent_raster[3],Ncoord)
     Ncoord = np.add(Ncoord,extent_raster[2])
 
-    these_data = thisPointData.QueryData(data_name)
+    these_data = np.asarray(thisPointData.QueryData(data_name), dtype=int)
     #print M_chi
-    these_data = [int(x) for x in these_data]
 
     # make a color map of fixed colors
     NUM_COLORS = 15
@@ -957,9 +926,12 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
     plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-    channel_data = [x % NUM_COLORS for x in these_data]
+    channel_data = these_data % NUM_COLORS
 
-    ax.scatter(easting,Ncoord,s=0.5, c=channel_data,norm=cNorm,cmap=this_cmap,edgecolors='none')
+    # the sources are categories, so an aggregated pixel takes the colour of its last point, like the scatter plot
+    n_pixels = LSDMap_BP.GetAxisWidthPixels(ax, 500)
+    LSDMap_BP.PlotPointsOrAggregate(ax, easting, Ncoord, channel_data, extent_raster, n_pixels, this_cmap,
+                                    norm = cNorm, method = "last", aggregation_threshold = aggregation_threshold)
 
     # This affects all axes because we set share_all = True.
     ax.set_xlim(x_min,x_max)
@@ -978,6 +950,41 @@ def BasicChannelPlotByBasin(FileName, DrapeName, chi_csv_fname, thiscmap='gray',
         plt.savefig(FigFileName,format=FigFormat,dpi=500)
         fig.clf()
 
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## This gets point data for the profile plots without rereading the csv
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+def GetChiPointData(chi_csv_fname, ranges = None, selections = None, chunked = False):
+    """This gets the point data used by the chi profile plots. You can pass it
+    either the name of a csv file or an LSDMap_PointData object you have already
+    loaded. In the latter case you get a copy back, so the plotting functions can
+    thin it without changing your data and you don't need to reload the csv.
+
+    A csv file is loaded through its binary cache (which is written the first time
+    the file is read) and the ranges and selections are applied to the cached columns.
+    If chunked is True and there is no cache, the csv file is read a chunk at a time
+    and only the points that pass the tests are kept, so big files don't need to fit in memory.
+
+    Args:
+        chi_csv_fname (str or LSDMap_PointData): The name (with full path and extension) of the csv file with chi information, or the point data itself.
+        ranges (dict): column name: (minimum, maximum), e.g. {"elevation": (elevation_threshold, None)}. See LSDMap_PointTools.ReadFilteredCSV.
+        selections (dict): column name: list of values, e.g. {"basin_key": [0]}
+        chunked (bool): If true, a csv file without a cache is read in chunks rather than all at once
+
+    Returns:
+        LSDMap_PointData: Point data that can be thinned freely
+    """
+    if isinstance(chi_csv_fname, LSDMap_PD.LSDMap_PointData):
+        return chi_csv_fname.GetFilteredCopy(ranges, selections)
+    elif chunked:
+        return LSDMap_PD.LoadFilteredPointData(chi_csv_fname, ranges = ranges, selections = selections)
+    else:
+        # This reads the cache if there is one, and writes it if there isn't
+        thisPointData = LSDMap_PD.LSDMap_PointData(chi_csv_fname)
+        if (ranges or selections) and len(thisPointData.VariableList) > 0:
+            thisPointData._ApplyMask(LSDMap_PD._PredicateMask(thisPointData.PointData, ranges, selections))
+        return thisPointData
+
+
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 ## This function plots channels, color coded
 ##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -991,7 +998,7 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
     """This function plots the chi vs elevation: lumps everything onto the same axis. This tends to make a mess.
 
     Args:
-        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool.
+        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool. Can also be an LSDMap_PointData object, which is not modified.
         FigFileName (str): The name of the figure file
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         basin_order_list (int list): The basins to plot
@@ -1034,8 +1041,7 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
     gs = plt.GridSpec(100,100,bottom=0.25,left=0.1,right=1.0,top=1.0)
     ax = fig.add_subplot(gs[25:100,10:95])
 
-    thisPointData = LSDMap_PD.LSDMap_PointData(chi_csv_fname)
-    thisPointData.ThinData('elevation',elevation_threshold)
+    thisPointData = GetChiPointData(chi_csv_fname, ranges = {"elevation": (elevation_threshold, None)})
 
     # Logic for thinning the sources
     if source_thinning_threshold > 0:
@@ -1052,23 +1058,15 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
 
 
     # Get the chi, m_chi, basin number, and source ID code
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    fdist = thisPointData.QueryData('flow distance')
-    fdist = [float(x) for x in fdist]
-    m_chi = thisPointData.QueryData('m_chi')
-    m_chi = [float(x) for x in m_chi]
-    basin = thisPointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
-
-    segments = thisPointData.QueryData('segment_number')
-    segments = [int(x) for x in segments]
-    segmented_elevation = thisPointData.QueryData('segmented_elevation')
-    segmented_elevation = [float(x) for x in segmented_elevation]
+    chi = np.asarray(thisPointData.QueryData('chi'), dtype=float)
+    elevation = np.asarray(thisPointData.QueryData('elevation'), dtype=float)
+    fdist = np.asarray(thisPointData.QueryData('flow distance'), dtype=float)
+    m_chi = np.asarray(thisPointData.QueryData('m_chi'), dtype=float)
+    basin = np.asarray(thisPointData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(thisPointData.QueryData('source_key'), dtype=int)
+
+    segments = np.asarray(thisPointData.QueryData('segment_number'), dtype=int)
+    segmented_elevation = np.asarray(thisPointData.QueryData('segmented_elevation'), dtype=float)
 
     # Some booleans that tell if there are segments and segmented elevation
     have_segments = False
@@ -1115,7 +1113,7 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
 
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
-    Basin_colors = [x % NUM_COLORS for x in Basin]
+    Basin_colors = Basin % NUM_COLORS
 
 
     dot_pos = FigFileName.rindex('.')
@@ -1133,43 +1131,32 @@ def ChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',FigFormat = 'show',
 
         print(("This basin is: " +str(basin_number)))
 
-        m = np.ma.masked_where(Basin!=basin_number, Basin)
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
+        # The nodes in this basin come from the group index, so we don't need to mask every node
+        basin_rows = thisPointData.GetGroupRows('basin_key',basin_number)
+        maskX = Chi[basin_rows]
         if plot_M_chi:
-            maskElevation = np.ma.masked_where(np.ma.getmask(m), M_chi)
+            maskElevation = M_chi[basin_rows]
         else:
-            maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
+            maskElevation = Elevation[basin_rows]
 
-        maskBasin = np.ma.masked_where(np.ma.getmask(m), Basin_colors)
-        maskSource = np.ma.masked_where(np.ma.getmask(m), Source)
+        maskBasin = Basin_colors[basin_rows]
+        maskSource = Source[basin_rows]
 
         if(have_segmented_elevation):
-            # We need to loop through the sources.
-            # We can do that by converting the sources to a set and then looping through the set
-            sources_list = maskSource.tolist()
-            myset = set(sources_list)
+            # We need to loop through the sources in this basin
+            sources_list = np.unique(maskSource).tolist()
             print("The sources are: ")
-            print(myset)
-            sources_list = list(myset)
+            print(sources_list)
             for source in sources_list:
-                m_mask = np.ma.masked_where(Source!=source, Source)
-                mask_maskX = np.ma.masked_where(np.ma.getmask(m_mask), Chi)
-                maskSegmentedElevation = np.ma.masked_where(np.ma.getmask(m_mask), Segmented_elevation)
-                a_line, = ax.plot(mask_maskX,maskSegmentedElevation,'b',alpha = 0.6)
+                source_rows = thisPointData.GetGroupRows('source_key',source)
+                a_line, = ax.plot(Chi[source_rows],Segmented_elevation[source_rows],'b',alpha = 0.6)
                 a_line.set_dashes([3,1])
 
 
         # logic for source labeling
         if label_sources:
 
-            # Convert the masked data to a list and then that list to a set and
-            # back to a list (phew!)
-            list_source = maskSource.tolist()
-            set_source = set(list_source)
-            list_source = list(set_source)
-
-            # Now we have to get rid of stupid non values
-            list_source = [x for x in list_source if x is not None]
+            list_source = np.unique(maskSource).tolist()
 
             print("these sources are: ")
             print(list_source)
@@ -1239,7 +1226,7 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     """This function plots the chi vs elevation: It stacks profiles (so the basins are spaced out) and colours them by the source number.
 
     Args:
-        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool.
+        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool. Can also be an LSDMap_PointData object, which is not modified.
         FigFileName (str): The name of the figure file
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         elevation_threshold (float): elevation_threshold chi points below this elevation are removed from plotting.
@@ -1282,9 +1269,8 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     gs = plt.GridSpec(100,100,bottom=0.25,left=0.1,right=1.0,top=1.0)
     ax = fig.add_subplot(gs[25:100,10:95])
 
-    thisPointData = LSDMap_PD.LSDMap_PointData(chi_csv_fname)
-    thisPointData.ThinData('elevation',elevation_threshold)
-    thisPointData.ThinData('chi',0)
+    thisPointData = GetChiPointData(chi_csv_fname, ranges = {"elevation": (elevation_threshold, None),
+                                                             "chi": (0, None)})
 
     # Thin the sources.
     if source_thinning_threshold > 0:
@@ -1295,18 +1281,12 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
         thisPointData.ThinDataSelection("source_key",remaining_sources)
 
     # Get the chi, m_chi, basin number, and source ID code
-    chi = thisPointData.QueryData('chi')
-    chi = [float(x) for x in chi]
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    fdist = thisPointData.QueryData('flow distance')
-    fdist = [float(x) for x in fdist]
-    m_chi = thisPointData.QueryData('m_chi')
-    m_chi = [float(x) for x in m_chi]
-    basin = thisPointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
+    chi = np.asarray(thisPointData.QueryData('chi'), dtype=float)
+    elevation = np.asarray(thisPointData.QueryData('elevation'), dtype=float)
+    fdist = np.asarray(thisPointData.QueryData('flow distance'), dtype=float)
+    m_chi = np.asarray(thisPointData.QueryData('m_chi'), dtype=float)
+    basin = np.asarray(thisPointData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(thisPointData.QueryData('source_key'), dtype=int)
 
     # need to convert everything into arrays so we can mask different basins
     Chi = np.asarray(chi)
@@ -1361,7 +1341,7 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     this_cmap = plt.cm.Set1
     cNorm  = colors.Normalize(vmin=0, vmax=NUM_COLORS-1)
     #scalarMap = plt.cm.ScalarMappable(norm=cNorm, cmap=this_cmap)
-    Source_colors = [x % NUM_COLORS for x in Source]
+    Source_colors = Source % NUM_COLORS
     plt.hold(True)
 
     # Logic for stacked labels. You need to run this after source thinning to
@@ -1372,6 +1352,9 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
     dot_pos = FigFileName.rindex('.')
     newFilename = FigFileName[:dot_pos]+'_Stack'+str(first_basin)+FigFileName[dot_pos:]
 
+    # This gets reset to the end of the last basin
+    chi_axis_max = X_axis_max
+
     texts = []
     # Format the bounding box of source labels
     bbox_props = dict(boxstyle="round,pad=0.1", fc="w", ec="b", lw=0.5,alpha = 0.5)
@@ -1380,10 +1363,15 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
 
         print(("This basin is: " +str(basin_number)))
 
-        m = np.ma.masked_where(Basin!=basin_number, Basin)
-        maskX = np.ma.masked_where(np.ma.getmask(m), Chi)
-        maskElevation = np.ma.masked_where(np.ma.getmask(m), Elevation)
-        maskSource = np.ma.masked_where(np.ma.getmask(m), Source_colors)
+        basin_rows = thisPointData.GetGroupRows('basin_key',basin_number)
+        if len(basin_rows) == 0:
+            print("There are no nodes in this basin, skipping it")
+            this_X_offset = this_X_offset+X_offset
+            continue
+
+        maskX = Chi[basin_rows]
+        maskElevation = Elevation[basin_rows]
+        maskSource = Source_colors[basin_rows]
 
         print(("adding an offset of: "+str(this_X_offset)))
 
@@ -1419,14 +1407,7 @@ def StackedChiProfiles(chi_csv_fname, FigFileName = 'Image.pdf',
         # logic for source labeling
         if label_sources:
 
-            # Convert the masked data to a list and then that list to a set and
-            # back to a list (phew!)
-            list_source = maskSource.tolist()
-            set_source = set(list_source)
-            list_source = list(set_source)
-
-            # Now we have to get rid of stupid non values
-            list_source = [x for x in list_source if x is not None]
+            list_source = np.unique(Source[basin_rows]).tolist()
 
             print("these sources are: ")
             print(list_source)
@@ -1492,7 +1473,7 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
     It colours the plots by the chi steepness (which is equal to the normalised channel steepness if A_0 is set to 1).
 
     Args:
-        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool.
+        chi_csv_fname (str): The name (with full path and extension) of the cdv file with chi, chi slope, etc information. This file is produced by the chi_mapping_tool. Can also be an LSDMap_PointData object, which is not modified.
         FigFileName (str): The name of the figure file
         FigFormat (str): The format of the figure. Usually 'png' or 'pdf'. If "show" then it calls the matplotlib show() command.
         elevation_threshold (float): elevation_threshold chi points below this elevation are removed from plotting.
@@ -1516,7 +1497,7 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
 
     import math
     import matplotlib.patches as patches
-    from adjust_text import adjust_text
+    from .adjust_text import adjust_text
 
     label_size = 10
 
@@ -1539,9 +1520,8 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
     gs = plt.GridSpec(100,100,bottom=0.15,left=0.1,right=1.0,top=1.0)
     ax = fig.add_subplot(gs[25:100,10:95])
 
-    thisPointData = LSDMap_PD.LSDMap_PointData(chi_csv_fname)
-    thisPointData.ThinData('elevation',elevation_threshold)
-    thisPointData.ThinData('chi',0)
+    thisPointData = GetChiPointData(chi_csv_fname, ranges = {"elevation": (elevation_threshold, None),
+                                                             "chi": (0, None)})
 
     # Thin the sources. Do this after the colouring so that thinned source colours
     # will be the same as unthinned source colours.
@@ -1556,24 +1536,17 @@ def StackedProfilesGradient(chi_csv_fname, FigFileName = 'Image.pdf',
 
     # Get the chi, m_chi, basin number, and source ID code
     if data_name  == 'chi':
-        x_data = thisPointData.QueryData('chi')
-        x_data = [float(x) for x in x_data]
+        x_data = np.asarray(thisPointData.QueryData('chi'), dtype=float)
     elif data_name == 'flow_distance':
-        x_data = thisPointData.QueryData('flow distance')
-        x_data = [float(x) for x in x_data]
+        x_data = np.asarray(thisPointData.QueryData('flow distance'), dtype=float)
     else:
         print("I did not understand the data name. Choices are chi and flow distance. Defaulting to chi.")
-        x_data = thisPointData.QueryData('chi')
-        x_data = [float(x) for x in x_data]
-
-    elevation = thisPointData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    m_chi = thisPointData.QueryData('m_chi')
-    m_chi = [float(x) for x in m_chi]
-    basin = thisPointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = thisPointData.QueryData('source_key')
-    source = [int(x) for x in source]
+        x_data = np.asarray(thisPointData.QueryData('chi'), dtype=float)
+
+    elevation = np.asarray(thisPointData.QueryData('elevation'), dtype=float)
+    m_chi = np.asarray(thisPointData.QueryData('m_chi'), dtype=float)
+    basin = np.asarray(thisPointData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(thisPointData.QueryData('source_key'), dtype=int)
 
     colorbarlabel = "$k_{sn}$"
     if (plotting_data_format == 'log'):
@@ -1845,14 +1818,10 @@ def SlopeAreaPlot(PointData, DataDirectory, FigFileName = 'Image.pdf',
     ax = fig.add_subplot(gs[25:100,10:95])
 
     # Get the slope, drainage area, basin ID and source ID
-    slope = PointData.QueryData('slope')
-    slope = [float(x) for x in slope]
-    area = PointData.QueryData('drainage area')
-    area = [float(x) for x in area]
-    basin = PointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = PointData.QueryData('source_key')
-    source = [int(x) for x in source]
+    slope = np.asarray(PointData.QueryData('slope'), dtype=float)
+    area = np.asarray(PointData.QueryData('drainage area'), dtype=float)
+    basin = np.asarray(PointData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(PointData.QueryData('source_key'), dtype=int)
 
     # need to convert everything into arrays so we can mask different basins
     Slope = np.asarray(slope)
@@ -1947,24 +1916,16 @@ def BinnedSlopeAreaPlot(PointData, DataDirectory, FigFileName = 'Image.pdf',
     ax = fig.add_subplot(gs[25:100,10:95])
 
     # Get the slope, drainage area, basin ID and source ID
-    mean_log_S = PointData.QueryData('mean_log_S')
-    mean_log_S = [float(10**x) for x in mean_log_S]
-    median_log_S = PointData.QueryData('median_log_S')
-    median_log_S = [float(10**x) for x in median_log_S]
-    mean_log_A = PointData.QueryData('mean_log_A')
-    mean_log_A = [float(10**x) for x in mean_log_A]
-    midpoints_A = PointData.QueryData('midpoints_log_A')
-    midpoints_A = [float(10**x) for x in midpoints_A]
-    basin = PointData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = PointData.QueryData('source_key')
-    source = [int(x) for x in source]
+    mean_log_S = np.power(10, np.asarray(PointData.QueryData('mean_log_S'), dtype=float))
+    median_log_S = np.power(10, np.asarray(PointData.QueryData('median_log_S'), dtype=float))
+    mean_log_A = np.power(10, np.asarray(PointData.QueryData('mean_log_A'), dtype=float))
+    midpoints_A = np.power(10, np.asarray(PointData.QueryData('midpoints_log_A'), dtype=float))
+    basin = np.asarray(PointData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(PointData.QueryData('source_key'), dtype=int)
 
     # get the errors
-    log_S_sterr = PointData.QueryData('logS_stdErr')
-    log_S_sterr = [float(10**x) for x in log_S_sterr]
-    log_A_sterr = PointData.QueryData('logA_stdErr')
-    log_A_sterr = [float(10**x) for x in log_A_sterr]
+    log_S_sterr = np.power(10, np.asarray(PointData.QueryData('logS_stdErr'), dtype=float))
+    log_A_sterr = np.power(10, np.asarray(PointData.QueryData('logA_stdErr'), dtype=float))
 
     # need to convert everything into arrays so we can mask different basins
     MeanLogSlope = np.asarray(mean_log_S)
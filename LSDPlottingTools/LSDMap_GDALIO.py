@@ -11,10 +11,137 @@ import osgeo.gdal as gdal
 import osgeo.gdal_array as gdal_array
 import numpy as np
 from osgeo import osr
+import os
+import json
+from collections import namedtuple
 from os.path import exists
 from osgeo.gdalconst import GA_ReadOnly
 
 
+#==============================================================================
+# The metadata of rasters is cached so that a file is only opened once to get
+# its georeferencing, no matter how many of the helpers below ask for it. The
+# cache is keyed on the path and checked against the modification time and
+# size of the file (and its header, if it has one), so a changed raster is reread.
+#==============================================================================
+
+# An immutable record of the metadata of a raster
+RasterInfo = namedtuple("RasterInfo", ["FileName", "NDV", "xsize", "ysize", "GeoT",
+                                       "ProjectionWkt", "DataType", "EPSG", "Extent", "CellSize"])
+
+_RasterInfoCache = {}
+
+def _RasterFileStamp(FileName):
+    """This gets the modification times and sizes of a raster and its header. 
+    Returns None if the file can't be stat-ed (e.g. a gdal virtual file), in which case it isn't cached.
+    """
+    try:
+        this_stat = os.stat(FileName)
+        stamp = (this_stat.st_mtime, this_stat.st_size)
+        header_name = GetHeaderFileName(FileName)
+        if header_name is not None:
+            header_stat = os.stat(header_name)
+            stamp = stamp+(header_stat.st_mtime, header_stat.st_size)
+    except OSError:
+        return None
+    return stamp
+
+def _EPSGFromWkt(wkt):
+    """This gets the UTM EPSG string ('epsg:326XX' or 'epsg:327XX') from the projection of a raster.
+    
+    Args:
+        wkt (str): The projection as well known text
+        
+    Return:
+        str: The EPSG string, or 'NULL' if the projection isn't UTM
+    """
+    EPSG_string = 'NULL'
+    srs=osr.SpatialReference(wkt=wkt)
+    proj_str = srs.GetAttrValue(str('projcs'))
+    
+    if proj_str != None:        
+        # extract the UTM information
+        proj_split = proj_str.split('_')
+        zone = proj_split[-1]
+    
+        N_or_S = zone[-1] 
+        zone = zone[:-1]
+        
+        EPSG_string = 'epsg:'
+        if N_or_S == 'S':
+            EPSG_string = EPSG_string+'327'+zone
+        else:
+            EPSG_string = EPSG_string+'326'+zone
+    
+    return EPSG_string
+
+def GetRasterInfo(FileName):
+    """This gets the metadata of a raster. The raster is only opened the first time
+    (or if it has changed since), after that the metadata comes from a cache.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        
+    Return:
+        RasterInfo: A named tuple with:
+            * FileName: the filename
+            * NDV: the nodata value of band 1
+            * xsize: the number of columns
+            * ysize: the number of rows
+            * GeoT: the geotransform
+            * ProjectionWkt: the projection as well known text
+            * DataType: the name of the data type of band 1
+            * EPSG: the UTM EPSG string, or 'NULL'
+            * Extent: [XMin, XMax, YMin, YMax]
+            * CellSize: the cell size
+    """
+    if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')    
+    
+    key = os.path.abspath(FileName)
+    stamp = _RasterFileStamp(FileName)
+    if stamp is not None and key in _RasterInfoCache:
+        cached_stamp, info = _RasterInfoCache[key]
+        if cached_stamp == stamp:
+            return info
+    
+    SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
+    if SourceDS == None:
+        raise Exception("Unable to read the data file")
+    
+    band = SourceDS.GetRasterBand(1)
+    NDV = band.GetNoDataValue()
+    xsize = SourceDS.RasterXSize
+    ysize = SourceDS.RasterYSize
+    GeoT = tuple(SourceDS.GetGeoTransform())
+    ProjectionWkt = SourceDS.GetProjectionRef()
+    DataType = gdal.GetDataTypeName(band.DataType)
+    
+    CellSize = GeoT[1]
+    XMin = GeoT[0]
+    XMax = XMin+CellSize*xsize
+    YMax = GeoT[3]
+    YMin = YMax-CellSize*ysize
+    
+    info = RasterInfo(FileName, NDV, xsize, ysize, GeoT, ProjectionWkt, DataType,
+                      _EPSGFromWkt(ProjectionWkt), (XMin,XMax,YMin,YMax), CellSize)
+    if stamp is not None:
+        _RasterInfoCache[key] = (stamp, info)
+    return info
+
+def ClearRasterInfoCache(FileName = None):
+    """This empties the raster metadata cache, or just removes one raster from it.
+    
+    Args:
+        FileName (str): The raster to forget. If None, the whole cache is emptied.
+    """
+    if FileName is None:
+        _RasterInfoCache.clear()
+    else:
+        _RasterInfoCache.pop(os.path.abspath(FileName), None)
+#==============================================================================  
+
+
 #==============================================================================
 def getNoDataValue(rasterfn):
     """This gets the nodata value from the raster
@@ -28,9 +155,7 @@ def getNoDataValue(rasterfn):
     Author: SMM
     """
     
-    raster = gdal.Open(rasterfn)
-    band = raster.GetRasterBand(1)
-    return band.GetNoDataValue()
+    return GetRasterInfo(rasterfn).NDV
 #==============================================================================  
 
 #==============================================================================
@@ -48,6 +173,7 @@ def setNoDataValue(rasterfn):
 
     raster = gdal.Open(rasterfn)
     band = raster.GetRasterBand(1)
+    ClearRasterInfoCache(rasterfn)
     return band.SetNoDataValue()
 #==============================================================================  
 
@@ -74,15 +200,10 @@ def GetUTMMaxMin(FileName):
     if exists(FileName) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')    
     
-    NDV, xsize, ysize, GeoT, Projection, DataType = GetGeoInfo(FileName)
-    CellSize = GeoT[1]
-    XMin = GeoT[0]
-    XMax = XMin+CellSize*xsize
-
-    YMax = GeoT[3]
-    YMin = YMax-CellSize*ysize
+    info = GetRasterInfo(FileName)
+    XMin,XMax,YMin,YMax = info.Extent
     
-    return CellSize,XMin,XMax,YMin,YMax
+    return info.CellSize,XMin,XMax,YMin,YMax
 #==============================================================================    
 
 #============================================================================== 
@@ -249,20 +370,11 @@ def GetGeoInfo(FileName):
             raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')    
     
     
-    SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
-    if SourceDS == None:
-        raise Exception("Unable to read the data file")
-    
-    NDV = SourceDS.GetRasterBand(1).GetNoDataValue()
-    xsize = SourceDS.RasterXSize
-    ysize = SourceDS.RasterYSize
-    GeoT = SourceDS.GetGeoTransform()
+    info = GetRasterInfo(FileName)
     Projection = osr.SpatialReference()
-    Projection.ImportFromWkt(SourceDS.GetProjectionRef())
-    DataType = SourceDS.GetRasterBand(1).DataType
-    DataType = gdal.GetDataTypeName(DataType)
+    Projection.ImportFromWkt(info.ProjectionWkt)
     
-    return NDV, xsize, ysize, GeoT, Projection, DataType
+    return info.NDV, info.xsize, info.ysize, info.GeoT, Projection, info.DataType
 #==============================================================================
 
 #==============================================================================
@@ -281,44 +393,8 @@ def GetUTMEPSG(FileName):
     if exists(FileName) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')    
     
-    # see if the file exists and get the dataset
-    SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
-    if SourceDS == None:
-        raise Exception("Unable to read the data file")
-    
-    EPSG_string = 'NULL'
-    
-    # get the projection
     print("Let me get that projection for you")
-    prj=SourceDS.GetProjection()
-    srs=osr.SpatialReference(wkt=prj)
-
-    if srs.IsProjected:
-        #print("Trying projcs")
-        #print(str(srs.GetAttrValue(str('PROJCS'),0)))
-        
-        print(srs.GetAttrValue(str('projcs')))
-        proj_str = srs.GetAttrValue(str('projcs'))
-
-
-        if proj_str != None:        
-            # extract the UTM information
-            proj_split = proj_str.split('_')
-            zone = proj_split[-1]
-        
-            N_or_S = zone[-1] 
-            zone = zone[:-1]
-    
-        
-            EPSG_string = 'epsg:'
-            if N_or_S == 'S':
-                EPSG_string = EPSG_string+'327'+zone
-            else:
-                EPSG_string = EPSG_string+'326'+zone        
-    else:
-        raise Exception("This is not a projected coordinate system!")
-    
-
+    EPSG_string = GetRasterInfo(FileName).EPSG
     
     print(EPSG_string)
     return EPSG_string
@@ -363,10 +439,7 @@ def CheckNoData(FileName):
         raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')   
 
     # read the file, and check if there is a no data value
-    SourceDS = gdal.Open(FileName, gdal.GA_ReadOnly)
-    if SourceDS == None:
-        raise Exception("Unable to read the data file")
-    NoDataValue = SourceDS.GetRasterBand(1).GetNoDataValue()
+    NoDataValue = GetRasterInfo(FileName).NDV
     
     print("In the check nodata routine. Nodata is: ")
     print(NoDataValue)
@@ -390,6 +463,7 @@ def CheckNoData(FileName):
                 this_file.write("%s" % item)        # no newline since a newline command character comes with the lines
 
             this_file.close()
+            ClearRasterInfoCache(FileName)
             
     NDV, xsize, ysize, GeoT, Projection, DataType = GetGeoInfo(FileName)
     
@@ -399,11 +473,202 @@ def CheckNoData(FileName):
 
 
 #==============================================================================
-def ReadRasterArrayBlocks(raster_file,raster_band=1):
-    """This reads a raster file (from GDAL) into an array. The "blocks" bit makes it efficient. 
+def _GetPixelWindow(dataset, window = None, bbox = None):
+    """This works out the pixel window of a GDAL dataset that should be read. 
+    
+    Args:
+        dataset (gdal.Dataset): An open GDAL dataset
+        window (int tuple): A pixel window as (xoff, yoff, xsize, ysize). Offsets are from the upper left corner.
+        bbox (float list): A bounding box in map coordinates as [XMin, XMax, YMin, YMax] (same ordering as GetRasterExtent). Ignored if a window is given.
+        
+    Return:
+        int tuple: The window (xoff, yoff, xsize, ysize), clipped to the raster
+    """
+    return _PixelWindow(dataset.RasterXSize, dataset.RasterYSize, dataset.GetGeoTransform(), window, bbox)
+
+def _PixelWindow(xsize, ysize, GeoT, window = None, bbox = None):
+    """This works out a pixel window from the size and geotransform of a raster. See _GetPixelWindow.
+    """
+    if window is None and bbox is None:
+        return 0, 0, xsize, ysize
+    
+    if window is None:
+        x_cellsize = abs(GeoT[1])
+        y_cellsize = abs(GeoT[5])
+        
+        # snap outwards so that the window covers all of the bounding box
+        xoff = int(np.floor((bbox[0]-GeoT[0])/x_cellsize))
+        xend = int(np.ceil((bbox[1]-GeoT[0])/x_cellsize))
+        yoff = int(np.floor((GeoT[3]-bbox[3])/y_cellsize))
+        yend = int(np.ceil((GeoT[3]-bbox[2])/y_cellsize))
+    else:
+        xoff = int(window[0])
+        yoff = int(window[1])
+        xend = xoff+int(window[2])
+        yend = yoff+int(window[3])
+    
+    # clip to the raster
+    xoff = max(xoff,0)
+    yoff = max(yoff,0)
+    xend = min(xend,xsize)
+    yend = min(yend,ysize)
+    
+    if xend <= xoff or yend <= yoff:
+        raise Exception("The requested window does not overlap the raster")
+    
+    return xoff, yoff, xend-xoff, yend-yoff
+#==============================================================================
+
+#==============================================================================
+def BBoxToPixelWindow(FileName, bbox):
+    """This converts a bounding box in map coordinates into a pixel window of the raster. 
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        bbox (float list): The bounding box as [XMin, XMax, YMin, YMax]
+        
+    Return:
+        int tuple: The window (xoff, yoff, xsize, ysize), snapped outwards to whole pixels and clipped to the raster
+    """
+    info = GetRasterInfo(FileName)
+    return _PixelWindow(info.xsize, info.ysize, info.GeoT, bbox = bbox)
+#==============================================================================
+
+#==============================================================================
+def GetRasterWindowExtent(FileName, window = None, bbox = None):
+    """This gets the extent of a window of the raster. Use it for the imshow extent of windowed reads.
+
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        window (int tuple): A pixel window as (xoff, yoff, xsize, ysize).
+        bbox (float list): A bounding box in map coordinates as [XMin, XMax, YMin, YMax]
+        
+    Return:
+        float: A vector that contains
+        
+            * extent[0]: XMin
+            * extent[1]: XMax
+            * extent[2]: YMin
+            * extent[3]: YMax           
+    """  
+    if window is None and bbox is None:
+        return GetRasterExtent(FileName)
+    
+    info = GetRasterInfo(FileName)
+    xoff, yoff, win_xsize, win_ysize = _PixelWindow(info.xsize, info.ysize, info.GeoT, window, bbox)
+    
+    GeoT = info.GeoT
+    CellSize = GeoT[1]
+    XMin = GeoT[0]+xoff*CellSize
+    XMax = XMin+win_xsize*CellSize
+    YMax = GeoT[3]-yoff*CellSize
+    YMin = YMax-win_ysize*CellSize
+    
+    return [XMin,XMax,YMin,YMax]
+#==============================================================================
+
+#==============================================================================
+def _ReadBandWindow(band, xoff, yoff, win_xsize, win_ysize, decimation = 1, dtype = None,
+                    resampling = "nearest"):
+    """This reads a window of a GDAL band in a single call. GDAL does the 
+    decimation while reading (using overviews if the raster has them) so only 
+    the pixels that are needed are touched.
+    
+    Args:
+        band (gdal.Band): The band to read from
+        xoff, yoff, win_xsize, win_ysize (int): The pixel window
+        decimation (int): Keep every nth pixel in each direction
+        dtype (numpy dtype): If None the native type of the band is kept, otherwise GDAL converts to this type as it reads.
+        resampling (str): "nearest" or "average". How decimated pixels are computed. Use nearest for categorical data.
+        
+    Return:
+        np.array: The data in the window
+    """
+    decimation = max(int(decimation),1)
+    buf_xsize = int(np.ceil(win_xsize/decimation))
+    buf_ysize = int(np.ceil(win_ysize/decimation))
+    
+    # If the raster has overviews, read from the coarsest one that still has
+    # at least the resolution we need, with the window scaled to match
+    if decimation > 1:
+        band, factor = _GetBestOverview(band, decimation)
+        if factor > 1:
+            xend = min(int(np.ceil((xoff+win_xsize)/factor)),band.XSize)
+            yend = min(int(np.ceil((yoff+win_ysize)/factor)),band.YSize)
+            xoff = xoff//factor
+            yoff = yoff//factor
+            win_xsize = max(xend-xoff,1)
+            win_ysize = max(yend-yoff,1)
+    
+    kwargs = {}
+    if decimation > 1 and resampling == "average":
+        kwargs["resample_alg"] = gdal.GRIORA_Average
+    
+    if dtype is None:
+        return band.ReadAsArray(xoff, yoff, win_xsize, win_ysize, buf_xsize, buf_ysize, **kwargs)
+    else:
+        data_array = np.empty((buf_ysize,buf_xsize), dtype = dtype)
+        band.ReadAsArray(xoff, yoff, win_xsize, win_ysize, buf_xsize, buf_ysize, buf_obj = data_array, **kwargs)
+        return data_array
+#==============================================================================
+
+#==============================================================================
+def ReadRasterArrayWindow(raster_file, raster_band = 1, window = None, bbox = None, 
+                          decimation = 1, dtype = None, resampling = "nearest"):
+    """This reads a raster (or part of a raster) into a masked array, keeping the native data type. 
+    
+    Nodata is returned as the mask of the array rather than being converted to nan, 
+    so integer rasters stay integer and nothing is upcast to float64.
+    
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster (almost all uses with LSDTopoTools will have a 1 band raster)
+        window (int tuple): A pixel window as (xoff, yoff, xsize, ysize). If None the whole raster is read.
+        bbox (float list): A bounding box in map coordinates as [XMin, XMax, YMin, YMax]. Ignored if a window is given.
+        decimation (int): Read every nth pixel in each direction (1 reads at full resolution)
+        dtype (numpy dtype): If None, the band's type is kept. Otherwise, for example np.float32, the data is converted while reading.
+        resampling (str): "nearest" or "average". How decimated pixels are computed.
+        
+    Return:
+        np.ma.MaskedArray: The data, with nodata masked. 
+    """  
+    if exists(raster_file) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')    
+    
+    dataset = gdal.Open(raster_file, GA_ReadOnly )
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+    
+    xoff, yoff, win_xsize, win_ysize = _GetPixelWindow(dataset, window, bbox)
+    data_array = _ReadBandWindow(band, xoff, yoff, win_xsize, win_ysize, decimation, dtype, resampling)
+    
+    if NoDataValue is not None:
+        nodata_mask = data_array == NoDataValue
+    else:
+        nodata_mask = np.ma.nomask
+    
+    return np.ma.MaskedArray(data_array, mask = nodata_mask, copy = False)
+#==============================================================================
+
+#==============================================================================
+def ReadRasterArrayBlocks(raster_file,raster_band=1, window = None, bbox = None, decimation = 1,
+                          resampling = "nearest"):
+    """This reads a raster file (from GDAL) into an array. 
+    
+    The data is read straight into a float array in one pass (there is no statistics pass) 
+    and nodata is converted to nan. Use ReadRasterArrayWindow if you want to keep the native
+    type of the raster and a nodata mask. 
+    
     Args:
         FileName (str): The filename (with path and extension) of the raster.
         raster_band (int): the band of the raster (almost all uses with LSDTopoTools will have a 1 band raster)
+        window (int tuple): A pixel window as (xoff, yoff, xsize, ysize). If None the whole raster is read.
+        bbox (float list): A bounding box in map coordinates as [XMin, XMax, YMin, YMax]. Ignored if a window is given.
+        decimation (int): Read every nth pixel in each direction (1 reads at full resolution)
+        resampling (str): "nearest" or "average". How decimated pixels are computed.
         
     Return:
         np.array: A numpy array with the data from the raster. 
@@ -415,66 +680,837 @@ def ReadRasterArrayBlocks(raster_file,raster_band=1):
     if exists(raster_file) is False:
             raise Exception('[Errno 2] No such file or directory: \'' + raster_file + '\'')    
     
+    # If the raster has been shared, copy (or decimate) it from memory rather than reading it again
+    shared_array = _GetSharedRasterArray(raster_file, raster_band)
+    if shared_array is not None:
+        info = GetRasterInfo(raster_file)
+        xoff, yoff, win_xsize, win_ysize = _PixelWindow(info.xsize, info.ysize, info.GeoT, window, bbox)
+        print("I am using the shared copy of "+raster_file)
+        shared_window = shared_array[yoff:yoff+win_ysize,xoff:xoff+win_xsize]
+        if decimation <= 1:
+            return shared_window.copy()
+        return _DecimateArray(shared_window, decimation, resampling)
+    
     dataset = gdal.Open(raster_file, GA_ReadOnly )
     if dataset == None:
         raise Exception("Unable to read the data file")
     
     band = dataset.GetRasterBand(raster_band)
-    NoDataValue = dataset.GetRasterBand(1).GetNoDataValue()
+    NoDataValue = band.GetNoDataValue()
+
+    xoff, yoff, win_xsize, win_ysize = _GetPixelWindow(dataset, window, bbox)
+    print("xsize: " +str(win_xsize)+" and y size: " + str(win_ysize))
+    
+    data_array = _ReadBandWindow(band, xoff, yoff, win_xsize, win_ysize, decimation, np.float64, resampling)
+ 
+    print("NoData is:", NoDataValue)
+    if NoDataValue is not None:
+        nodata_mask = data_array == NoDataValue
+        data_array[nodata_mask] = np.nan
+           
+    return data_array
+#==============================================================================
+
+#==============================================================================
+# Rasters that are used by several figures can be read once and shared. 
+# ReadRasterArrayBlocks then copies from the shared array rather than reading
+# the file again. Processes forked after a raster is shared inherit it, so 
+# they don't read the file either.
+#==============================================================================
+_SharedRasterArrays = {}
+
+def _SharedRasterKey(raster_file, raster_band):
+    """This gets the key of a raster in the shared arrays.
+    """
+    return (os.path.abspath(raster_file), raster_band)
+
+def _GetSharedRasterArray(raster_file, raster_band = 1):
+    """This gets the shared array of a raster, or None if it isn't shared (or the file has changed since).
+    """
+    key = _SharedRasterKey(raster_file, raster_band)
+    if key not in _SharedRasterArrays:
+        return None
+    
+    stamp, data_array = _SharedRasterArrays[key]
+    if stamp != _RasterFileStamp(raster_file):
+        del _SharedRasterArrays[key]
+        return None
+    return data_array
+
+def _DecimateArray(data_array, decimation, resampling = "nearest"):
+    """This decimates an array in memory the way GDAL decimates while reading (see
+    _ReadBandWindow): the result has ceil(size/decimation) pixels in each direction,
+    and each pixel is either the nearest pixel to its centre or the average of the
+    pixels it covers, leaving out nan.
+
+    Args:
+        data_array (np.array): The array, with nodata as nan
+        decimation (int): Keep every nth pixel in each direction
+        resampling (str): "nearest" or "average"
+
+    Return:
+        np.array: The decimated array (a new array)
+    """
+    decimation = max(int(decimation),1)
+    n_rows, n_cols = data_array.shape
+    buf_ysize = int(np.ceil(n_rows/decimation))
+    buf_xsize = int(np.ceil(n_cols/decimation))
+
+    if resampling != "average":
+        rows = np.minimum(((np.arange(buf_ysize)+0.5)*n_rows/buf_ysize).astype(np.int64), n_rows-1)
+        cols = np.minimum(((np.arange(buf_xsize)+0.5)*n_cols/buf_xsize).astype(np.int64), n_cols-1)
+        return data_array[np.ix_(rows, cols)]
+
+    # The first pixel covered by each output pixel, in each direction
+    row_starts = np.floor(np.arange(buf_ysize)*n_rows/buf_ysize).astype(np.int64)
+    col_starts = np.floor(np.arange(buf_xsize)*n_cols/buf_xsize).astype(np.int64)
+    valid = np.isfinite(data_array)
+    totals = np.where(valid, data_array, 0).astype(np.float64)
+    totals = np.add.reduceat(np.add.reduceat(totals, row_starts, axis = 0), col_starts, axis = 1)
+    counts = np.add.reduceat(np.add.reduceat(valid.astype(np.int64), row_starts, axis = 0), col_starts, axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return np.where(counts > 0, totals/counts, np.nan).astype(data_array.dtype)
+
+def ShareRasterArray(raster_file, raster_band = 1):
+    """This reads a raster into memory so that later calls to ReadRasterArrayBlocks
+    (for the whole raster or a window of it, at full resolution or decimated, as
+    MapFigure reads it) don't read the file again.
+    
+    Args:
+        raster_file (str): The filename (with path and extension) of the raster.
+        raster_band (int): the band of the raster
+        
+    Return:
+        np.array: The shared array. Don't change it: readers get copies of it.
+    """
+    data_array = _GetSharedRasterArray(raster_file, raster_band)
+    if data_array is None:
+        stamp = _RasterFileStamp(raster_file)
+        data_array = ReadRasterArrayBlocks(raster_file, raster_band)
+        data_array.flags.writeable = False
+        if stamp is not None:
+            _SharedRasterArrays[_SharedRasterKey(raster_file, raster_band)] = (stamp, data_array)
+    return data_array
+
+def ClearSharedRasterArrays(raster_file = None):
+    """This frees the shared rasters.
+    
+    Args:
+        raster_file (str): The raster to free. If None all of them are freed.
+    """
+    if raster_file is None:
+        _SharedRasterArrays.clear()
+    else:
+        path = os.path.abspath(raster_file)
+        for key in list(_SharedRasterArrays.keys()):
+            if key[0] == path:
+                del _SharedRasterArrays[key]
+#==============================================================================
+
+#==============================================================================
+# These build and use overviews (reduced resolution copies of a raster). 
+# LSDTopoTools writes ENVI rasters with no overviews, so without them every 
+# decimated read still has to touch every pixel of the raster.
+#==============================================================================
+def _GetOverviewFactor(band, overview):
+    """This gets the (integer) decimation of an overview of a band.
+    """
+    return max(int(round(band.XSize/overview.XSize)),1)
+
+def _GetBestOverview(band, decimation):
+    """This gets the coarsest overview of a band that is no coarser than the decimation. 
+    
+    Args:
+        band (gdal.Band): The full resolution band
+        decimation (int): The decimation of the read
+        
+    Return:
+        (gdal.Band, int): The band to read from and its decimation. This is the band itself, with a decimation of 1, if no overview is suitable. 
+    """
+    best_band = band
+    best_factor = 1
+    for i in range(band.GetOverviewCount()):
+        overview = band.GetOverview(i)
+        if overview is None:
+            continue
+        factor = _GetOverviewFactor(band, overview)
+        if best_factor < factor <= decimation:
+            best_band = overview
+            best_factor = factor
+    return best_band, best_factor
+
+def GetOverviewFactors(FileName, raster_band = 1):
+    """This gets the decimations of the overviews of a raster.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        raster_band (int): The band of the raster
+        
+    Return:
+        int list: The decimation of each overview, e.g. [2,4,8]. Empty if the raster has no overviews.
+    """
+    if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
+    
+    dataset = gdal.Open(FileName, GA_ReadOnly)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    
+    band = dataset.GetRasterBand(raster_band)
+    factors = []
+    for i in range(band.GetOverviewCount()):
+        factors.append(_GetOverviewFactor(band, band.GetOverview(i)))
+    return sorted(factors)
 
-    block_sizes = band.GetBlockSize()
-    x_block_size = block_sizes[0]
-    y_block_size = block_sizes[1]
+def GetOverviewResampling(FileName):
+    """This gets the resampling used to build overviews: mode for integer
+    rasters (basins, lithologies and other categories) and average for everything else.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        
+    Return:
+        str: "MODE" or "AVERAGE"
+    """
+    if GetDisplayResampling(FileName) == "nearest":
+        return "MODE"
+    else:
+        return "AVERAGE"
 
-    #If the block y size is 1, as in a GeoTIFF image, the gradient can't be calculated, 
-    #so more than one block is used. In this case, using8 lines gives a similar 
-    #result as taking the whole array.
-    if y_block_size < 8:
-        y_block_size = 8
+def BuildOverviews(FileName, levels = None, resampling = None, external = True,
+                   min_size = 256, n_threads = None):
+    """This builds a power of two pyramid of overviews for a raster. Readers in this
+    module (and MapFigure) then automatically read from the best overview for the 
+    decimation they need, so zoomed out plots of very large rasters load quickly. 
+    
+    GDAL computes the overviews: the tiles of each level are computed in parallel
+    using n_threads (this needs GDAL >= 3.2; older versions use one thread).
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        levels (int list): The decimations of the overviews. If None, powers of two are used until the raster is smaller than min_size pixels on its shorter side.
+        resampling (str): The GDAL resampling, e.g. "AVERAGE", "MODE", "NEAREST". If None, mode is used for integer rasters and average for all others.
+        external (bool): If True, the overviews are written to a separate .ovr file (needed for ENVI rasters). If False they are written into the file, for formats (like GTiff) that support it.
+        min_size (int): The size of the coarsest overview if levels is None
+        n_threads (int): The number of threads. If None, all cpus are used.
+        
+    Return:
+        int list: The levels that were built
+    """
+    if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
+    
+    info = GetRasterInfo(FileName)
+    if levels is None:
+        levels = []
+        factor = 2
+        while min(info.xsize,info.ysize)//factor >= min_size:
+            levels.append(factor)
+            factor = factor*2
+    levels = sorted(set([int(level) for level in levels if int(level) > 1]))
+    if len(levels) == 0:
+        print("The raster "+FileName+" is too small to need overviews")
+        return levels
+    
+    if resampling is None:
+        resampling = GetOverviewResampling(FileName)
+    if n_threads is None:
+        n_threads = "ALL_CPUS"
+    
+    # Opening read only means GDAL writes an external .ovr file
+    if external:
+        dataset = gdal.Open(FileName, GA_ReadOnly)
+    else:
+        dataset = gdal.Open(FileName, gdal.GA_Update)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    
+    print("Building overviews "+str(levels)+" of "+FileName+" with "+resampling+" resampling")
+    # The number of threads is set for this thread only, so BuildOverviewsForFiles
+    # can build several rasters at once without the threads changing each other's setting.
+    # Older GDAL without thread local options just uses its default.
+    thread_local = hasattr(gdal, "SetThreadLocalConfigOption")
+    if thread_local:
+        old_n_threads = gdal.GetThreadLocalConfigOption("GDAL_NUM_THREADS", None)
+        gdal.SetThreadLocalConfigOption("GDAL_NUM_THREADS", str(n_threads))
+    try:
+        err = dataset.BuildOverviews(resampling.upper(), levels)
+    finally:
+        if thread_local:
+            gdal.SetThreadLocalConfigOption("GDAL_NUM_THREADS", old_n_threads)
+    dataset = None
+    
+    if err != 0:
+        raise Exception("GDAL was unable to build the overviews of "+FileName)
+    return levels
 
-    xsize = band.XSize
-    ysize = band.YSize
+def BuildOverviewsForFiles(FileList, n_threads = None, **kwargs):
+    """This builds overviews for several rasters (e.g. a DEM and its drapes) at the same time. 
     
-    print("xsize: " +str(xsize)+" and y size: " + str(ysize))
+    Args:
+        FileList (str list): The filenames (with path and extension) of the rasters.
+        n_threads (int): The number of rasters to work on at once. If None, one per cpu.
+        kwargs: Passed to BuildOverviews
+        
+    Return:
+        dict: The levels that were built for each file
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+    
+    if n_threads is None:
+        n_threads = cpu_count()
+    n_threads = max(min(int(n_threads),len(FileList)),1)
+    
+    # GDAL releases the GIL while it computes, so threads are enough.
+    # Each file gets one thread so the pool isn't oversubscribed
+    kwargs["n_threads"] = 1 if n_threads > 1 else None
+    def build(FileName):
+        return BuildOverviews(FileName, **kwargs)
+    
+    pool = ThreadPool(n_threads)
+    try:
+        all_levels = pool.map(build, FileList)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(FileList, all_levels))
+#==============================================================================
 
-    max_value = band.GetMaximum()
-    min_value = band.GetMinimum()
+#==============================================================================
+# These get the statistics of rasters (and of lists of rasters) without 
+# reading them into memory. The statistics of each raster are kept in a 
+# sidecar file (the raster name plus .stats.json), so they are only worked out
+# once for each version of the raster.
+#==============================================================================
+def GetStatsSidecarName(FileName):
+    """This gets the name of the statistics sidecar of a raster.
+    """
+    return FileName+".stats.json"
+
+def _ReadStatsSidecar(FileName, raster_band):
+    """This reads the statistics of a band from the sidecar. Returns an empty dict
+    if there is no sidecar or the raster has changed since it was written.
+    """
+    stamp = _RasterFileStamp(FileName)
+    sidecar_name = GetStatsSidecarName(FileName)
+    if stamp is None or not exists(sidecar_name):
+        return {}
+    try:
+        with open(sidecar_name, "r") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+    except (ValueError, IOError):
+        return {}
+    if sidecar.get("stamp") != list(stamp):
+        return {}
+    return sidecar.get("bands", {}).get(str(raster_band), {})
+
+def _WriteStatsSidecar(FileName, raster_band, stats):
+    """This writes the statistics of a band to the sidecar. 
+    """
+    stamp = _RasterFileStamp(FileName)
+    if stamp is None:
+        return
+    sidecar_name = GetStatsSidecarName(FileName)
+    
+    bands = {}
+    if exists(sidecar_name):
+        try:
+            with open(sidecar_name, "r") as sidecar_file:
+                sidecar = json.load(sidecar_file)
+            if sidecar.get("stamp") == list(stamp):
+                bands = sidecar.get("bands", {})
+        except (ValueError, IOError):
+            pass
+    bands[str(raster_band)] = stats
+    
+    # The sidecar is written to a temporary file first so it is never half written.
+    # If the directory can't be written to, the statistics just aren't kept
+    temp_name = sidecar_name+".tmp"+str(os.getpid())
+    try:
+        with open(temp_name, "w") as sidecar_file:
+            json.dump({"stamp": list(stamp), "bands": bands}, sidecar_file, indent = 1)
+        if os.name == "nt" and exists(sidecar_name):
+            os.remove(sidecar_name)
+        os.rename(temp_name, sidecar_name)
+    except (IOError, OSError):
+        print("I could not write the statistics sidecar "+sidecar_name)
+
+def _ValidValues(block, NoDataValue):
+    """This gets the values of a block that aren't nodata or nan.
+    """
+    valid = np.isfinite(block)
+    if NoDataValue is not None:
+        valid &= block != NoDataValue
+    return block[valid]
+
+def _IterateBandValues(FileName, raster_band = 1, approximate = False, block_rows = 1024):
+    """This reads a raster in blocks of rows and yields the valid values of each block. 
+    If approximate is True and the raster has overviews, the coarsest overview is read instead.
+    """
+    if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
     
-    # now initiate the array
-    data_array = np.zeros((ysize,xsize))
+    dataset = gdal.Open(FileName, GA_ReadOnly)
+    if dataset == None:
+        raise Exception("Unable to read the data file")
+    band = dataset.GetRasterBand(raster_band)
+    NoDataValue = band.GetNoDataValue()
+    
+    if approximate and band.GetOverviewCount() > 0:
+        band, factor = _GetBestOverview(band, max(band.XSize, band.YSize))
+    
+    block_rows = max(int(block_rows),1)
+    for first_row in range(0, band.YSize, block_rows):
+        n_rows = min(block_rows, band.YSize-first_row)
+        block = _ReadBandWindow(band, 0, first_row, band.XSize, n_rows, dtype = np.float64)
+        yield _ValidValues(block, NoDataValue)
+
+def _GetStoredBandStatistics(FileName, raster_band):
+    """This gets the statistics that GDAL has stored for a band (e.g. in a .aux.xml file), 
+    or None if there are none. 
+    """
+    dataset = gdal.Open(FileName, GA_ReadOnly)
+    if dataset == None:
+        return None
+    band = dataset.GetRasterBand(raster_band)
     
-    #print "data shape is: " 
-    #print data_array.shape
+    stored = {}
+    for key in ["MINIMUM", "MAXIMUM", "MEAN"]:
+        value = band.GetMetadataItem("STATISTICS_"+key)
+        if value is None:
+            return None
+        stored[key.lower()] = float(value)
+    stored["approximate"] = band.GetMetadataItem("STATISTICS_APPROXIMATE") == "YES"
+    return stored
+
+def _HistogramPercentiles(histogram, value_min, value_max, percentiles):
+    """This interpolates percentiles from a histogram with equal bins between value_min and value_max.
+    """
+    n_bins = len(histogram)
+    bin_width = (value_max-value_min)/n_bins
+    cumulative = np.cumsum(histogram)
+    count = cumulative[-1]
+    
+    values = {}
+    for percentile in percentiles:
+        if count == 0:
+            values["percentile_"+str(percentile)] = np.nan
+            continue
+        rank = count*percentile/100.
+        h_bin = int(np.argmax(cumulative >= rank))
+        below = cumulative[h_bin]-histogram[h_bin]
+        fraction = (rank-below)/max(histogram[h_bin],1)
+        values["percentile_"+str(percentile)] = float(min(max(value_min+(h_bin+fraction)*bin_width, value_min), value_max))
+    return values
+
+def _RasterHistogram(FileName, raster_band, value_min, value_max, n_bins, approximate, block_rows):
+    """This gets the histogram of a raster, with n_bins equal bins between value_min and value_max.
+    """
+    histogram = np.zeros(n_bins, dtype = np.int64)
+    if not value_max > value_min:
+        value_max = value_min+1
+    for values in _IterateBandValues(FileName, raster_band, approximate, block_rows):
+        h_bins = np.clip(((values-value_min)*(n_bins/(value_max-value_min))).astype(np.int64), 0, n_bins-1)
+        histogram += np.bincount(h_bins, minlength = n_bins)
+    return histogram
 
-    if max_value == None or min_value == None:
-        stats = band.GetStatistics(0, 1)
-        max_value = stats[1]
-        min_value = stats[0]
+def GetRasterStatistics(FileName, raster_band = 1, approximate = False, block_rows = 1024):
+    """This gets the minimum, maximum, mean and number of valid pixels of a raster.
+    
+    Statistics that are already known are used: first the sidecar, then any statistics 
+    GDAL has stored for the band. Otherwise the raster is read in blocks of rows, so 
+    it never has to fit in memory. If approximate is True, approximate stored 
+    statistics are accepted and rasters with overviews are measured from their 
+    coarsest overview.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        raster_band (int): The band of the raster
+        approximate (bool): Whether approximate statistics are good enough
+        block_rows (int): The number of rows read at a time
         
-    for i in range(0, ysize, y_block_size):
-        if i + y_block_size < ysize:
-            rows = y_block_size
+    Return:
+        dict: With the keys min, max, mean, count and approximate. count is None if it came from GDAL's stored statistics.
+    """
+    stats = _ReadStatsSidecar(FileName, raster_band)
+    if "min" in stats and (approximate or not stats["approximate"]):
+        return stats
+    
+    stored = _GetStoredBandStatistics(FileName, raster_band)
+    if stored is not None and (approximate or not stored["approximate"]):
+        stats = {"min": stored["minimum"], "max": stored["maximum"], "mean": stored["mean"],
+                 "count": None, "approximate": stored["approximate"]}
+    else:
+        value_min = np.inf
+        value_max = -np.inf
+        total = 0.0
+        count = 0
+        for values in _IterateBandValues(FileName, raster_band, approximate, block_rows):
+            if values.size > 0:
+                value_min = min(value_min, values.min())
+                value_max = max(value_max, values.max())
+                total += values.sum()
+                count += values.size
+        if count == 0:
+            stats = {"min": None, "max": None, "mean": None, "count": 0, "approximate": approximate}
         else:
-            rows = ysize - i
+            stats = {"min": float(value_min), "max": float(value_max), "mean": total/count, 
+                     "count": int(count), "approximate": approximate}
+    
+    _WriteStatsSidecar(FileName, raster_band, stats)
+    return stats
+
+def GetMultiRasterStatistics(FileList, raster_band = 1, percentiles = None, approximate = False,
+                             n_threads = None, n_histogram_bins = 4096, block_rows = 1024):
+    """This gets the minimum and maximum (and optionally percentiles) of all the pixels
+    of a list of rasters, e.g. to give all the panels of a figure the same colour scale.
+    
+    The rasters are measured at the same time by a pool of threads, each of them with 
+    GetRasterStatistics, so rasters that have been measured before aren't read again. 
+    Percentiles need another (block-wise) pass over the rasters: they are interpolated 
+    from a histogram of n_histogram_bins bins covering the range of all the rasters.
+    
+    Args:
+        FileList (str list): The filenames (with path and extension) of the rasters.
+        raster_band (int): The band of the rasters
+        percentiles (float list): The percentiles to get, e.g. [2, 98]. 
+        approximate (bool): Whether approximate statistics (and overviews) are good enough
+        n_threads (int): The number of threads. If None, one per cpu. 
+        n_histogram_bins (int): The number of histogram bins used for the percentiles
+        block_rows (int): The number of rows read at a time
         
-        for j in range(0, xsize, x_block_size):
-            if j + x_block_size < xsize:
-                cols = x_block_size
-            else:
-                cols = xsize - j
-            
-            # get the values for this block
-            values = band.ReadAsArray(j, i, cols, rows)
-            
-            # move these values to the data array
-            data_array[i:i+rows,j:j+cols] = values
- 
-    print("NoData is:", NoDataValue)
-    if NoDataValue is not None:
-        nodata_mask = data_array == NoDataValue
-        data_array[nodata_mask] = np.nan
-           
-    return data_array
+    Return:
+        dict: With the keys min, max, mean, count (None if unknown) and percentile_X for each percentile
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+    
+    if len(FileList) == 0:
+        raise Exception("There are no rasters to get statistics from")
+    
+    if n_threads is None:
+        n_threads = cpu_count()
+    n_threads = max(min(int(n_threads),len(FileList)),1)
+    
+    pool = ThreadPool(n_threads)
+    try:
+        all_stats = pool.map(lambda FileName: GetRasterStatistics(FileName, raster_band, approximate, block_rows), FileList)
+        
+        all_stats = [stats for stats in all_stats if stats["min"] is not None]
+        if len(all_stats) == 0:
+            raise Exception("None of the rasters have any data")
+        
+        Stats = {"min": min([stats["min"] for stats in all_stats]),
+                 "max": max([stats["max"] for stats in all_stats])}
+        if all([stats["count"] is not None for stats in all_stats]):
+            Stats["count"] = sum([stats["count"] for stats in all_stats])
+            Stats["mean"] = sum([stats["mean"]*stats["count"] for stats in all_stats])/max(Stats["count"],1)
+        else:
+            Stats["count"] = None
+            Stats["mean"] = None
+        
+        if percentiles is not None and len(percentiles) > 0:
+            histograms = pool.map(lambda FileName: _RasterHistogram(FileName, raster_band, Stats["min"], Stats["max"],
+                                                                    n_histogram_bins, approximate, block_rows), FileList)
+            value_max = Stats["max"] if Stats["max"] > Stats["min"] else Stats["min"]+1
+            Stats.update(_HistogramPercentiles(np.sum(histograms, axis = 0), Stats["min"], value_max, percentiles))
+    finally:
+        pool.close()
+        pool.join()
+    
+    return Stats
+#==============================================================================
+
+#==============================================================================
+# These work out how much of a raster needs to be read to display it
+#==============================================================================
+def GetDisplayDecimation(FileName, target_width_pixels, window = None, bbox = None):
+    """This gets the decimation that gives at least target_width_pixels across the
+    (window of the) raster. Use it so a figure doesn't read more pixels than it can show.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        target_width_pixels (int): The number of pixels the raster will be drawn across
+        window (int tuple): A pixel window as (xoff, yoff, xsize, ysize).
+        bbox (float list): A bounding box in map coordinates as [XMin, XMax, YMin, YMax]
+        
+    Return:
+        int: The decimation. 1 means full resolution.
+    """
+    info = GetRasterInfo(FileName)
+    xoff, yoff, win_xsize, win_ysize = _PixelWindow(info.xsize, info.ysize, info.GeoT, window, bbox)
+    
+    target_width_pixels = max(int(target_width_pixels),1)
+    return max(int(win_xsize//target_width_pixels),1)
+
+def GetDisplayResampling(FileName):
+    """This gets the resampling that should be used to decimate a raster: nearest
+    for integer rasters (which are usually categories like basins or lithologies)
+    and average for everything else.
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster.
+        
+    Return:
+        str: "nearest" or "average"
+    """
+    DataType = GetRasterInfo(FileName).DataType
+    if DataType.startswith("Int") or DataType.startswith("UInt") or DataType == "Byte":
+        return "nearest"
+    else:
+        return "average"
+#==============================================================================
+
+#==============================================================================
+# These deal with memory mapping flat binary rasters (ENVI and ESRI float)
+#==============================================================================
+
+# The ENVI "data type" codes and the numpy types they correspond to
+ENVI_DATA_TYPES = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8',
+                   12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+
+# The extensions of the flat binary formats that can be memory mapped
+MEMMAP_EXTENSIONS = [".bil", ".bsq", ".bip", ".flt"]
+
+#==============================================================================
+def GetHeaderFileName(FileName):
+    """This gets the name of the header file that goes with a flat binary raster. 
+    
+    LSDTopoTools replaces the extension with .hdr (e.g. DEM.bil -> DEM.hdr) but 
+    some ENVI writers append it (DEM.bil.hdr) so both are checked. 
+    
+    Args:
+        FileName (str): The filename (with path and extension) of the raster
+        
+    Returns:
+        str: The name of the header file, or None if there isn't one
+    """
+    for header_name in [FileName[:-4]+".hdr", FileName+".hdr"]:
+        if exists(header_name):
+            return header_name
+    return None
+#==============================================================================
+
+#==============================================================================
+def ReadENVIHeader(header_name):
+    """This parses an ENVI header file into a dict. 
+    
+    The keys are the header fields in lower case (e.g. "samples", "lines", "data type", "map info").
+    Values in braces, like the map info, are returned as lists of strings.
+    
+    Args:
+        header_name (str): The filename (with path and extension) of the header
+        
+    Returns:
+        dict: The header fields
+    """
+    header_dict = {}
+    with open(header_name, 'r') as this_file:
+        text = this_file.read()
+    
+    # fields in braces can spread over several lines so join them up first
+    lines = []
+    this_line = ""
+    for line in text.splitlines():
+        this_line = this_line+line
+        if this_line.count("{") == this_line.count("}"):
+            lines.append(this_line)
+            this_line = ""
+    
+    for line in lines:
+        if "=" not in line:
+            continue
+        key,value = line.split("=",1)
+        key = key.strip().lower()
+        value = value.strip()
+        if value.startswith("{"):
+            value = [v.strip() for v in value.strip("{}").split(",")]
+        header_dict[key] = value
+    
+    return header_dict
+#==============================================================================
+
+#==============================================================================
+def ReadESRIFloatHeader(header_name):
+    """This parses the header of an ESRI .flt raster into a dict.
+    
+    The header has lines like "ncols 100" and "byteorder LSBFIRST". 
+    The keys are returned in lower case.
+    
+    Args:
+        header_name (str): The filename (with path and extension) of the header
+        
+    Returns:
+        dict: The header fields
+    """
+    header_dict = {}
+    with open(header_name, 'r') as this_file:
+        for line in this_file:
+            split_line = line.split()
+            if len(split_line) >= 2:
+                header_dict[split_line[0].lower()] = split_line[1]
+    return header_dict
+#==============================================================================
+
+#==============================================================================
+class LSDMap_MemmapRaster(object):
+
+    def __init__(self, FileName, raster_band = 1):
+        """This is a raster that is memory mapped with np.memmap rather than read into memory. 
+        
+        ENVI (.bil, .bsq, .bip) and ESRI float (.flt) rasters are flat binary files with a 
+        text header, so the data array can be a view of the file. Nothing is copied, so 
+        many plots of the same DEM share the operating system's page cache rather than 
+        each having its own copy of the array. 
+        
+        If the raster cannot be mapped (another format, or a header that can't be parsed) 
+        it is read with GDAL instead. The AccessPath member says which of these was used 
+        ("memmap" or "gdal").
+        
+        Note:
+            The mapped array is read only. Nodata is not converted to nan (that would need a copy); use GetMaskedArray to get a nodata mask. 
+        
+        Args:
+            FileName (str): The filename (with path and extension) of the raster
+            raster_band (int): The band of the raster
+        """
+        if exists(FileName) is False:
+            raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')   
+        
+        self.FileName = FileName
+        self.RasterBand = raster_band
+        
+        self.AccessPath = "gdal"
+        extension = FileName[-4:].lower()
+        header_name = GetHeaderFileName(FileName)
+        if extension in MEMMAP_EXTENSIONS and header_name is not None:
+            try:
+                if extension == ".flt":
+                    self._MapESRIFloat(header_name)
+                else:
+                    self._MapENVI(header_name)
+                self.AccessPath = "memmap"
+            except (KeyError, ValueError, IndexError) as e:
+                print("I could not memory map this raster ("+str(e)+"), reading it with GDAL instead")
+        
+        if self.AccessPath == "gdal":
+            self._ReadWithGDAL()
+        
+        print("The raster "+FileName+" was opened using the "+self.AccessPath+" path")
+
+    def _MapENVI(self, header_name):
+        """Maps an ENVI raster using its header"""
+        header = ReadENVIHeader(header_name)
+        
+        samples = int(header["samples"])
+        lines = int(header["lines"])
+        bands = int(header.get("bands", 1))
+        offset = int(header.get("header offset", 0))
+        interleave = header.get("interleave", "bsq").lower()
+        data_type = ENVI_DATA_TYPES[int(header["data type"])]
+        
+        if int(header.get("byte order", 0)) == 1:
+            data_type = ">"+data_type
+        else:
+            data_type = "<"+data_type
+        
+        if self.RasterBand > bands:
+            raise ValueError("band "+str(self.RasterBand)+" does not exist")
+        b = self.RasterBand-1
+        
+        # The shape of the file depends on how the bands are interleaved. 
+        # Taking one band out of the file is a strided view, not a copy.
+        if interleave == "bil":
+            data = np.memmap(self.FileName, dtype = data_type, mode = "r", offset = offset,
+                             shape = (lines,bands,samples))
+            self.RasterArray = data[:,b,:]
+        elif interleave == "bip":
+            data = np.memmap(self.FileName, dtype = data_type, mode = "r", offset = offset,
+                             shape = (lines,samples,bands))
+            self.RasterArray = data[:,:,b]
+        else:
+            data = np.memmap(self.FileName, dtype = data_type, mode = "r", offset = offset,
+                             shape = (bands,lines,samples))
+            self.RasterArray = data[b,:,:]
+        
+        # The map info has the map coordinates of a reference pixel (counting from 1)
+        # followed by the pixel sizes
+        map_info = header["map info"]
+        ref_x = float(map_info[1])
+        ref_y = float(map_info[2])
+        dx = float(map_info[5])
+        dy = float(map_info[6])
+        XMin = float(map_info[3])-(ref_x-1)*dx
+        YMax = float(map_info[4])+(ref_y-1)*dy
+        self.GeoTransform = (XMin, dx, 0, YMax, 0, -dy)
+        
+        if "data ignore value" in header:
+            self.NoDataValue = float(header["data ignore value"])
+        else:
+            self.NoDataValue = None
+    
+    def _MapESRIFloat(self, header_name):
+        """Maps an ESRI .flt raster using its header"""
+        header = ReadESRIFloatHeader(header_name)
+        
+        ncols = int(header["ncols"])
+        nrows = int(header["nrows"])
+        CellSize = float(header["cellsize"])
+        
+        if header.get("byteorder", "lsbfirst").lower() == "msbfirst":
+            data_type = ">f4"
+        else:
+            data_type = "<f4"
+        
+        self.RasterArray = np.memmap(self.FileName, dtype = data_type, mode = "r", 
+                                     shape = (nrows,ncols))
+        
+        # the lower left can be given as a corner or as a pixel centre
+        if "xllcorner" in header:
+            XMin = float(header["xllcorner"])
+            YMin = float(header["yllcorner"])
+        else:
+            XMin = float(header["xllcenter"])-0.5*CellSize
+            YMin = float(header["yllcenter"])-0.5*CellSize
+        YMax = YMin+nrows*CellSize
+        self.GeoTransform = (XMin, CellSize, 0, YMax, 0, -CellSize)
+        
+        if "nodata_value" in header:
+            self.NoDataValue = float(header["nodata_value"])
+        else:
+            self.NoDataValue = None
+    
+    def _ReadWithGDAL(self):
+        """Reads the raster with GDAL, for formats that can't be mapped"""
+        dataset = gdal.Open(self.FileName, GA_ReadOnly )
+        if dataset == None:
+            raise Exception("Unable to read the data file")
+        band = dataset.GetRasterBand(self.RasterBand)
+        self.RasterArray = band.ReadAsArray()
+        self.GeoTransform = dataset.GetGeoTransform()
+        self.NoDataValue = band.GetNoDataValue()
+    
+    def GetMaskedArray(self):
+        """Returns the raster as a masked array with nodata masked. The data is not copied.
+        
+        Returns:
+            np.ma.MaskedArray: The raster data
+        """
+        if self.NoDataValue is None:
+            return np.ma.MaskedArray(self.RasterArray, copy = False)
+        else:
+            return np.ma.MaskedArray(self.RasterArray, mask = self.RasterArray == self.NoDataValue, copy = False)
+    
+    def GetRasterExtent(self):
+        """Returns the extent of the raster as [XMin, XMax, YMin, YMax] (for imshow)
+        """
+        nrows,ncols = self.RasterArray.shape
+        XMin = self.GeoTransform[0]
+        XMax = XMin+ncols*self.GeoTransform[1]
+        YMax = self.GeoTransform[3]
+        YMin = YMax+nrows*self.GeoTransform[5]
+        return [XMin,XMax,YMin,YMax]
 #==============================================================================
 
 #==============================================================================
@@ -516,54 +1552,17 @@ def array2raster(rasterfn,newRasterfn,array,driver_name = "ENVI", noDataValue =
 #==============================================================================  
     
 
-def RasterDifference(RasterFile1, RasterFile2, raster_band=1, OutFileName="Test.outfile", OutFileType="ENVI"):
+def RasterDifference(RasterFile1, RasterFile2, raster_band=1, OutFileName="Test.outfile", OutFileType="ENVI",
+                     NoDataValue = -9999, n_threads = None):
     """
     Takes two rasters of same size and subtracts second from first,
     e.g. Raster1 - Raster2 = raster_of_difference
-    then writes it out to file
+    then writes it out to file. The rasters are read and the difference is written
+    a strip at a time (see LSDMap_RasterCalculator.RasterCalculator), in double
+    precision, and the difference is nodata wherever either raster is nodata.
     """
-    
-    Raster1 = gdal.Open(RasterFile1)
-    Raster2 = gdal.Open(RasterFile2)
-    
-    print("RASTER 1: ")
-    print(Raster1.GetGeoTransform())
-    print(Raster1.RasterCount)
-    print(Raster1.GetRasterBand(1).XSize)
-    print(Raster1.GetRasterBand(1).YSize)
-    print(Raster1.GetRasterBand(1).DataType)
-    
-    print("RASTER 2: ")
-    print(Raster2.GetGeoTransform())
-    print(Raster2.RasterCount)
-    print(Raster2.GetRasterBand(1).XSize)
-    print(Raster2.GetRasterBand(1).YSize)
-    print(Raster2.GetRasterBand(1).DataType)
-    
-    raster_array1 = np.array(Raster1.GetRasterBand(raster_band).ReadAsArray())
-    raster_array2 = np.array(Raster2.GetRasterBand(raster_band).ReadAsArray())
-    
-    assert(raster_array1.shape == raster_array2.shape )
-    print("Shapes: ", raster_array1.shape, raster_array2.shape)
-    
-    difference_raster_array = raster_array1 - raster_array2
-    
-#    import matplotlib.pyplot as plt
-#    
-#    plt.imshow(difference_raster_array)
-#    
-    
-    driver = gdal.GetDriverByName(OutFileType)
+    from LSDPlottingTools.LSDMap_RasterCalculator import RasterCalculator
 
-    dsOut = driver.Create(OutFileName, 
-                          Raster1.GetRasterBand(1).XSize, 
-                          Raster1.GetRasterBand(1).YSize, 
-                          1, 
-                          gdal.GDT_Float32)
-                          #Raster1.GetRasterBand(raster_band).DataType)
-    
-    
-    gdal_array.CopyDatasetInfo(Raster1,dsOut)
-    bandOut = dsOut.GetRasterBand(1)
-    gdal_array.BandWriteArray(bandOut, difference_raster_array)
+    RasterCalculator("a - b", [RasterFile1, RasterFile2], OutFileName, raster_band = raster_band,
+                     driver_name = OutFileType, NoDataValue = NoDataValue, n_threads = n_threads)
     
@@ -60,16 +60,11 @@ def plot_knickpoint_elevations(PointData, DataDirectory, DEM_prefix, basin_key=0
     ax = fig.add_subplot(gs[25:100,10:95])
 
     # get the data
-    elevation = KPData.QueryData('elevation')
-    elevation = [float(x) for x in elevation]
-    flow_distance = KPData.QueryData('flow distance')
-    flow_distance = [float(x) for x in flow_distance]
-    magnitude = KPData.QueryData(kp_type)
-    magnitude = [float(x) for x in magnitude]
-    basin = KPData.QueryData('basin_key')
-    basin = [int(x) for x in basin]
-    source = KPData.QueryData('source_key')
-    source = [int(x) for x in source]
+    elevation = np.asarray(KPData.QueryData('elevation'), dtype=float)
+    flow_distance = np.asarray(KPData.QueryData('flow distance'), dtype=float)
+    magnitude = np.asarray(KPData.QueryData(kp_type), dtype=float)
+    basin = np.asarray(KPData.QueryData('basin_key'), dtype=int)
+    source = np.asarray(KPData.QueryData('source_key'), dtype=int)
 
     # need to convert everything into arrays so we can mask different basins
     Elevation = np.asarray(elevation)
@@ -7,6 +7,7 @@ Created on Thu Jul 09 11:16:42 2015
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
+import tempfile
 
 # This function takes a string and looks for the seperators
 # it then reformats to the correct operating system
@@ -216,3 +217,25 @@ def ParseListToType(A_list):
     
         
         
+
+
+# This function makes a new, empty temporary file in the same directory as
+# a file and returns its name. A file can be written there and then moved into
+# place in one step with ReplaceFile, so it is never read half written and
+# processes writing the same file at the same time don't get in each other's way
+def MakeTempFileNextTo(filename):
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = tempfile.mkstemp(dir = directory, prefix = os.path.basename(filename)+".", suffix = ".tmp")
+    os.close(handle)
+    return temp_name
+
+# This function moves a file into place in one step, replacing the file that is
+# already there. os.replace is python 3 only. On python 2 os.rename does the same
+# on unix, but windows won't rename over a file so it is removed first there
+def ReplaceFile(source, destination):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        if os.name == "nt" and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
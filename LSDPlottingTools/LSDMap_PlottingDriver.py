@@ -8,10 +8,140 @@ Created on Sun Jan 29 10:20:18 2017
 import LSDPlottingTools.LSDMap_ChiPlotting as LSDMap_CP
 import LSDPlottingTools.LSDMap_BasicPlotting as LSDMap_BP
 import LSDPlottingTools.LSDMap_OSystemTools as LSDOst
+import LSDPlottingTools.LSDMap_GDALIO as LSDMap_IO
+import LSDPlottingTools.LSDMap_PointTools as LSDMap_PD
+import matplotlib.pyplot as plt
+import multiprocessing
+import traceback
+import hashlib
+import json
 import os
 import sys
 import ast
 
+#==============================================================================
+# The plots the driver can make, in the order they are made, and the suffix 
+# of the default name of each figure. Each of them has a method called
+# plot_<switch> in LSDMap_PlottingDriver.
+#==============================================================================
+PLOTTING_TASKS = [("BasicDensityPlot", "BDP"),
+                  ("BasicDrapedPlotGridPlot", "BDPDPG"),
+                  ("DrapedOverFancyHillshade", "DrapedFancyHS"),
+                  ("BasinsOverFancyHillshade", "Basins"),
+                  ("BasicChiCoordinatePlot", "Chi"),
+                  ("ChiProfiles", "ChiProfile"),
+                  ("StackedChiProfiles", "StackedChiProfile"),
+                  ("StackedProfilesGradient", "StackedProfileGradient")]
+
+# The parameters that each plot uses. If none of these (or the files it 
+# reads, or the plotting code) change, the figure doesn't need to be remade.
+TASK_PARAMETERS = {"BasicDensityPlot": ["base_cmap", "cbar_label", "clim_val", "FigFormat", "size_format", "is_log"],
+                   "BasicDrapedPlotGridPlot": ["DrapeName", "base_cmap", "drape_cmap", "cbar_label", "clim_val", 
+                                               "drape_alpha", "FigFormat"],
+                   "DrapedOverFancyHillshade": ["DrapeName", "base_cmap", "drape_cmap", "cbar_label", "clim_val", 
+                                                "drape_alpha", "FigFormat", "elevation_threshold"],
+                   "BasinsOverFancyHillshade": ["chan_net_csv", "base_cmap", "drape_cmap", "clim_val", "drape_alpha", 
+                                                "FigFormat", "elevation_threshold", "grouped_basin_list", 
+                                                "basin_rename_list", "spread", "label_sources", 
+                                                "source_chi_threshold", "size_format"],
+                   "BasicChiCoordinatePlot": ["base_cmap", "clim_val", "basin_order_list", "drape_alpha", 
+                                              "FigFormat", "size_format"],
+                   "ChiProfiles": ["FigFormat", "basin_order_list", "basin_rename_list", "label_sources", 
+                                   "elevation_threshold", "source_thinning_threshold", "plot_M_chi", 
+                                   "size_format", "plot_segments"],
+                   "StackedChiProfiles": ["FigFormat", "elevation_threshold", "basin_order_list", 
+                                          "basin_rename_list", "label_sources", "source_thinning_threshold", 
+                                          "size_format"],
+                   "StackedProfilesGradient": ["FigFormat", "elevation_threshold", "basin_order_list", 
+                                               "basin_rename_list", "label_sources", "source_thinning_threshold", 
+                                               "size_format"]}
+
+# The modules whose code makes the figures
+_PlottingCodeVersion = None
+
+def GetPlottingCodeVersion():
+    """This gets a fingerprint of the plotting code, so figures are remade if the code changes.
+    It covers the source of the whole LSDPlottingTools package (colours, adjust_text and so on,
+    not just the plotting modules) and of LSDMapFigure, which sits next to it.
+    
+    Returns:
+        str: A hash of the source of the plotting packages
+    """
+    global _PlottingCodeVersion
+    if _PlottingCodeVersion is None:
+        code_hash = hashlib.sha1()
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for source_dir in [package_dir, os.path.join(os.path.dirname(package_dir), "LSDMapFigure")]:
+            source_files = []
+            for root, dirs, files in os.walk(source_dir):
+                dirs[:] = [d for d in dirs if d != "__pycache__"]
+                source_files.extend([os.path.join(root, f) for f in files if f.endswith(".py")])
+            for source_file in sorted(source_files):
+                code_hash.update(os.path.relpath(source_file, source_dir).encode("utf-8"))
+                with open(source_file, "rb") as this_file:
+                    code_hash.update(this_file.read())
+        _PlottingCodeVersion = code_hash.hexdigest()
+    return _PlottingCodeVersion
+
+def GetFileFingerprint(FileName):
+    """This gets the size and modification time of a file (and its header, if it is a raster with one). 
+    
+    Args:
+        FileName (str): The name of the file
+        
+    Returns:
+        list: [size, modification time] of the file and its header, or None if the file doesn't exist
+    """
+    fingerprint = []
+    header_name = LSDMap_IO.GetHeaderFileName(FileName) if FileName.endswith(".bil") else None
+    for fname in [FileName, header_name]:
+        if fname is None:
+            continue
+        if not os.path.isfile(fname):
+            return None
+        this_stat = os.stat(fname)
+        fingerprint.extend([this_stat.st_size, this_stat.st_mtime])
+    return fingerprint
+
+# The driver that the worker processes plot for. It is set before the workers
+# are forked, so they inherit it along with the data it has already loaded.
+_ActiveDriver = None
+
+def _RunPlottingTask(switch):
+    """This makes one plot in a worker process.
+    
+    Args:
+        switch (str): The plotting switch
+        
+    Returns:
+        (str, str): The switch, and the traceback if the plot failed (or None)
+    """
+    try:
+        _ActiveDriver.run_task(switch)
+        return switch, None
+    except Exception:
+        return switch, traceback.format_exc()
+
+def _InitPlottingWorker():
+    """This makes sure workers plot to files rather than to a screen.
+    """
+    plt.switch_backend("Agg")
+
+def _CanForkWorkers():
+    """This checks that worker processes can be forked. Start methods are python 3
+    only; on python 2 the pool always forks where there is os.fork.
+    """
+    if hasattr(multiprocessing, "get_all_start_methods"):
+        return "fork" in multiprocessing.get_all_start_methods()
+    return hasattr(os, "fork")
+
+def _MakeForkedPool(n_processes):
+    """This makes a pool of forked plotting workers.
+    """
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("fork").Pool(n_processes, initializer = _InitPlottingWorker)
+    return multiprocessing.Pool(n_processes, initializer = _InitPlottingWorker)
+
 class LSDMap_PlottingDriver(object):
     
     # The constructor: it needs a filename to read    
@@ -92,6 +222,9 @@ class LSDMap_PlottingDriver(object):
         self.basin_csv_fname = str(self.FilePath+os.sep+self.FilePrefix+"_AllBasinsInfo.csv")
         
         
+        # Point data that is used by several plots is read once and kept here
+        self.shared_point_data = {}
+        
         # Now load and parse parameters
         self.create_plotting_switches()
         self.create_default_parameters()
@@ -153,6 +286,7 @@ class LSDMap_PlottingDriver(object):
         num_default_parameters["basin_rename_list"] = []
         num_default_parameters["elevation_threshold"] = 0
         num_default_parameters["source_thinning_threshold"]= 0
+        num_default_parameters["n_processes"] = 0
         
         bool_default_parameters["label_sources"] = False
         bool_default_parameters["is_log"] = False
@@ -216,136 +350,458 @@ class LSDMap_PlottingDriver(object):
         # reset the defaults, just to be safe
         self.create_default_parameters()
                 
-    def plot_data(self):
-        """This is the bit that actually plots the data.
+    def get_plot_tasks(self):
+        """This gets the plots that are switched on, in the order they are made.
         
+        Returns:
+            list: The switches of the plots to make
         """
-        import LSDPlottingTools.LSDMap_PointTools as LSDMap_PD
-
-            
-        if self.plotting_switches["BasicDensityPlot"]: 
-            
-            # Check to see if there is a filename. If not set a default file name
-            if self.plotting_parameters["FigFileName"] == "None":
-                self.plotting_parameters["FigFileName"] = self.FilePath+os.sep+self.FilePrefix+"BDP."+self.plotting_parameters["FigFormat"]     
-            
-            print("Hey there partner, I am making a grid plot.")
-            LSDMap_BP.BasicDensityPlot(self.base_faster_fname, 
-                                       self.plotting_parameters["base_cmap"],
-                                       self.plotting_parameters["cbar_label"],
-                                       self.plotting_parameters["clim_val"],
-                                       self.plotting_parameters["FigFileName"],
-                                       self.plotting_parameters["FigFormat"],
-                                       self.plotting_parameters["size_format"],
-                                       self.plotting_parameters["is_log"])
-                
+        return [switch for switch, suffix in PLOTTING_TASKS if self.plotting_switches.get(switch, False)]
+    
+    def get_figure_name(self, switch):
+        """This gets the name of the figure made by a plotting switch. If FigFileName is not 
+        set, each plot gets a default name. If it is set and several plots are made, the 
+        name of the plot is added to it so that the figures don't overwrite each other.
+        
+        Args:
+            switch (str): The plotting switch
             
-        if self.plotting_switches["BasicDrapedPlotGridPlot"]:
-            # Check to see if there is a filename. If not set a default file name
-            if self.plotting_parameters["FigFileName"] == "None":
-                self.plotting_parameters["FigFileName"] = self.FilePath+os.sep+self.FilePrefix+"BDPDPG."+self.plotting_parameters["FigFormat"]     
- 
-            LSDMap_BP.BasicDrapedPlotGridPlot(self.base_faster_fname, 
-                                       self.plotting_parameters["DrapeName"],
-                                       self.plotting_parameters["base_cmap"],
-                                       self.plotting_parameters["drape_cmap"],                                
-                                       self.plotting_parameters["cbar_label"],
-                                       self.plotting_parameters["clim_val"],
-                                       self.plotting_parameters["drape_alpha"],
-                                       self.plotting_parameters["FigFileName"],
-                                       self.plotting_parameters["FigFormat"])
-                                              
-        if self.plotting_switches["BasinsOverFancyHillshade"]:
-            # Check to see if there is a filename. If not set a default file name
-            if self.plotting_parameters["FigFileName"] == "None":
-                self.plotting_parameters["FigFileName"] = self.FilePath+os.sep+self.FilePrefix+"Basins."+self.plotting_parameters["FigFormat"]     
+        Returns:
+            str: The figure file name
+        """
+        suffix = dict(PLOTTING_TASKS)[switch]
+        FigFormat = self.plotting_parameters["FigFormat"]
+        FigFileName = self.plotting_parameters["FigFileName"]
+        
+        if FigFileName == "None":
+            return self.FilePath+os.sep+self.FilePrefix+suffix+"."+FigFormat
+        elif len(self.get_plot_tasks()) > 1:
+            root, ext = os.path.splitext(FigFileName)
+            return root+"_"+suffix+ext
+        else:
+            return FigFileName
+    
+    def get_task_inputs(self, switch):
+        """This gets the files that a plot reads. 
+        
+        Args:
+            switch (str): The plotting switch
             
-            print("Type of base raster is: "+str(type(self.base_faster_fname)))
-            print("The chan net csv is: " +str(self.plotting_parameters["chan_net_csv"]))
-            print("The drape cmap is: "+self.plotting_parameters["drape_cmap"])
+        Returns:
+            (list, list): The rasters and the csv files read by the plot
+        """
+        DrapeName = self.plotting_parameters["DrapeName"]
+        chan_net_csv = self.plotting_parameters["chan_net_csv"]
+        
+        if switch == "BasicDensityPlot":
+            return [self.base_faster_fname], []
+        elif switch == "BasicDrapedPlotGridPlot":
+            return [self.base_faster_fname, DrapeName], []
+        elif switch == "DrapedOverFancyHillshade":
+            return [self.base_faster_fname, self.hs_fname, DrapeName], []
+        elif switch == "BasinsOverFancyHillshade":
+            return [self.base_faster_fname, self.hs_fname, self.basin_fname], [self.basin_csv_fname, chan_net_csv]
+        elif switch == "BasicChiCoordinatePlot":
+            return [self.hs_fname, self.chi_raster_fname, self.basin_fname], [self.basin_csv_fname, self.basic_chi_csv_fname]
+        else:
+            return [], [self.chi_csv_fname]
+    
+    def get_figure_manifest_name(self):
+        """This gets the name of the file where the manifests of the figures are kept.
+        """
+        return self.FilePath+os.sep+self.FilePrefix+"_FigureManifest.json"
+    
+    def read_figure_manifest(self):
+        """This reads the manifests of the figures that have been made.
+        
+        Returns:
+            dict: The manifest of each figure, keyed by figure name. Empty if there is no (readable) manifest file.
+        """
+        manifest_name = self.get_figure_manifest_name()
+        if not os.path.isfile(manifest_name):
+            return {}
+        try:
+            with open(manifest_name, "r") as manifest_file:
+                return json.load(manifest_file)
+        except ValueError:
+            print("The figure manifest "+manifest_name+" can't be read, I will remake all the figures.")
+            return {}
+    
+    def write_figure_manifest(self, manifest):
+        """This writes the manifests of the figures. It is written to a temporary file that
+        then replaces the old one, so an interrupted run doesn't leave a broken manifest.
+        
+        Args:
+            manifest (dict): The manifest of each figure, keyed by figure name.
+        """
+        manifest_name = self.get_figure_manifest_name()
+        temp_name = LSDOst.MakeTempFileNextTo(manifest_name)
+        try:
+            with open(temp_name, "w") as manifest_file:
+                json.dump(manifest, manifest_file, indent = 1, sort_keys = True)
+            LSDOst.ReplaceFile(temp_name, manifest_name)
+        finally:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+    
+    def get_task_manifest(self, switch):
+        """This gets the manifest of a figure: the fingerprints of the files it reads, 
+        the parameters it uses and the version of the plotting code.
+        
+        Args:
+            switch (str): The plotting switch
             
-            thisPointData = LSDMap_PD.LSDMap_PointData(self.basin_csv_fname)
+        Returns:
+            dict: The manifest, in the form it has once it is written to and read from json.
+        """
+        rasters, csvs = self.get_task_inputs(switch)
+        inputs = {}
+        for fname in rasters+csvs:
+            if fname != "None":
+                inputs[fname] = GetFileFingerprint(fname)
+        
+        parameters = {}
+        for key in TASK_PARAMETERS[switch]:
+            parameters[key] = self.plotting_parameters[key]
+        
+        manifest = {"switch": switch, "inputs": inputs, "parameters": parameters,
+                    "code_version": GetPlottingCodeVersion()}
+        
+        # This turns tuples into lists etc. so it can be compared with the manifest on file
+        return json.loads(json.dumps(manifest))
+    
+    def get_out_of_date_tasks(self, tasks, manifest):
+        """This gets the plots whose figures need to be made: those with no figure, 
+        or whose inputs, parameters or code have changed since the figure was made.
+        
+        Args:
+            tasks (list): The plotting switches
+            manifest (dict): The manifests of the figures that have been made.
             
-            if self.plotting_parameters["chan_net_csv"] == "None":
-                chanPointData = "None"
+        Returns:
+            list: The plotting switches that need to be run
+        """
+        if self.plotting_parameters["FigFormat"] in ["show", "return"]:
+            return tasks
+        
+        out_of_date = []
+        for switch in tasks:
+            FigFileName = self.get_figure_name(switch)
+            if os.path.isfile(FigFileName) and manifest.get(FigFileName) == self.get_task_manifest(switch):
+                print("The figure "+FigFileName+" is up to date.")
             else:
-                chanPointData = LSDMap_PD.LSDMap_PointData(self.plotting_parameters["chan_net_csv"])
-            
-            
-            LSDMap_BP.BasinsOverFancyHillshade(self.base_faster_fname, 
-                                       self.hs_fname,
-                                       self.basin_fname,
-                                       self.basin_csv_fname,
-                                       thisPointData,                                      
-                                       self.plotting_parameters["base_cmap"],
-                                       self.plotting_parameters["drape_cmap"],                                
-                                       self.plotting_parameters["clim_val"],
-                                       self.plotting_parameters["drape_alpha"],
-                                       self.plotting_parameters["FigFileName"],
-                                       self.plotting_parameters["FigFormat"],
-                                       self.plotting_parameters["elevation_threshold"],
-                                       self.plotting_parameters["grouped_basin_list"], 
-                                       self.plotting_parameters["basin_rename_list"],
-                                       self.plotting_parameters["spread"],
-                                       chanPointData,
-                                       self.plotting_parameters["label_sources"],
-                                       self.plotting_parameters["source_chi_threshold"],
-                                       self.plotting_parameters["size_format"])
-
-        if self.plotting_switches["BasicChiCoordinatePlot"]:
-            print("I am plotting a basic chi plot!")
+                out_of_date.append(switch)
+        return out_of_date
+    
+    def load_shared_inputs(self, tasks):
+        """This reads the rasters and csv files that are used by more than one of the plots,
+        so each of them is only read once.
+        
+        Args:
+            tasks (list): The plotting switches
+        """
+        raster_count = {}
+        csv_count = {}
+        for switch in tasks:
+            rasters, csvs = self.get_task_inputs(switch)
+            for fname in set(rasters):
+                raster_count[fname] = raster_count.get(fname, 0)+1
+            for fname in set(csvs):
+                csv_count[fname] = csv_count.get(fname, 0)+1
+        
+        for fname in raster_count:
+            if raster_count[fname] > 1 and fname != "None" and os.path.isfile(fname):
+                print("I am reading the shared raster: "+fname)
+                LSDMap_IO.ShareRasterArray(fname)
+        
+        for fname in csv_count:
+            if csv_count[fname] > 1 and fname != "None" and fname not in self.shared_point_data:
+                print("I am reading the shared point data: "+fname)
+                self.shared_point_data[fname] = LSDMap_PD.LSDMap_PointData(fname)
+    
+    def get_point_data(self, fname):
+        """This gets a point data object, from the shared point data if it has been read. 
+        
+        Args:
+            fname (str): The csv file name
             
-            # Check to see if there is a filename. If not set a default file name
-            if self.plotting_parameters["FigFileName"] == "None":
-                self.plotting_parameters["FigFileName"] = self.FilePath+os.sep+self.FilePrefix+"Chi."+self.plotting_parameters["FigFormat"]     
-
+        Returns:
+            LSDMap_PointData: The point data. Shared data is copied so the plots can thin it.
+        """
+        if fname in self.shared_point_data:
+            return self.shared_point_data[fname].GetMaskedCopy(None)
+        else:
+            return LSDMap_PD.LSDMap_PointData(fname)
+    
+    def run_task(self, switch):
+        """This makes the plot of one plotting switch.
+        
+        Args:
+            switch (str): The plotting switch
+        """
+        getattr(self, "plot_"+switch)(self.get_figure_name(switch))
+        if self.plotting_parameters["FigFormat"] not in ["show", "return"]:
+            plt.close("all")
+    
+    def plot_data(self, n_processes = None, force = False):
+        """This is the bit that actually plots the data.
+        
+        Figures are only remade if the files they read, the parameters they use or the
+        plotting code have changed since they were last made (this is recorded in the
+        figure manifest, prefix_FigureManifest.json). 
+        
+        Inputs used by more than one plot are read once. The plots are then made at 
+        the same time in separate processes (with the Agg backend), so the 
+        figures take about as long as the slowest one. 
+        
+        Args:
+            n_processes (int): The number of processes. If None, the n_processes 
+                parameter is used, and if that is 0 one process per cpu is used (up 
+                to the number of plots). 1 makes the plots one after another.
+            force (bool): If True, all the figures are remade even if they are up to date.
+        """
+        global _ActiveDriver
+        
+        tasks = self.get_plot_tasks()
+        if len(tasks) == 0:
+            print("There are no plotting switches turned on.")
+            return
+        
+        manifest = self.read_figure_manifest()
+        if not force:
+            tasks = self.get_out_of_date_tasks(tasks, manifest)
+            if len(tasks) == 0:
+                print("All of the figures are up to date. Use force to remake them.")
+                return
+        
+        # The manifests are worked out before plotting, so if an input changes 
+        # while the figure is being made it is remade next time
+        if self.plotting_parameters["FigFormat"] in ["show", "return"]:
+            task_manifests = {}
+        else:
+            task_manifests = dict([(switch, self.get_task_manifest(switch)) for switch in tasks])
+        
+        def record_figure(switch):
+            if switch in task_manifests:
+                manifest[self.get_figure_name(switch)] = task_manifests[switch]
+        
+        if n_processes is None:
+            n_processes = int(self.plotting_parameters["n_processes"])
+        if n_processes <= 0:
+            n_processes = multiprocessing.cpu_count()
+        n_processes = min(n_processes, len(tasks))
+        
+        # The shared data is inherited by forked workers, so the plots are only 
+        # made in parallel if processes can be forked and the figures go to files
+        if n_processes > 1:
+            if self.plotting_parameters["FigFormat"] in ["show", "return"]:
+                print("The figures are being shown, so I will plot them one at a time.")
+                n_processes = 1
+            elif not _CanForkWorkers():
+                print("I can't fork processes on this system, so I will plot the figures one at a time.")
+                n_processes = 1
+        
+        self.shared_point_data = {}
+        self.load_shared_inputs(tasks)
+        
+        try:
+            if n_processes == 1:
+                for switch in tasks:
+                    self.run_task(switch)
+                    record_figure(switch)
+            else:
+                print("I am making "+str(len(tasks))+" plots with "+str(n_processes)+" processes.")
+                _ActiveDriver = self
+                pool = _MakeForkedPool(n_processes)
+                try:
+                    results = pool.map(_RunPlottingTask, tasks, chunksize = 1)
+                finally:
+                    pool.close()
+                    pool.join()
+                    _ActiveDriver = None
                 
+                for switch, error in results:
+                    if error is None:
+                        record_figure(switch)
                 
-            thisBasinData = LSDMap_PD.LSDMap_PointData(self.basin_csv_fname)
-            chi_drape_cname = 'CMRmap_r'
-            #chi_drape_cname = 'brg_r'
-            cbar_lablel = "$\chi$ (m)"
-
-            LSDMap_CP.BasicChiCoordinatePlot(self.hs_fname, 
-                                       self.chi_raster_fname,
-                                       self.basic_chi_csv_fname,                                      
-                                       self.plotting_parameters["base_cmap"],
-                                       chi_drape_cname,
-                                       cbar_lablel,
-                                       self.plotting_parameters["clim_val"],
-                                       self.plotting_parameters["basin_order_list"],
-                                       thisBasinData,
-                                       self.basin_fname,
-                                       self.plotting_parameters["drape_alpha"],
-                                       self.plotting_parameters["FigFileName"],
-                                       self.plotting_parameters["FigFormat"],
-                                       self.plotting_parameters["size_format"])            
-            
-        if self.plotting_switches["ChiProfiles"]:
-            print("I am plotting a basic chi profile plot!")
+                failed = [(switch, error) for switch, error in results if error is not None]
+                for switch, error in failed:
+                    print("The plot "+switch+" failed:")
+                    print(error)
+                if len(failed) > 0:
+                    raise Exception("Some of the plots failed: "+", ".join([switch for switch, error in failed]))
+        finally:
+            if len(task_manifests) > 0:
+                self.write_figure_manifest(manifest)
+            self.shared_point_data = {}
+            LSDMap_IO.ClearSharedRasterArrays()
             
-            # Check to see if there is a filename. If not set a default file name
-            if self.plotting_parameters["FigFileName"] == "None":
-                self.plotting_parameters["FigFileName"] = self.FilePath+os.sep+self.FilePrefix+"ChiProfile."+self.plotting_parameters["FigFormat"]     
+    def plot_BasicDensityPlot(self, FigFileName):
+        """This makes a density plot of the base raster.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("Hey there partner, I am making a grid plot.")
+        LSDMap_BP.BasicDensityPlot(self.base_faster_fname, 
+                                   self.plotting_parameters["base_cmap"],
+                                   self.plotting_parameters["cbar_label"],
+                                   self.plotting_parameters["clim_val"],
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["size_format"],
+                                   self.plotting_parameters["is_log"])
+    
+    def plot_BasicDrapedPlotGridPlot(self, FigFileName):
+        """This drapes the DrapeName raster over the base raster.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        LSDMap_BP.BasicDrapedPlotGridPlot(self.base_faster_fname, 
+                                   self.plotting_parameters["DrapeName"],
+                                   self.plotting_parameters["base_cmap"],
+                                   self.plotting_parameters["drape_cmap"],                                
+                                   self.plotting_parameters["cbar_label"],
+                                   self.plotting_parameters["clim_val"],
+                                   self.plotting_parameters["drape_alpha"],
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"])
+    
+    def plot_DrapedOverFancyHillshade(self, FigFileName):
+        """This drapes the DrapeName raster over the base raster and its hillshade.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        LSDMap_BP.DrapedOverFancyHillshade(self.base_faster_fname, 
+                                   self.hs_fname,
+                                   self.plotting_parameters["DrapeName"],
+                                   self.plotting_parameters["base_cmap"],
+                                   self.plotting_parameters["drape_cmap"],                                
+                                   self.plotting_parameters["cbar_label"],
+                                   self.plotting_parameters["clim_val"],
+                                   self.plotting_parameters["drape_alpha"],
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["elevation_threshold"])
+    
+    def plot_BasinsOverFancyHillshade(self, FigFileName):
+        """This plots the basins over the hillshade.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("Type of base raster is: "+str(type(self.base_faster_fname)))
+        print("The chan net csv is: " +str(self.plotting_parameters["chan_net_csv"]))
+        print("The drape cmap is: "+self.plotting_parameters["drape_cmap"])
+        
+        thisPointData = self.get_point_data(self.basin_csv_fname)
+        
+        if self.plotting_parameters["chan_net_csv"] == "None":
+            chanPointData = "None"
+        else:
+            chanPointData = self.get_point_data(self.plotting_parameters["chan_net_csv"])
+        
+        LSDMap_BP.BasinsOverFancyHillshade(self.base_faster_fname, 
+                                   self.hs_fname,
+                                   self.basin_fname,
+                                   self.basin_csv_fname,
+                                   thisPointData,                                      
+                                   self.plotting_parameters["base_cmap"],
+                                   self.plotting_parameters["drape_cmap"],                                
+                                   self.plotting_parameters["clim_val"],
+                                   self.plotting_parameters["drape_alpha"],
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["elevation_threshold"],
+                                   self.plotting_parameters["grouped_basin_list"], 
+                                   self.plotting_parameters["basin_rename_list"],
+                                   self.plotting_parameters["spread"],
+                                   chanPointData,
+                                   self.plotting_parameters["label_sources"],
+                                   self.plotting_parameters["source_chi_threshold"],
+                                   self.plotting_parameters["size_format"])
+    
+    def plot_BasicChiCoordinatePlot(self, FigFileName):
+        """This plots the chi coordinate over the hillshade.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("I am plotting a basic chi plot!")
+        
+        thisBasinData = self.get_point_data(self.basin_csv_fname)
+        chi_drape_cname = 'CMRmap_r'
+        #chi_drape_cname = 'brg_r'
+        cbar_lablel = "$\chi$ (m)"
 
-                
-                
-            thisBasinData = LSDMap_PD.LSDMap_PointData(self.basin_csv_fname)
-            chi_drape_cname = 'CMRmap_r'
-            #chi_drape_cname = 'brg_r'
-            cbar_lablel = "$\chi$ (m)"
-            
-            print("The csv filename is: "+ self.chi_csv_fname)
-            
-            LSDMap_CP.ChiProfiles(self.chi_csv_fname,
-                                       self.plotting_parameters["FigFileName"],
-                                       self.plotting_parameters["FigFormat"],
-                                       self.plotting_parameters["basin_order_list"],      
-                                       self.plotting_parameters["basin_rename_list"],      
-                                       self.plotting_parameters["label_sources"], 
-                                       self.plotting_parameters["elevation_threshold"], 
-                                       self.plotting_parameters["source_thinning_threshold"], 
-                                       self.plotting_parameters["plot_M_chi"],                                       
-                                       self.plotting_parameters["plot_segments"],
-                                       self.plotting_parameters["size_format"])            
-            
\ No newline at end of file
+        LSDMap_CP.BasicChiCoordinatePlot(self.hs_fname, 
+                                   self.chi_raster_fname,
+                                   self.basic_chi_csv_fname,                                      
+                                   self.plotting_parameters["base_cmap"],
+                                   chi_drape_cname,
+                                   cbar_lablel,
+                                   self.plotting_parameters["clim_val"],
+                                   self.plotting_parameters["basin_order_list"],
+                                   thisBasinData,
+                                   self.basin_fname,
+                                   self.plotting_parameters["drape_alpha"],
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["size_format"])
+    
+    def plot_ChiProfiles(self, FigFileName):
+        """This plots the chi profiles.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("I am plotting a basic chi profile plot!")
+        print("The csv filename is: "+ self.chi_csv_fname)
+        
+        LSDMap_CP.ChiProfiles(self.get_point_data(self.chi_csv_fname),
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["basin_order_list"],      
+                                   self.plotting_parameters["basin_rename_list"],      
+                                   self.plotting_parameters["label_sources"], 
+                                   self.plotting_parameters["elevation_threshold"], 
+                                   self.plotting_parameters["source_thinning_threshold"], 
+                                   self.plotting_parameters["plot_M_chi"],                                       
+                                   self.plotting_parameters["size_format"],
+                                   self.plotting_parameters["plot_segments"])
+    
+    def plot_StackedChiProfiles(self, FigFileName):
+        """This plots the chi profiles of the basins, stacked.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("I am plotting stacked chi profiles!")
+        LSDMap_CP.StackedChiProfiles(self.get_point_data(self.chi_csv_fname),
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["elevation_threshold"],
+                                   basin_order_list = self.plotting_parameters["basin_order_list"],
+                                   basin_rename_list = self.plotting_parameters["basin_rename_list"],
+                                   label_sources = self.plotting_parameters["label_sources"],
+                                   source_thinning_threshold = self.plotting_parameters["source_thinning_threshold"],
+                                   size_format = self.plotting_parameters["size_format"])
+    
+    def plot_StackedProfilesGradient(self, FigFileName):
+        """This plots the stacked chi profiles of the basins, coloured by their gradient.
+        
+        Args:
+            FigFileName (str): The name of the figure
+        """
+        print("I am plotting stacked chi profiles coloured by gradient!")
+        LSDMap_CP.StackedProfilesGradient(self.get_point_data(self.chi_csv_fname),
+                                   FigFileName,
+                                   self.plotting_parameters["FigFormat"],
+                                   self.plotting_parameters["elevation_threshold"],
+                                   basin_order_list = self.plotting_parameters["basin_order_list"],
+                                   basin_rename_list = self.plotting_parameters["basin_rename_list"],
+                                   label_sources = self.plotting_parameters["label_sources"],
+                                   source_thinning_threshold = self.plotting_parameters["source_thinning_threshold"],
+                                   size_format = self.plotting_parameters["size_format"])
@@ -11,11 +11,17 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from osgeo import osr
 from . import LSDMap_OSystemTools as LSDOst
+from . import LSDMap_BasicManipulation as LSDMap_BM
+from . import LSDMap_GDALIO as LSDMap_IO
 import os
+import copy
 import glob
+import zipfile
 import pandas
 import numpy as np
-from pyproj import Proj, transform
+
+# The error for a broken zip file (e.g. a half written cache) is BadZipfile on python 2
+_BadZipFile = getattr(zipfile, "BadZipFile", None) or zipfile.BadZipfile
 
 
 #==============================================================================
@@ -86,16 +92,339 @@ def ConvertAllCSVToShapefile(path):
         thisPointData.TranslateToReducedShapefile(FileName)
 
 
+#==============================================================================
+# This gets the python type that corresponds to a numpy column type.
+# These are the types used to make the fields of shapefiles and GeoJSON
+#==============================================================================
+def NumpyTypeToPythonType(this_dtype):
+    """This converts a numpy dtype to the python type of its elements.
+
+    Args:
+        this_dtype (np.dtype): The type of a data column
+
+    Returns:
+        type: int, float or str
+    """
+    if np.issubdtype(this_dtype, np.integer):
+        return int
+    elif np.issubdtype(this_dtype, np.floating):
+        return float
+    else:
+        return str
+
+
+#==============================================================================
+# These functions keep a binary copy of the columns in a csv file so that
+# big chi_mapping_tool files only need to be parsed from text once
+#==============================================================================
+def GetColumnarCacheName(FileName):
+    """This gets the name of the binary cache of a csv file. It sits next to the csv file.
+
+    Args:
+        FileName (str): The name of the csv file (with path and extension)
+
+    Returns:
+        str: The name of the cache file
+    """
+    return FileName+".npz"
+
+def ReadColumnarCache(FileName, columns = None):
+    """This reads the columns of a csv file from its binary cache. The cache is only
+    used if the size and modification time of the csv file match the ones stored
+    in the cache, so if the csv file changes it is parsed again.
+
+    Args:
+        FileName (str): The name of the csv file (with path and extension)
+        columns (list): The columns to read. None reads all of them. Columns that aren't in the file are left out.
+
+    Returns:
+        The list of column names and a dict of the column arrays, or None, None if there is no valid cache
+    """
+    CacheName = GetColumnarCacheName(FileName)
+    if not os.access(CacheName,os.F_OK):
+        return None, None
+
+    this_stat = os.stat(FileName)
+    try:
+        with np.load(CacheName) as cache:
+            if (int(cache["__source_size"]) != this_stat.st_size or
+                    float(cache["__source_mtime"]) != this_stat.st_mtime):
+                print("The cache file "+CacheName+" is out of date, I'll read the csv")
+                return None, None
+
+            VariableList = [str(name) for name in cache["__columns"]]
+            if columns is not None:
+                VariableList = [name for name in VariableList if name in columns]
+            DataDict = {}
+            for name in VariableList:
+                DataDict[name] = cache["col_"+name]
+    except (IOError, OSError, KeyError, ValueError, _BadZipFile) as e:
+        print("I could not read the cache file "+CacheName+": "+str(e))
+        return None, None
+
+    return VariableList, DataDict
+
+def WriteColumnarCache(FileName, VariableList, DataDict):
+    """This writes the columns of a csv file to a binary cache, along with the size
+    and modification time of the csv file so the cache can be checked later.
+    Text columns are not cached, so files containing them are always parsed.
+
+    Args:
+        FileName (str): The name of the csv file (with path and extension)
+        VariableList (list): The column names, in order
+        DataDict (dict): The typed column arrays
+
+    Returns:
+        bool: True if the cache was written
+    """
+    for name in VariableList:
+        if DataDict[name].dtype == object:
+            print("The column "+name+" has text in it, I am not caching this file")
+            return False
+
+    CacheName = GetColumnarCacheName(FileName)
+    this_stat = os.stat(FileName)
+
+    ArraysToSave = {}
+    ArraysToSave["__columns"] = np.asarray(VariableList, dtype = np.str_)
+    ArraysToSave["__source_size"] = np.asarray(this_stat.st_size)
+    ArraysToSave["__source_mtime"] = np.asarray(this_stat.st_mtime)
+    for name in VariableList:
+        ArraysToSave["col_"+name] = DataDict[name]
+
+    # Write to a temporary file of our own and then move it into place in one step,
+    # so a half written cache is never read, even with several processes writing it
+    TempName = None
+    try:
+        TempName = LSDOst.MakeTempFileNextTo(CacheName)
+        with open(TempName, "wb") as cache_file:
+            np.savez(cache_file, **ArraysToSave)
+        LSDOst.ReplaceFile(TempName,CacheName)
+    except (IOError, OSError) as e:
+        print("I could not write the cache file "+CacheName+": "+str(e))
+        if TempName is not None and os.access(TempName,os.F_OK):
+            os.remove(TempName)
+        return False
+
+    print("I wrote a binary cache of the data to "+CacheName)
+    return True
+
+#==============================================================================
+# This bins points into a grid, so that very large point sets can be drawn
+# as one image rather than a marker per point
+#==============================================================================
+AGGREGATION_METHODS = ["count", "mean", "max", "min", "last"]
+
+def AggregatePointsToGrid(x, y, extent, n_cols, n_rows = None, values = None, method = "mean"):
+    """This bins points into the cells of a grid covering an extent.
+
+    Args:
+        x (np.array): The x coordinates (e.g. easting) of the points
+        y (np.array): The y coordinates (e.g. northing) of the points
+        extent (float list): The extent of the grid as [XMin, XMax, YMin, YMax] (the same as imshow)
+        n_cols (int): The number of columns of the grid, e.g. the number of pixels across the figure
+        n_rows (int): The number of rows. If None the cells are square.
+        values (np.array): The data of each point. Not needed for "count".
+        method (str): What goes in each cell: "count" (the number of points), "mean", "max", "min" or "last" (the value of the last point in the cell, which is what a scatter plot shows, for categories like source keys)
+
+    Returns:
+        np.array: The grid, with row 0 at YMax (like a raster, so draw it with imshow(origin = "upper", extent = extent)). Cells without points are nan.
+    """
+    if method not in AGGREGATION_METHODS:
+        raise ValueError("The aggregation method must be one of "+str(AGGREGATION_METHODS))
+    if method != "count" and values is None:
+        raise ValueError("You need values to aggregate with the "+method+" method")
+
+    XMin, XMax, YMin, YMax = [float(e) for e in extent]
+    n_cols = max(int(n_cols),1)
+    cell_size = (XMax-XMin)/n_cols
+    if n_rows is None:
+        n_rows = max(int(np.ceil((YMax-YMin)/cell_size)),1)
+    cell_height = (YMax-YMin)/n_rows
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    cols = np.floor((x-XMin)/cell_size).astype(np.int64)
+    rows = np.floor((YMax-y)/cell_height).astype(np.int64)
+
+    # points on the far edges go in the last cell, points outside are dropped
+    cols[x == XMax] = n_cols-1
+    rows[y == YMin] = n_rows-1
+    inside = (cols >= 0) & (cols < n_cols) & (rows >= 0) & (rows < n_rows)
+    if values is not None:
+        values = np.asarray(values, dtype = np.float64)
+        inside &= np.isfinite(values)
+        values = values[inside]
+    cells = rows[inside]*n_cols+cols[inside]
+    n_cells = n_rows*n_cols
+
+    counts = np.bincount(cells, minlength = n_cells)
+    if method == "count":
+        grid = counts.astype(np.float64)
+    elif method == "mean":
+        grid = np.bincount(cells, weights = values, minlength = n_cells)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            grid = grid/counts
+    elif method == "max":
+        grid = np.full(n_cells, -np.inf)
+        np.maximum.at(grid, cells, values)
+    elif method == "min":
+        grid = np.full(n_cells, np.inf)
+        np.minimum.at(grid, cells, values)
+    else:
+        # the last point of each cell is the first one when they are reversed
+        grid = np.full(n_cells, np.nan)
+        unique_cells, first_reversed = np.unique(cells[::-1], return_index = True)
+        grid[unique_cells] = values[::-1][first_reversed]
+
+    grid[counts == 0] = np.nan
+    return grid.reshape((n_rows,n_cols))
+
+#==============================================================================
+# These read a big csv file a chunk at a time, keeping only some of the columns
+# and the rows that pass some simple tests, so the whole file is never in memory
+#==============================================================================
+def _PredicateMask(DataDict, ranges = None, selections = None, lat_long_bbox = None):
+    """This gets a boolean mask of the rows of some data that pass a set of tests.
+
+    Args:
+        DataDict (dict or DataFrame): The data columns
+        ranges (dict): column name: (minimum, maximum). Rows outside are removed. Either can be None. Nans are kept, as they are by ThinData.
+        selections (dict): column name: list of values. Rows whose value isn't in the list are removed.
+        lat_long_bbox (float list): [minimum longitude, maximum longitude, minimum latitude, maximum latitude]. Rows outside are removed.
+
+    Returns:
+        np.array: The mask (True for rows to keep)
+    """
+    keep_mask = None
+
+    def combine(mask, this_mask):
+        if mask is None:
+            return this_mask
+        return mask & this_mask
+
+    if ranges:
+        for name in ranges:
+            minimum, maximum = ranges[name]
+            this_data = np.asarray(DataDict[name], dtype = float)
+            if minimum is not None:
+                keep_mask = combine(keep_mask, ~(this_data < minimum))
+            if maximum is not None:
+                keep_mask = combine(keep_mask, ~(this_data > maximum))
+
+    if selections:
+        for name in selections:
+            selection = np.unique(np.atleast_1d(np.asarray(selections[name])))
+            keep_mask = combine(keep_mask, np.isin(np.asarray(DataDict[name]), selection))
+
+    if lat_long_bbox is not None:
+        longitude = np.asarray(DataDict["longitude"], dtype = float)
+        latitude = np.asarray(DataDict["latitude"], dtype = float)
+        keep_mask = combine(keep_mask, (longitude >= lat_long_bbox[0]) & (longitude <= lat_long_bbox[1]) &
+                                       (latitude >= lat_long_bbox[2]) & (latitude <= lat_long_bbox[3]))
+
+    if keep_mask is None:
+        keep_mask = np.ones(len(DataDict[list(DataDict.keys())[0]]), dtype = bool)
+    return keep_mask
+
+def ReadFilteredCSV(FileName, columns = None, ranges = None, selections = None,
+                    lat_long_bbox = None, chunk_size = 500000, use_cache = True):
+    """This reads a csv file a chunk of rows at a time and only keeps the columns you
+    ask for and the rows that pass the tests, so the memory used depends on the chunk
+    size and the data that is kept, not on the size of the file. The latitude and
+    longitude columns are always kept.
+
+    If the file has an up to date binary cache (see WriteColumnarCache) the columns
+    are read from that and the tests are applied to them instead, which is much
+    faster than parsing the text.
+
+    Args:
+        FileName (str): The name of the csv file (with path and extension)
+        columns (list): The columns to keep. None keeps all of them.
+        ranges (dict): column name: (minimum, maximum), e.g. {"elevation": (elevation_threshold, None)}. Rows outside are removed. Nans are kept, as they are by ThinData.
+        selections (dict): column name: list of values, e.g. {"basin_key": [0, 3]}. Rows whose value isn't in the list are removed.
+        lat_long_bbox (float list): [minimum longitude, maximum longitude, minimum latitude, maximum latitude]. Rows outside are removed.
+        chunk_size (int): The number of rows read at a time
+        use_cache (bool): If true, the binary cache of the file is used if there is one
+
+    Returns:
+        pandas.DataFrame: The rows and columns that are kept
+    """
+    if not os.access(FileName,os.F_OK):
+        raise Exception('[Errno 2] No such file or directory: \'' + FileName + '\'')
+
+    # the columns that are read are the ones kept and the ones that are tested
+    if columns is None:
+        read_columns = None
+    else:
+        keep_columns = list(columns)
+        for name in ["latitude", "longitude"]:
+            if name not in keep_columns:
+                keep_columns.append(name)
+        read_columns = list(keep_columns)
+        for tested in [ranges, selections]:
+            if tested:
+                for name in tested:
+                    if name not in read_columns:
+                        read_columns.append(name)
+
+    if use_cache:
+        CachedVariables, DataDict = ReadColumnarCache(FileName, read_columns)
+        if CachedVariables is not None:
+            keep_mask = _PredicateMask(DataDict, ranges, selections, lat_long_bbox)
+            if columns is not None:
+                CachedVariables = [name for name in keep_columns if name in CachedVariables]
+            data = pandas.DataFrame(dict([(name, DataDict[name][keep_mask]) for name in CachedVariables]),
+                                    columns = CachedVariables)
+            print("I read "+str(len(keep_mask))+" rows of "+FileName+" from the binary cache and kept "+str(len(data)))
+            return data
+
+    kept_chunks = []
+    n_read = 0
+    for chunk in pandas.read_csv(FileName, sep=",", usecols = read_columns, chunksize = chunk_size):
+        n_read += len(chunk)
+        chunk = chunk[_PredicateMask(chunk, ranges, selections, lat_long_bbox)]
+        if columns is not None:
+            chunk = chunk[keep_columns]
+        kept_chunks.append(chunk)
+
+    if len(kept_chunks) == 0:
+        # an empty file has no chunks, so this gets the columns from the header
+        if columns is None:
+            keep_columns = list(pandas.read_csv(FileName, sep=",", nrows = 0).columns)
+        data = pandas.DataFrame(columns = keep_columns)
+    else:
+        data = pandas.concat(kept_chunks, ignore_index = True)
+    print("I read "+str(n_read)+" rows of "+FileName+" and kept "+str(len(data)))
+    return data
+
+def LoadFilteredPointData(FileName, columns = None, ranges = None, selections = None,
+                          lat_long_bbox = None, chunk_size = 500000, use_cache = True):
+    """This loads point data from a csv file that is too big to read all at once, keeping
+    only some of the columns and the rows that pass some tests. See ReadFilteredCSV.
+
+    Returns:
+        LSDMap_PointData: The point data
+    """
+    data = ReadFilteredCSV(FileName, columns, ranges, selections, lat_long_bbox, chunk_size, use_cache)
+    thisPointData = LSDMap_PointData(data, data_type = "pandas")
+    thisPointData.FilePrefix = LSDOst.GetFilePrefix(FileName)
+    return thisPointData
+
+
 class LSDMap_PointData(object):
 
     # The constructor: it needs a filename to read
-    def __init__(self,FileName, data_type = "csv", PANDEX = False):
+    def __init__(self,FileName, data_type = "csv", PANDEX = False, use_cache = True):
         """This is the LSDMap_pointdata object. It loads csv files that have latitude and longitude data (in WGS84) and keeps other data records.
 
         The object can convert to UTM, and it also can print data to other file formats like GeoJSON and shapefiles.
 
         Args:
             Filename (str): The name of the csv file (with path and extension) that contains the point data. It should have columns labelled "latitude" and "longitude".
+            data_type (str): "csv" or "pandas". If "pandas" then Filename is a dataframe.
+            PANDEX (bool): If true, keeps the data in a pandas dataframe (experimental).
+            use_cache (bool): If true, a binary copy of the csv columns is written next to the csv file (Filename.npz) and later loads read from it instead of parsing the text, as long as the csv file hasn't changed.
 
         Author: SMM
         """
@@ -108,6 +437,16 @@ class LSDMap_PointData(object):
 
         self.PANDEX = PANDEX
 
+        # Projected coordinates are cached here, keyed on the EPSG string and the
+        # latitude and longitude columns, so that plotting the same data again is free
+        self.ProjectedCoordinates = {}
+
+        # Group indices of integer columns (basin_key, source_key, etc.), built when first asked for
+        self.GroupIndices = {}
+
+        # Spatial indices of the projected coordinates, keyed on the EPSG string, built when first asked for
+        self.SpatialIndices = {}
+
         ######################### THIS PART OF THE CODE IS ONLY USING PANDAS #########################
         if(self.PANDEX == True):
             print("Warning, you are using an experimental version of LSDMT that is implementing Pandas dataframe to improve the performance. It is still unstable, switch PANDEX to False in your PointData parameters to use the regular way")
@@ -190,56 +529,58 @@ class LSDMap_PointData(object):
                     for name in self.VariableList:
                         this_list = DataDict[name]
                         typed_list = LSDOst.ParseListToType(this_list)
-                        DataDictTyped[name] = typed_list
+                        DataDictTyped[name] = np.asarray(typed_list)
 
                         TypeList.append(type(typed_list[0]))
 
                     self.PointData = DataDictTyped
                     self.DataTypes = TypeList
-                    print(self.PointData)
                     print(self.DataTypes)
                 else:
                     print("I am loading data using pandas, I haven't been widely tested yet, you can switch to the old way if you have troubles by looking for native_way in LSDMap_PointData")
                     #Loading the file
                     print("Loading")
-                    if(data_type == "csv"):
-                        data = pandas.read_csv(FileName, sep=",")
+                    CachedVariables = None
+                    if(data_type == "csv" and use_cache):
+                        CachedVariables, DataDict = ReadColumnarCache(FileName)
+
+                    if CachedVariables is not None:
+                        print("Loaded from the binary cache")
+                        self.VariableList = CachedVariables
                     else:
-                        if(data_type == "pandas"):
-                            data = FileName
-                    print("Loaded")
-                    #Extracting the headers
-                    self.VariableList = list(data.columns.values)
-                    #Correcting the names
-                    for names in self.VariableList:
-                        names =  LSDOst.RemoveEscapeCharacters(names).lower()
+                        if(data_type == "csv"):
+                            data = pandas.read_csv(FileName, sep=",")
+                        else:
+                            if(data_type == "pandas"):
+                                data = FileName
+                        print("Loaded")
+                        #Extracting the headers
+                        self.VariableList = list(data.columns.values)
+                        #Correcting the names
+                        for names in self.VariableList:
+                            names =  LSDOst.RemoveEscapeCharacters(names).lower()
+
+                        # Each column is kept as its own contiguous, typed numpy array.
+                        # pandas infers the type of each column once when it parses the file,
+                        # so nothing is upcast to an object array and nothing needs reparsing.
+                        print("I am ingesting the data")
+                        DataDict = {}
+                        for name in self.VariableList:
+                            DataDict[name] = np.ascontiguousarray(data[name].values)
+
+                        if(data_type == "csv" and use_cache):
+                            WriteColumnarCache(FileName, self.VariableList, DataDict)
 
                     print("Your Variable list is : ")
                     print(self.VariableList)
-                    #ingesting data values
-                    dataPoints = np.array(data.values)
-                    DataDict = {}
-                    #Feeding the dictionnary[header][table of values]
-                    print("I am ingesting the data")
-                    for i in range(len(self.VariableList)):
-                        DataDict[self.VariableList[i]] = dataPoints[:,i]
-                    #dealing with the types
-                    DataDictTyped = {}
                     TypeList = []
                     for name in self.VariableList:
-                        this_list = DataDict[name]
-                        typed_list = LSDOst.ParseListToType(this_list)
-                        DataDictTyped[name] = typed_list
-
-                        TypeList.append(type(typed_list[0]))
+                        TypeList.append(NumpyTypeToPythonType(DataDict[name].dtype))
 
                     self.PointData = DataDict
                     self.DataTypes = TypeList
-                    #print(self.PointData)
                     print("The points data are successfully loaded")
-                    print("DEBUG, pointdata:")
-                    print(self.PointData)
-                    print("DEBUG, DataTypes:")
+                    print("The data types are:")
                     print(self.DataTypes)
 
 
@@ -347,14 +688,17 @@ class LSDMap_PointData(object):
 
     def QueryData(self,data_name,PrintToScreen = False):
 
-        """Returns the list of the data that has the column header data_name
+        """Returns the data that has the column header data_name
+
+        Note:
+            The column is a typed numpy array and it is returned without copying, so don't modify it in place.
 
         Args:
             PrintToScreen (bool): If true, prints to screen.
             data_name (str): The header of the column you want
 
         Return:
-            float: A list of the data
+            np.array: The data in the column (an empty list if the column doesn't exist)
 
         Author: SMM
         """
@@ -371,77 +715,384 @@ class LSDMap_PointData(object):
             return self.PointData[data_name]
 
     def GetUTMEastingNorthing(self,EPSG_string):
-        """Returns two lists: the latitude and longitude converted to northing and easting.
+        """Returns two arrays: the latitude and longitude converted to northing and easting.
+        The result is cached, so asking again for the same EPSG code costs nothing.
 
         Args:
-            PrintToScreen (bool): If true, prints to screen.
             EPSG_string (str): The EPSG code of the UTM coordinates you want (326XX) with zone XX is for north, 327XX is for south.
 
         Return:
-            float: Two lists containing easting and northing
+            float: Two arrays containing easting and northing
 
         Author: SMM
         """
         print("Yo, getting this stuff: "+EPSG_string)
-        # The lat long are in epsg 4326 which is WGS84
-        inProj = Proj(init='epsg:4326')
-        outProj = Proj(init=EPSG_string)
-        this_Lat = self.Latitude[0]
-        this_Lon = self.Longitude[0]
-
-        print("Lat-long: ")
-        print(this_Lat)
-        print(this_Lon)
-
-        easting =[]
-        northing = []
-        if(PANDEX == True):
-            easting,northing = transform(inProj,outProj,self.Longitude,self.Latitude)
-        else:
-            for idx, Lon in enumerate(self.Longitude):
-                Lat = self.Latitude[idx]
-                ea,no = transform(inProj,outProj,Lon,Lat)
-                easting.append(ea)
-                northing.append(no)
+        key = (EPSG_string,"latitude","longitude")
+        if key not in self.ProjectedCoordinates:
+            # The lat long are in epsg 4326 which is WGS84
+            self.ProjectedCoordinates[key] = self._ProjectCoordinates(EPSG_string,self.Latitude,self.Longitude)
 
-        return easting,northing
+        return self.ProjectedCoordinates[key]
 
     def GetUTMEastingNorthingFromQuery(self,EPSG_string,Latitude_string,Longitude_string):
-        """Returns two lists: the latitude and longitude converted to northing and easting. But you can define the columns if there are more than one latitude and longitude columns.
+        """Returns two arrays: the latitude and longitude converted to northing and easting. But you can define the columns if there are more than one latitude and longitude columns.
 
         Note:
             This is used mainly if there are multple lat-long coordinates in the csv file. For example when you have basin centroids and basin outlets in the same file.
         Args:
-            PrintToScreen (bool): If true, prints to screen.
             EPSG_string (str): The EPSG code of the UTM coordinates you want (326XX) with zone XX is for north, 327XX is for south.
             Latitude_string (str): The name of the latitude column you want
             Longitude_string (str): The name of the longitude column you want.
 
         Return:
-            float: Two lists containing easting and northing
+            float: Two arrays containing easting and northing
 
         Author: SMM
         """
         print("Yo, getting this stuff: "+EPSG_string)
-        # The lat long are in epsg 4326 which is WGS84
-        inProj = Proj(init='epsg:4326')
-        outProj = Proj(init=EPSG_string)
+        key = (EPSG_string,Latitude_string,Longitude_string)
+        if key not in self.ProjectedCoordinates:
+            this_Lat = self.QueryData(Latitude_string)
+            this_Lon = self.QueryData(Longitude_string)
+            self.ProjectedCoordinates[key] = self._ProjectCoordinates(EPSG_string,this_Lat,this_Lon)
 
+        return self.ProjectedCoordinates[key]
 
-        this_Lat = self.QueryData(Latitude_string)
-        this_Lon = self.QueryData(Longitude_string)
+    def _ProjectCoordinates(self,EPSG_string,Latitude,Longitude):
+        """Converts WGS84 latitude and longitude arrays in one vectorised call.
+        The returned arrays are read only since they are shared through the cache.
 
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates you want
+            Latitude (array): The latitudes
+            Longitude (array): The longitudes
 
-        easting =[]
-        northing = []
+        Return:
+            float: Two arrays containing easting and northing
+        """
+        easting,northing = LSDMap_BM.GetUTMEastingNorthing(EPSG_string,
+                                                           np.asarray(Latitude, dtype = float),
+                                                           np.asarray(Longitude, dtype = float))
+        easting = np.asarray(easting)
+        northing = np.asarray(northing)
+        easting.flags.writeable = False
+        northing.flags.writeable = False
+        return easting,northing
 
-        for idx, Lon in enumerate(this_Lon):
-            Lat = this_Lat[idx]
-            ea,no = transform(inProj,outProj,Lon,Lat)
-            easting.append(ea)
-            northing.append(no)
 
-        return easting,northing
+
+##==============================================================================
+##==============================================================================
+## Grouped data
+##==============================================================================
+##==============================================================================
+    def GetGroupIndex(self,data_name):
+        """This gets an index of the points grouped by an integer column such as basin_key,
+        source_key or segment_number. The points are sorted by the key once, and each group
+        is a contiguous run of the sorted order, so getting a group is proportional to its size
+        rather than to the number of points. The index is kept until the data is thinned.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+
+        Returns:
+            keys (np.array): the unique keys, in ascending order
+            order (np.array): the point indices sorted by key (in their original order within a key)
+            starts (np.array): where each key starts in order
+            counts (np.array): the number of points with each key
+
+            These are all empty if the column doesn't exist.
+        """
+        if data_name not in self.GroupIndices:
+            if data_name not in self.VariableList:
+                print("The data " + data_name + " is not one of the data elements in this point data")
+                empty = np.asarray([], dtype = int)
+                return empty, empty, empty, empty
+
+            this_data = np.asarray(self.PointData[data_name]).astype(int)
+            order = np.argsort(this_data, kind = "mergesort")
+            keys,starts,counts = np.unique(this_data[order], return_index = True, return_counts = True)
+            self.GroupIndices[data_name] = (keys,order,starts,counts)
+
+        return self.GroupIndices[data_name]
+
+    def GetGroupKeys(self,data_name):
+        """This gets the unique values of an integer column, e.g. the basins in the data.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+
+        Returns:
+            np.array: the unique keys, in ascending order
+        """
+        return self.GetGroupIndex(data_name)[0]
+
+    def GetGroupRows(self,data_name,key):
+        """This gets the indices of the points that have a given key, e.g. all the nodes in a basin.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+            key (int): The key of the group
+
+        Returns:
+            np.array: The point indices of the group, in their original order. Empty if there is no such group.
+        """
+        keys,order,starts,counts = self.GetGroupIndex(data_name)
+        group = np.searchsorted(keys,key)
+        if group == len(keys) or keys[group] != key:
+            return order[0:0]
+        return order[starts[group]:starts[group]+counts[group]]
+
+    def QueryGroupData(self,data_name,key,query_name):
+        """This gets the data of one column for a group of points, e.g. the chi values of a source.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+            key (int): The key of the group
+            query_name (str): The column you want
+
+        Returns:
+            np.array: The data in the group. Empty if the column doesn't exist.
+        """
+        if query_name not in self.VariableList:
+            print("The data " + query_name + " is not one of the data elements in this point data")
+            return np.asarray([])
+        return np.asarray(self.PointData[query_name])[self.GetGroupRows(data_name,key)]
+
+    def GetGroupMinMax(self,data_name,value_name):
+        """This gets the minimum and maximum of a column in every group in one pass.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+            value_name (str): The column to reduce, e.g. elevation
+
+        Returns:
+            keys, minimums, maximums: arrays with one element per group
+        """
+        keys,order,starts,counts = self.GetGroupIndex(data_name)
+        if len(keys) == 0 or value_name not in self.VariableList:
+            empty = np.asarray([])
+            return keys, empty, empty
+
+        sorted_values = np.asarray(self.PointData[value_name])[order]
+        return keys, np.minimum.reduceat(sorted_values,starts), np.maximum.reduceat(sorted_values,starts)
+
+    def GetGroupArgMinMax(self,data_name,value_name):
+        """This gets the point indices of the minimum and maximum of a column in every group,
+        e.g. the node with the highest chi in each source. Ties go to the first point, like np.argmax.
+
+        Args:
+            data_name (str): The name of the integer column to group by
+            value_name (str): The column to find the minimum and maximum of
+
+        Returns:
+            keys, argmins, argmaxs: arrays with one element per group. The argmins and argmaxs are point indices.
+        """
+        keys,order,starts,counts = self.GetGroupIndex(data_name)
+        if len(keys) == 0 or value_name not in self.VariableList:
+            empty = np.asarray([], dtype = int)
+            return keys, empty, empty
+
+        these_keys = np.asarray(self.PointData[data_name]).astype(int)
+        values = np.asarray(self.PointData[value_name])
+        point_index = np.arange(len(values))
+
+        # Sorted by key, then by value. The minimum is the first point of each group
+        # and the maximum is the last, with the point index breaking ties.
+        min_order = np.lexsort((point_index,values,these_keys))
+        max_order = np.lexsort((-point_index,values,these_keys))
+        return keys, min_order[starts], max_order[starts+counts-1]
+
+
+
+##==============================================================================
+##==============================================================================
+## Spatial queries
+##==============================================================================
+##==============================================================================
+    def GetSpatialIndex(self,EPSG_string,points_per_cell = 8):
+        """This gets a spatial index of the points in projected coordinates. The points are
+        binned into a uniform grid of square cells and sorted by cell (row by row), so the
+        points in a run of cells along a row are a contiguous run of the sorted order.
+        Spatial queries then only look at the points in the cells they overlap. The index
+        is built once for each EPSG code and is kept until the data is thinned.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates, e.g. from LSDMap_IO.GetUTMEPSG
+            points_per_cell (int): The average number of points in a cell
+
+        Returns:
+            A dict with the easting and northing, the grid origin (XMin, YMin), the cell size,
+            the number of columns and rows, the point indices sorted by cell (order) and
+            where each cell starts in order (starts, with one more element than there are cells).
+            Points with nan coordinates are not in any cell.
+        """
+        if EPSG_string not in self.SpatialIndices:
+            easting,northing = self.GetUTMEastingNorthing(EPSG_string)
+            valid = np.isfinite(easting) & np.isfinite(northing)
+            valid_index = np.flatnonzero(valid)
+            n_points = len(valid_index)
+
+            if n_points == 0:
+                XMin = YMin = 0.0
+                cell_size = 1.0
+                n_cols = n_rows = 1
+            else:
+                XMin = np.min(easting[valid_index])
+                YMin = np.min(northing[valid_index])
+                width = np.max(easting[valid_index])-XMin
+                height = np.max(northing[valid_index])-YMin
+
+                # square cells with points_per_cell points on average, and no more cells than points
+                cell_size = np.sqrt(max(width*height,1.0)*points_per_cell/n_points)
+                cell_size = max(cell_size,width/n_points,height/n_points,1e-6)
+                n_cols = int(width/cell_size)+1
+                n_rows = int(height/cell_size)+1
+
+            cols = ((easting[valid_index]-XMin)/cell_size).astype(int)
+            rows = ((northing[valid_index]-YMin)/cell_size).astype(int)
+            cells = rows*n_cols+cols
+
+            cell_order = np.argsort(cells, kind = "mergesort")
+            order = valid_index[cell_order]
+            starts = np.searchsorted(cells[cell_order], np.arange(n_cols*n_rows+1))
+
+            self.SpatialIndices[EPSG_string] = {"easting": easting, "northing": northing,
+                                                "XMin": XMin, "YMin": YMin, "cell_size": cell_size,
+                                                "n_cols": n_cols, "n_rows": n_rows,
+                                                "order": order, "starts": starts}
+
+        return self.SpatialIndices[EPSG_string]
+
+    def GetPointsInBoundingBox(self,EPSG_string,bbox):
+        """This gets the points inside a bounding box. Only the points in the cells of the
+        spatial index that overlap the box are tested.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates of the box
+            bbox (float list): The box as [XMin, XMax, YMin, YMax], e.g. a raster extent
+
+        Returns:
+            np.array: The indices of the points in the box (edges included), in their original order
+        """
+        index = self.GetSpatialIndex(EPSG_string)
+        XMin, XMax, YMin, YMax = [float(b) for b in bbox]
+        cell_size = index["cell_size"]
+        n_cols = index["n_cols"]
+
+        col_start = max(int(np.floor((XMin-index["XMin"])/cell_size)),0)
+        col_end = min(int(np.floor((XMax-index["XMin"])/cell_size)),n_cols-1)
+        row_start = max(int(np.floor((YMin-index["YMin"])/cell_size)),0)
+        row_end = min(int(np.floor((YMax-index["YMin"])/cell_size)),index["n_rows"]-1)
+        if col_start > col_end or row_start > row_end:
+            return np.asarray([], dtype = int)
+
+        # the cells of each row in the box are contiguous, so each row is one slice
+        starts = index["starts"]
+        candidates = [index["order"][starts[row*n_cols+col_start]:starts[row*n_cols+col_end+1]]
+                      for row in range(row_start,row_end+1)]
+        candidates = np.concatenate(candidates)
+
+        easting = index["easting"][candidates]
+        northing = index["northing"][candidates]
+        inside = (easting >= XMin) & (easting <= XMax) & (northing >= YMin) & (northing <= YMax)
+        return np.sort(candidates[inside])
+
+    def GetPointsInRasterExtent(self,FileName):
+        """This gets the points inside the extent of a raster, in the coordinates of the raster.
+
+        Args:
+            FileName (str): The name of the raster (with path and extension)
+
+        Returns:
+            np.array: The indices of the points on the raster, in their original order
+        """
+        EPSG_string = LSDMap_IO.GetUTMEPSG(FileName)
+        return self.GetPointsInBoundingBox(EPSG_string,LSDMap_IO.GetRasterExtent(FileName))
+
+    def GetPointsWithinRadius(self,EPSG_string,x,y,radius):
+        """This gets the points within a distance of a location, e.g. the channel nodes near a sample site.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates of the location
+            x (float): The easting of the location
+            y (float): The northing of the location
+            radius (float): The distance
+
+        Returns:
+            np.array: The indices of the points within the radius, in their original order
+        """
+        candidates = self.GetPointsInBoundingBox(EPSG_string,[x-radius,x+radius,y-radius,y+radius])
+        index = self.SpatialIndices[EPSG_string]
+        distances = np.hypot(index["easting"][candidates]-x, index["northing"][candidates]-y)
+        return candidates[distances <= radius]
+
+    def GetNearestPoints(self,EPSG_string,x,y,max_distance = None):
+        """This gets the nearest point to each of a set of locations, e.g. to snap gauges or
+        sample sites to the channel network. The search looks in a box around each location
+        that doubles in size until the nearest point found is inside it.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates of the locations
+            x (float or array): The eastings of the locations
+            y (float or array): The northings of the locations
+            max_distance (float): If not None, locations with no point this close get an index of -1 and a distance of nan
+
+        Returns:
+            indices, distances: arrays with one element per location
+        """
+        index = self.GetSpatialIndex(EPSG_string)
+        x = np.atleast_1d(np.asarray(x, dtype = float))
+        y = np.atleast_1d(np.asarray(y, dtype = float))
+        indices = np.full(len(x), -1, dtype = int)
+        distances = np.full(len(x), np.nan)
+        if len(index["order"]) == 0:
+            return indices, distances
+
+        # a box this big around any location covers every point
+        grid_width = index["n_cols"]*index["cell_size"]
+        grid_height = index["n_rows"]*index["cell_size"]
+
+        for i in range(len(x)):
+            reach = max(abs(x[i]-index["XMin"]), abs(x[i]-index["XMin"]-grid_width),
+                        abs(y[i]-index["YMin"]), abs(y[i]-index["YMin"]-grid_height))
+            half_width = index["cell_size"]
+            while True:
+                if max_distance is not None:
+                    half_width = min(half_width,max_distance)
+                candidates = self.GetPointsInBoundingBox(EPSG_string,[x[i]-half_width,x[i]+half_width,
+                                                                      y[i]-half_width,y[i]+half_width])
+                if len(candidates) > 0:
+                    these_distances = np.hypot(index["easting"][candidates]-x[i], index["northing"][candidates]-y[i])
+                    nearest = np.argmin(these_distances)
+
+                    # any closer point would be inside the box, and a box past the reach holds every point
+                    if these_distances[nearest] <= half_width or half_width >= reach:
+                        if max_distance is None or these_distances[nearest] <= max_distance:
+                            indices[i] = candidates[nearest]
+                            distances[i] = these_distances[nearest]
+                        break
+
+                if half_width >= reach or (max_distance is not None and half_width >= max_distance):
+                    break
+                half_width = half_width*2
+
+        return indices, distances
+
+    def GetClippedCopy(self,EPSG_string,bbox):
+        """This returns a new point data object with only the points inside a bounding box,
+        e.g. to plot a regional chi csv over a small DEM. The original object is not changed.
+
+        Args:
+            EPSG_string (str): The EPSG code of the coordinates of the box
+            bbox (float list): The box as [XMin, XMax, YMin, YMax]
+
+        Returns:
+            LSDMap_PointData: The clipped point data
+        """
+        keep_mask = np.zeros(len(self.GetUTMEastingNorthing(EPSG_string)[0]), dtype = bool)
+        keep_mask[self.GetPointsInBoundingBox(EPSG_string,bbox)] = True
+        return self.GetMaskedCopy(keep_mask)
 
 
 
@@ -450,68 +1101,180 @@ class LSDMap_PointData(object):
 ## Data manipulation
 ##==============================================================================
 ##==============================================================================
-    def ThinData(self,data_name,Threshold_value):
-        """This removes data from a point function that is below a threshold value
+    def _ThresholdMask(self,data_name,Threshold_value):
+        """Gets a boolean mask of the points that are not below a threshold value.
 
         Args:
             data_name (str): The name of the data member to select
-            Threshold_value (float): Below this threshold points will be removed.
+            Threshold_value (float): Points below this threshold are False in the mask
 
         Returns:
-            None removes data from the object (not reversible!!)
+            np.array: The mask (True for points to keep), or None if the data doesn't exist
+        """
+        if data_name not in self.VariableList:
+            print("The data " + data_name + " is not one of the data elements in this point data")
+            return None
 
-        Author: SMM
+        this_data = np.asarray(self.PointData[data_name], dtype = float)
+
+        # written this way round so that nans are kept, as they always have been
+        return ~(this_data < Threshold_value)
+
+    def _SelectionMask(self,data_name,data_for_selection_list):
+        """Gets a boolean mask of the points whose data_name is in a list of values.
+
+        The list is made into a sorted array of unique values and matched with
+        np.isin, so this is O(n log m) rather than a search of the list for each point.
+
+        Args:
+            data_name (str): The name of the data member to select
+            data_for_selection_list (int): A list of values to retain.
 
+        Returns:
+            np.array: The mask (True for points to keep), or None if the data doesn't exist
         """
-        print("I am thinning the data for you!")
+        if data_name not in self.VariableList:
+            print("The data " + data_name + " is not one of the data elements in this point data")
+            return None
+
+        this_data = np.asarray(self.PointData[data_name]).astype(int)
+        selection = np.unique(np.asarray(list(data_for_selection_list), dtype = int))
+
+        return np.isin(this_data, selection)
+
+    def _KeyMask(self,data_name,data_key):
+        """Gets a boolean mask of the points whose data_name equals a key.
+
+        Args:
+            data_name (str): The name of the data member to select
+            data_key (int): The key of the points to retain
 
-        # Get the data for thinning
+        Returns:
+            np.array: The mask (True for points to keep), or None if the data doesn't exist
+        """
         if data_name not in self.VariableList:
             print("The data " + data_name + " is not one of the data elements in this point data")
-        else:
-            if(self.PANDEX == False):
-                this_data = self.PointData[data_name]
+            return None
+
+        this_data = np.asarray(self.PointData[data_name]).astype(int)
+
+        return this_data == int(data_key)
+
+    def _ApplyMask(self,keep_mask):
+        """This keeps only the points where keep_mask is True. Every column is indexed in one go.
+
+        Args:
+            keep_mask (np.array): A boolean array, one element per point
+
+        Returns:
+            None removes data from the object (not reversible!!)
+        """
+        # The group and spatial indices are rebuilt if they are needed again
+        self.GroupIndices = {}
+        self.SpatialIndices = {}
+
+        # The cached coordinates are thinned along with everything else
+        NewProjected = {}
+        for key in self.ProjectedCoordinates:
+            easting,northing = self.ProjectedCoordinates[key]
+            easting = easting[keep_mask]
+            northing = northing[keep_mask]
+            easting.flags.writeable = False
+            northing.flags.writeable = False
+            NewProjected[key] = (easting,northing)
+        self.ProjectedCoordinates = NewProjected
 
         if(self.PANDEX):
-            self.PointData = self.PointData[self.PointData[data_name]<Threshold_value]
+            self.PointData = self.PointData[keep_mask]
             self.Longitude = self.PointData["longitude"]
             self.Latitude = self.PointData["latitude"]
         else:
-            this_data = [float(x) for x in this_data]
-
-
-            # Start a new data dict
             NewDataDict = {}
-            NewLat = []
-            NewLon = []
             for name in self.VariableList:
-                NewDataDict[name] = []
+                NewDataDict[name] = np.asarray(self.PointData[name])[keep_mask]
+            self.PointData = NewDataDict
+            if "latitude" in self.VariableList:
+                self.Latitude = self.PointData["latitude"]
+            if "longitude" in self.VariableList:
+                self.Longitude = self.PointData["longitude"]
 
+    def GetMaskedCopy(self,keep_mask):
+        """This returns a new point data object that only has the points where keep_mask is True.
+        The original object is not changed.
 
-            # Get all the data to be delelted
-            delete_indices = []
-            for index, data in enumerate(this_data):
-                if data<Threshold_value:
-                    delete_indices.append(index)
-                else:
-                    NewLat.append(self.Latitude[index])
-                    NewLon.append(self.Longitude[index])
-                    for name in self.VariableList:
-                        this_element = self.PointData[name][index]
-                        NewDataDict[name].append(this_element)
+        Args:
+            keep_mask (np.array): A boolean array, one element per point
 
+        Returns:
+            LSDMap_PointData: The thinned point data
+        """
+        NewPointData = copy.copy(self)
+        if keep_mask is not None:
+            NewPointData._ApplyMask(keep_mask)
+        return NewPointData
 
-            # Now reset the data dict
-            self.PointData = NewDataDict
-            self.Latitude = NewLat
-            self.Longitude = NewLon
+    def GetFilteredCopy(self, ranges = None, selections = None, lat_long_bbox = None):
+        """This returns a new point data object with only the points that pass the same
+        tests as LoadFilteredPointData. The original object is not changed.
 
+        Args:
+            ranges (dict): column name: (minimum, maximum). Either can be None.
+            selections (dict): column name: list of values
+            lat_long_bbox (float list): [minimum longitude, maximum longitude, minimum latitude, maximum latitude]
+
+        Returns:
+            LSDMap_PointData: The filtered point data
+        """
+        if not ranges and not selections and lat_long_bbox is None:
+            return self.GetMaskedCopy(None)
+        return self.GetMaskedCopy(_PredicateMask(self.PointData, ranges, selections, lat_long_bbox))
+
+    def ThinData(self,data_name,Threshold_value):
+        """This removes data from a point function that is below a threshold value
+
+        Args:
+            data_name (str): The name of the data member to select
+            Threshold_value (float): Below this threshold points will be removed.
+
+        Returns:
+            None removes data from the object (not reversible!!)
+
+        Author: SMM
+
+        """
+        print("I am thinning the data for you!")
+
+        if(self.PANDEX):
+            self.PointData = self.PointData[self.PointData[data_name]<Threshold_value]
+            self.ProjectedCoordinates = {}
+            self.GroupIndices = {}
+            self.SpatialIndices = {}
+            self.Longitude = self.PointData["longitude"]
+            self.Latitude = self.PointData["latitude"]
+        else:
+            keep_mask = self._ThresholdMask(data_name,Threshold_value)
+            if keep_mask is not None:
+                self._ApplyMask(keep_mask)
+
+    def GetThinnedData(self,data_name,Threshold_value):
+        """This is like ThinData but returns a new point data object and leaves this one alone,
+        so you can try different thresholds without reloading the data.
+
+        Args:
+            data_name (str): The name of the data member to select
+            Threshold_value (float): Below this threshold points will be removed.
+
+        Returns:
+            LSDMap_PointData: The thinned point data
+        """
+        if(self.PANDEX):
+            keep_mask = None
+            if data_name in self.VariableList:
+                keep_mask = ~(self.PointData[data_name].values < Threshold_value)
+        else:
+            keep_mask = self._ThresholdMask(data_name,Threshold_value)
+        return self.GetMaskedCopy(keep_mask)
 
-##==============================================================================
-##==============================================================================
-## Data manipulation
-##==============================================================================
-##==============================================================================
     def ThinDataSelection(self,data_name,data_for_selection_list):
         """This function takes a list of values and retains the members in data name corresponding to that selection
 
@@ -525,59 +1288,37 @@ class LSDMap_PointData(object):
         Author: SMM
 
         """
-
-
         print("I am thinning the data for you from a list!")
 
-        # Get the data for thinning
-        if data_name not in self.VariableList:
-            print("The data " + data_name + " is not one of the data elements in this point data")
-        else:
-            if(self.PANDEX == False):
-                this_data = self.PointData[data_name]
         if(self.PANDEX):
             self.PointData = self.PointData[self.PointData[data_name].isin(data_for_selection_list)]
+            self.ProjectedCoordinates = {}
+            self.GroupIndices = {}
+            self.SpatialIndices = {}
             self.Longitude = self.PointData["longitude"]
             self.Latitude = self.PointData["latitude"]
         else:
-            this_data = [int(x) for x in this_data]
-            #print("The original data I need to thin is: ")
-            #print(this_data)
-
-
-            # Start a new data dict
-            NewDataDict = {}
-            NewLat = []
-            NewLon = []
-            for name in self.VariableList:
-                NewDataDict[name] = []
-
-
-            # Get all the data to be deleted
-            print("The data I am keeping is: ")
-            print(data_for_selection_list)
-            delete_indices = []
-            for index, data in enumerate(this_data):
-                #print("Data: "+str(data))
-                if data not in data_for_selection_list:
-                    #print("I'm not keeping it")
-                    delete_indices.append(index)
-                else:
-                    #print("I'll have that one. ")
-                    NewLat.append(self.Latitude[index])
-                    NewLon.append(self.Longitude[index])
-                    for name in self.VariableList:
-                        this_element = self.PointData[name][index]
-                        NewDataDict[name].append(this_element)
+            keep_mask = self._SelectionMask(data_name,data_for_selection_list)
+            if keep_mask is not None:
+                self._ApplyMask(keep_mask)
 
+    def GetThinnedDataSelection(self,data_name,data_for_selection_list):
+        """This is like ThinDataSelection but returns a new point data object and leaves this one alone.
 
-            # Now reset the data dict
-            self.PointData = NewDataDict
-            self.Latitude = NewLat
-            self.Longitude = NewLon
+        Args:
+            data_name (str): The name of the data member to select
+            data_for_selection_list (int): A list of values to retain. Useful for things like selecting basins or sources.
 
-        #print("The updated data is:")
-        #print(self.PointData[data_name])
+        Returns:
+            LSDMap_PointData: The thinned point data
+        """
+        if(self.PANDEX):
+            keep_mask = None
+            if data_name in self.VariableList:
+                keep_mask = self.PointData[data_name].isin(data_for_selection_list).values
+        else:
+            keep_mask = self._SelectionMask(data_name,data_for_selection_list)
+        return self.GetMaskedCopy(keep_mask)
 
     def ThinDataFromKey(self,data_name,data_key):
         """This function takes a key for a value and retains the members in data name corresponding to that selection.
@@ -596,47 +1337,22 @@ class LSDMap_PointData(object):
         """
         print("I am only keeping the "+data_name+" data with a value of "+str(data_key))
 
-        # Get the data for thinning
-        if data_name not in self.VariableList:
-            print("The data " + data_name + " is not one of the data elements in this point data")
-        else:
-            this_data = self.PointData[data_name]
-
-        this_data = [int(x) for x in this_data]
-        #print("The original data I need to thin is: ")
-        #print(this_data)
+        keep_mask = self._KeyMask(data_name,data_key)
+        if keep_mask is not None:
+            self._ApplyMask(keep_mask)
 
+    def GetThinnedDataFromKey(self,data_name,data_key):
+        """This is like ThinDataFromKey but returns a new point data object and leaves this one alone.
+        Not compatible with PANDEX
 
-        # Start a new data dict
-        NewDataDict = {}
-        NewLat = []
-        NewLon = []
-        for name in self.VariableList:
-            NewDataDict[name] = []
-
-
-        # Get all the data to be deleted
-        print("The data I am keeping is: ")
-        print(data_key)
-        delete_indices = []
-        for index, data in enumerate(this_data):
-            #print("Data: "+str(data))
-            if data != data_key:
-                #print("I'm not keeping it")
-                delete_indices.append(index)
-            else:
-                #print("I'll have that one. ")
-                NewLat.append(self.Latitude[index])
-                NewLon.append(self.Longitude[index])
-                for name in self.VariableList:
-                    this_element = self.PointData[name][index]
-                    NewDataDict[name].append(this_element)
-
+        Args:
+            data_name (str): The name of the data member to select
+            data_key (int): The integer to search, values corresponding to this will be retained
 
-        # Now reset the data dict
-        self.PointData = NewDataDict
-        self.Latitude = NewLat
-        self.Longitude = NewLon
+        Returns:
+            LSDMap_PointData: The thinned point data
+        """
+        return self.GetMaskedCopy(self._KeyMask(data_name,data_key))
 
 
 
@@ -705,6 +1421,11 @@ class LSDMap_PointData(object):
             else:
                 layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
 
+        # ogr wants python types rather than numpy types for the fields
+        FieldData = {}
+        for name in self.VariableList:
+            FieldData[name] = np.asarray(self.PointData[name]).tolist()
+
         # Process the text file and add the attributes and features to the shapefile
         for index,lat in enumerate(self.Latitude):
 
@@ -712,7 +1433,7 @@ class LSDMap_PointData(object):
             feature = ogr.Feature(layer.GetLayerDefn())
 
             for name in self.VariableList:
-                feature.SetField(name, self.PointData[name][index])
+                feature.SetField(name, FieldData[name][index])
 
             # create the WKT for the feature using Python string formatting
             wkt = "POINT(%f %f)" %  (float(self.Longitude[index]), float(self.Latitude[index]))
@@ -794,6 +1515,11 @@ class LSDMap_PointData(object):
             else:
                 layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
 
+        # ogr wants python types rather than numpy types for the fields
+        FieldData = {}
+        for name in self.VariableList:
+            FieldData[name] = np.asarray(self.PointData[name]).tolist()
+
         # Process the text file and add the attributes and features to the shapefile
         for index,lat in enumerate(self.Latitude):
 
@@ -801,7 +1527,7 @@ class LSDMap_PointData(object):
             feature = ogr.Feature(layer.GetLayerDefn())
 
             for name in self.VariableList:
-                feature.SetField(name, self.PointData[name][index])
+                feature.SetField(name, FieldData[name][index])
 
             # create the WKT for the feature using Python string formatting
             wkt = "POINT(%f %f)" %  (float(self.Longitude[index]), float(self.Latitude[index]))
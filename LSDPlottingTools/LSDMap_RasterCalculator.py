@@ -0,0 +1,226 @@
+## LSDMap_RasterCalculator.py
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## Raster algebra on aligned rasters (e.g. DEMs of difference, or masks)
+## that works a strip of rows at a time, so rasters of any size are
+## processed in constant memory. Nodata in any input is nodata in the result.
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import ast
+import multiprocessing
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from osgeo import gdal, osr
+import LSDPlottingTools.LSDMap_GDALIO as LSDMap_IO
+
+# The functions and constants that can be used in expressions
+CALCULATOR_FUNCTIONS = {"where": np.where, "minimum": np.minimum, "maximum": np.maximum,
+                        "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log,
+                        "log10": np.log10, "sin": np.sin, "cos": np.cos, "tan": np.tan,
+                        "arctan2": np.arctan2, "isnan": np.isnan, "logical_and": np.logical_and,
+                        "logical_or": np.logical_or, "logical_not": np.logical_not,
+                        "nan": np.nan, "pi": np.pi}
+
+# The node types that numbers are parsed to (Num before python 3.8)
+_NUMBER_NODES = tuple([getattr(ast, name) for name in ["Constant", "Num"] if hasattr(ast, name)])
+
+#==============================================================================
+def _InputNames(rasters):
+    """This gets the names of the inputs of an expression: the keys if the rasters are
+    a dict, or a, b, c... if they are a list.
+    """
+    if isinstance(rasters, dict):
+        return list(rasters.keys()), list(rasters.values())
+    names = [chr(ord("a")+index) for index in range(len(rasters))]
+    return names, list(rasters)
+
+def _CompileExpression(expression, names):
+    """This checks that an expression only uses the inputs, constants, numpy style
+    arithmetic and the functions in CALCULATOR_FUNCTIONS, and compiles it.
+    """
+    tree = ast.parse(expression, mode = "eval")
+    allowed_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call,
+                     ast.Name, ast.Load, ast.operator, ast.unaryop, ast.cmpop)
+    for node in ast.walk(tree):
+        if isinstance(node, _NUMBER_NODES) and isinstance(getattr(node, "n", getattr(node, "value", None)), (int, float)):
+            continue
+        if not isinstance(node, allowed_nodes):
+            raise ValueError("The expression "+expression+" can't contain "+type(node).__name__)
+        if isinstance(node, ast.Name) and node.id not in names and node.id not in CALCULATOR_FUNCTIONS:
+            raise ValueError("The expression "+expression+" uses "+node.id+", which isn't an input")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id in names):
+            raise ValueError("The expression "+expression+" can only call "+str(sorted(CALCULATOR_FUNCTIONS)))
+    return compile(tree, "<raster expression>", "eval")
+
+def _EvaluateBlock(code, names, blocks, constants, propagate_nodata):
+    """This evaluates an expression on one block of the inputs (with nodata as nan).
+
+    Returns:
+        np.array: The result, with nan where it is nodata
+    """
+    variables = dict(CALCULATOR_FUNCTIONS)
+    variables.update(constants)
+    variables.update(zip(names, blocks))
+    with np.errstate(invalid = "ignore", divide = "ignore", over = "ignore"):
+        result = eval(code, {"__builtins__": {}}, variables)
+        result = np.array(np.broadcast_to(result, blocks[0].shape), dtype = blocks[0].dtype)
+        result[~np.isfinite(result)] = np.nan
+    if propagate_nodata:
+        for block in blocks:
+            result[np.isnan(block)] = np.nan
+    return result
+
+def _IterateResultBlocks(expression, rasters, raster_band = 1, window = None, bbox = None,
+                         constants = None, propagate_nodata = True, block_rows = 256,
+                         n_threads = None, dtype = np.float64):
+    """This evaluates an expression over a set of aligned rasters a strip of rows at a
+    time. The strips are read on this thread (gdal datasets shouldn't be shared between
+    threads) and evaluated on a pool of threads, a batch at a time, so only a few strips
+    are ever in memory.
+
+    Yields:
+        The row offset (within the window) and the result of each strip, in order
+    """
+    names, FileList = _InputNames(rasters)
+    if len(FileList) == 0:
+        raise Exception("The raster calculator needs at least one raster")
+    if constants is None:
+        constants = {}
+    code = _CompileExpression(expression, names+list(constants.keys()))
+
+    # The rasters have to be aligned
+    first_info = LSDMap_IO.GetRasterInfo(FileList[0])
+    for FileName in FileList[1:]:
+        info = LSDMap_IO.GetRasterInfo(FileName)
+        if (info.xsize != first_info.xsize or info.ysize != first_info.ysize or
+                not np.allclose(info.GeoT, first_info.GeoT)):
+            raise Exception("The raster "+FileName+" isn't aligned with "+FileList[0])
+
+    xoff, yoff, win_xsize, win_ysize = LSDMap_IO._PixelWindow(first_info.xsize, first_info.ysize,
+                                                             first_info.GeoT, window, bbox)
+
+    datasets = [gdal.Open(FileName, gdal.GA_ReadOnly) for FileName in FileList]
+    bands = [dataset.GetRasterBand(raster_band) for dataset in datasets]
+    NoDataValues = [band.GetNoDataValue() for band in bands]
+
+    def ReadBlock(first_row):
+        n_rows = min(block_rows, win_ysize-first_row)
+        blocks = []
+        for band, NoDataValue in zip(bands, NoDataValues):
+            block = np.empty((n_rows, win_xsize), dtype = dtype)
+            band.ReadAsArray(xoff, yoff+first_row, win_xsize, n_rows, buf_obj = block)
+            if NoDataValue is not None:
+                block[block == NoDataValue] = np.nan
+            blocks.append(block)
+        return blocks
+
+    def EvaluateBlock(blocks):
+        return _EvaluateBlock(code, names, blocks, constants, propagate_nodata)
+
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+    block_rows = max(int(block_rows), 1)
+    print("Evaluating "+expression+" in strips of "+str(block_rows)+" rows on "+str(n_threads)+" threads")
+
+    pool = ThreadPool(n_threads)
+    try:
+        block_starts = list(range(0, win_ysize, block_rows))
+        for batch_start in range(0, len(block_starts), n_threads):
+            batch = block_starts[batch_start:batch_start+n_threads]
+            results = pool.map(EvaluateBlock, [ReadBlock(first_row) for first_row in batch])
+            for first_row, result in zip(batch, results):
+                yield first_row, result
+    finally:
+        pool.close()
+        pool.join()
+#==============================================================================
+
+#==============================================================================
+def RasterCalculator(expression, rasters, new_raster_filename = None, raster_band = 1,
+                     window = None, bbox = None, constants = None, propagate_nodata = True,
+                     block_rows = 256, n_threads = None, driver_name = "ENVI",
+                     NoDataValue = -9999, dtype = np.float64):
+    """This evaluates an expression over a set of aligned rasters (the same size and
+    geotransform) and writes the result a strip of rows at a time, so the memory used
+    doesn't depend on the size of the rasters. For example, a DEM of difference masked
+    to where a third raster is positive:
+
+        RasterCalculator("(a - b) * (c > 0)", [DEM2, DEM1, Mask], "DoD.bil")
+
+    Nodata in the inputs is nan while the expression is evaluated.
+
+    Args:
+        expression (str): The expression. It can use the inputs, numbers, arithmetic, comparisons and the functions in CALCULATOR_FUNCTIONS (e.g. where, minimum, sqrt).
+        rasters (list or dict): The rasters (with path and extension). In a list they are a, b, c... in the expression. In a dict the keys are the names.
+        new_raster_filename (str): The name of the raster to write. If None, the result is returned as an array.
+        raster_band (int): The band of the rasters
+        window (int tuple): A pixel window (xoff, yoff, xsize, ysize). Only this part of the rasters is used.
+        bbox (float list): A bounding box [XMin, XMax, YMin, YMax]. Ignored if window is given.
+        constants (dict): Other names that can be used in the expression, e.g. {"threshold": 10}
+        propagate_nodata (bool): If true, the result is nodata wherever any input is nodata. If false, only where the result is nan.
+        block_rows (int): The number of rows in each strip
+        n_threads (int): The number of threads. If None, uses the number of cores.
+        driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
+        NoDataValue (float): The nodata value of the new raster.
+        dtype (numpy dtype): The type the expression is evaluated in
+
+    Returns:
+        The result (with nan as nodata) if new_raster_filename is None, otherwise None but prints a new raster to file.
+    """
+    names, FileList = _InputNames(rasters)
+    info = LSDMap_IO.GetRasterInfo(FileList[0])
+    xoff, yoff, win_xsize, win_ysize = LSDMap_IO._PixelWindow(info.xsize, info.ysize, info.GeoT, window, bbox)
+
+    # Set up the output: either a raster or an array
+    if new_raster_filename is not None:
+        GeoT = info.GeoT
+        driver = gdal.GetDriverByName(driver_name)
+        outRaster = driver.Create(new_raster_filename, win_xsize, win_ysize, 1, gdal.GDT_Float32)
+        outRaster.SetGeoTransform((GeoT[0]+xoff*GeoT[1], GeoT[1], GeoT[2],
+                                   GeoT[3]+yoff*GeoT[5], GeoT[4], GeoT[5]))
+        outRasterSRS = osr.SpatialReference()
+        outRasterSRS.ImportFromWkt(info.ProjectionWkt)
+        outRaster.SetProjection(outRasterSRS.ExportToWkt())
+        outband = outRaster.GetRasterBand(1)
+        outband.SetNoDataValue(NoDataValue)
+        result_array = None
+    else:
+        result_array = np.empty((win_ysize, win_xsize), dtype = dtype)
+
+    for first_row, result in _IterateResultBlocks(expression, rasters, raster_band, window, bbox,
+                                                  constants, propagate_nodata, block_rows,
+                                                  n_threads, dtype):
+        if result_array is None:
+            result[np.isnan(result)] = NoDataValue
+            outband.WriteArray(result, 0, first_row)
+        else:
+            result_array[first_row:first_row+result.shape[0]] = result
+
+    if result_array is None:
+        outband.FlushCache()
+        outRaster = None
+        print("Wrote raster "+new_raster_filename)
+    else:
+        return result_array
+
+def RasterCalculatorSum(expression, rasters, raster_band = 1, window = None, bbox = None,
+                        constants = None, propagate_nodata = True, block_rows = 256,
+                        n_threads = None):
+    """This evaluates an expression over a set of aligned rasters a strip at a time (see
+    RasterCalculator) and sums the result, e.g. to get the volume change between two DEMs.
+    Nodata is left out of the sum.
+
+    Returns:
+        float: The sum of the result
+        int: The number of pixels in the sum
+    """
+    total = 0.0
+    count = 0
+    for first_row, result in _IterateResultBlocks(expression, rasters, raster_band, window, bbox,
+                                                  constants, propagate_nodata, block_rows,
+                                                  n_threads):
+        valid = ~np.isnan(result)
+        total += float(np.sum(result[valid]))
+        count += int(np.count_nonzero(valid))
+    return total, count
+#==============================================================================
@@ -0,0 +1,275 @@
+## LSDMap_RasterStack.py
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## A stack of rasters (e.g. the time steps of a CAESAR-Lisflood or LithoCHILD
+## run) kept in one memory mapped 3-D array on disk, with per-pixel reductions
+## over time that work on blocks of rows so the stack is never held in memory.
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import glob
+import json
+import os
+import numpy as np
+import LSDPlottingTools.LSDMap_GDALIO as LSDMap_IO
+from LSDPlottingTools.inundation import natural_key, timestep_string_from_filename
+
+# The names of the files that make up a stack
+STACK_ARRAY_NAME = "stack.npy"
+STACK_INFO_NAME = "stack.json"
+
+#==============================================================================
+def _GetTimestep(FileName, index):
+    """This gets the time step from a file name like WaterDepths2880.asc, or the index of the file if it doesn't have one.
+    """
+    try:
+        return float(timestep_string_from_filename(FileName))
+    except (TypeError, ValueError):
+        return float(index)
+
+def _GetSourceStamps(FileList):
+    """This gets the sizes and modification times of the rasters in a stack, so a stack can tell if it is out of date.
+    """
+    stamps = []
+    for FileName in FileList:
+        this_stat = os.stat(FileName)
+        stamps.append([this_stat.st_size, this_stat.st_mtime])
+    return stamps
+
+def _FilesExist(FileList):
+    """This checks that all the files in a list exist.
+    """
+    return all([os.path.isfile(FileName) for FileName in FileList])
+#==============================================================================
+
+#==============================================================================
+class LSDMap_RasterStack(object):
+
+    def __init__(self, StackDirectory):
+        """This is a stack of rasters with the same dimensions, stored as one 3-D
+        array (time x rows x columns) of float32 in a .npy file that is memory mapped.
+        Nodata is stored as nan. Make one with BuildRasterStack.
+
+        Args:
+            StackDirectory (str): The directory the stack was built in
+        """
+        self.StackDirectory = StackDirectory
+        info_name = os.path.join(StackDirectory, STACK_INFO_NAME)
+        array_name = os.path.join(StackDirectory, STACK_ARRAY_NAME)
+        if _FilesExist([info_name, array_name]) is False:
+            raise Exception('[Errno 2] There is no raster stack in: \'' + StackDirectory + '\'')
+
+        with open(info_name, "r") as info_file:
+            info = json.load(info_file)
+
+        self.SourceFiles = info["SourceFiles"]
+        self.Timesteps = np.asarray(info["Timesteps"])
+        self.GeoTransform = tuple(info["GeoTransform"])
+        self.ProjectionWkt = info["ProjectionWkt"]
+        self.StackArray = np.load(array_name, mmap_mode = "r")
+
+        self.NTimesteps, self.NRows, self.NCols = self.StackArray.shape
+
+    def _RowBlocks(self, block_rows):
+        """This gets the (start, end) rows of each block.
+        """
+        block_rows = max(int(block_rows), 1)
+        for row_start in range(0, self.NRows, block_rows):
+            yield row_start, min(row_start+block_rows, self.NRows)
+
+    def GetPixelTimeSeries(self, row, col):
+        """This gets the values of one pixel at every time step.
+
+        Args:
+            row (int): The row of the pixel
+            col (int): The column of the pixel
+
+        Returns:
+            np.array: The value at each time step (nan is nodata)
+        """
+        return np.array(self.StackArray[:, row, col])
+
+    def GetTimestep(self, index):
+        """This gets the raster of one time step.
+
+        Args:
+            index (int): The index of the time step (not the time step itself)
+
+        Returns:
+            np.array: The raster (a copy, nan is nodata)
+        """
+        return np.array(self.StackArray[index])
+
+    def Reduce(self, reduce_function, block_rows = 64, dtype = np.float32):
+        """This reduces the stack over time, one block of rows at a time.
+
+        Args:
+            reduce_function (function): Takes a block (time x rows x columns) and the time steps and returns a rows x columns array
+            block_rows (int): The number of rows in each block. Each block holds block_rows*NCols*NTimesteps values.
+            dtype (numpy dtype): The type of the result
+
+        Returns:
+            np.array: The reduced raster
+        """
+        result = np.empty((self.NRows, self.NCols), dtype = dtype)
+        for row_start, row_end in self._RowBlocks(block_rows):
+            block = np.asarray(self.StackArray[:, row_start:row_end, :])
+            result[row_start:row_end, :] = reduce_function(block, self.Timesteps)
+        return result
+
+    def GetMaximum(self, block_rows = 64):
+        """This gets the maximum of every pixel over time (e.g. the maximum water depth).
+        """
+        return self.Reduce(lambda block, t: np.fmax.reduce(block, axis = 0), block_rows)
+
+    def GetMinimum(self, block_rows = 64):
+        """This gets the minimum of every pixel over time.
+        """
+        return self.Reduce(lambda block, t: np.fmin.reduce(block, axis = 0), block_rows)
+
+    def GetMean(self, block_rows = 64):
+        """This gets the mean of every pixel over time, ignoring nodata.
+        """
+        def mean(block, t):
+            valid = ~np.isnan(block)
+            count = np.count_nonzero(valid, axis = 0)
+            total = np.where(valid, block, 0).sum(axis = 0, dtype = np.float64)
+            with np.errstate(invalid = "ignore", divide = "ignore"):
+                return np.where(count > 0, total/count, np.nan)
+        return self.Reduce(mean, block_rows)
+
+    def GetChange(self, first = 0, last = -1, block_rows = 64):
+        """This gets the change of every pixel between two time steps, e.g. the
+        erosion (negative) and deposition (positive) over a run of elevation rasters.
+
+        Args:
+            first (int): The index of the first time step
+            last (int): The index of the last time step
+        """
+        def change(block, t):
+            return block[last]-block[first]
+        return self.Reduce(change, block_rows)
+
+    def GetTimeOfFirstExceedance(self, threshold, block_rows = 64):
+        """This gets the time step at which every pixel first goes above a threshold
+        (e.g. the time of first inundation). Pixels that never do are nan.
+
+        Args:
+            threshold (float): The threshold
+        """
+        def first_time(block, t):
+            above = block > threshold
+            first_index = np.argmax(above, axis = 0)
+            return np.where(above.any(axis = 0), t[first_index], np.nan)
+        return self.Reduce(first_time, block_rows)
+
+    def GetDurationAboveThreshold(self, threshold, block_rows = 64):
+        """This gets how long every pixel is above a threshold. Each time step lasts
+        until the next one (the last lasts as long as the one before it), so the
+        duration is in the units of the time steps.
+
+        Args:
+            threshold (float): The threshold
+        """
+        if self.NTimesteps > 1:
+            durations = np.diff(self.Timesteps)
+            durations = np.append(durations, durations[-1])
+        else:
+            durations = np.ones(1)
+
+        def duration(block, t):
+            above = block > threshold
+            return np.tensordot(durations, above, axes = (0, 0))
+        return self.Reduce(duration, block_rows)
+
+    def GetCountAboveThreshold(self, threshold, block_rows = 64):
+        """This gets the number of time steps at which every pixel is above a threshold.
+
+        Args:
+            threshold (float): The threshold
+        """
+        def count(block, t):
+            return np.count_nonzero(block > threshold, axis = 0)
+        return self.Reduce(count, block_rows, dtype = np.int32)
+
+    def WriteRaster(self, array, newRasterfn, driver_name = "ENVI", noDataValue = -9999):
+        """This writes a reduced raster (with nan as nodata) using the georeferencing of the stack.
+
+        Args:
+            array (np.array): The raster, e.g. from GetMaximum
+            newRasterfn (str): The filename (with path and extension) of the new raster.
+            driver_name (str): The type of raster to write.
+            noDataValue (float): The no data value
+        """
+        array = np.where(np.isnan(array), noDataValue, array)
+        LSDMap_IO.array2raster(self.SourceFiles[0], newRasterfn, array, driver_name, noDataValue)
+#==============================================================================
+
+#==============================================================================
+def BuildRasterStack(glob_wildcard, StackDirectory, raster_band = 1, rebuild = False):
+    """This builds a raster stack from a set of rasters with the same dimensions (e.g.
+    the WaterDepths*.asc files of a CAESAR-Lisflood run). The rasters are sorted in
+    natural order (so WaterDepths60 comes before WaterDepths120) and are read one at a
+    time into the memory mapped stack, so the stack never has to fit in memory.
+
+    If the stack has already been built from the same files (with the same sizes and
+    modification times) it is just opened.
+
+    Args:
+        glob_wildcard (str): The rasters, e.g. "Hydro/WaterDepths*.asc"
+        StackDirectory (str): The directory for the stack. It is made if it doesn't exist.
+        raster_band (int): The band of the rasters
+        rebuild (bool): If True the stack is built even if it is up to date
+
+    Returns:
+        LSDMap_RasterStack: The stack
+    """
+    FileList = sorted(glob.glob(glob_wildcard), key = natural_key)
+    if len(FileList) == 0:
+        raise Exception("No rasters match " + glob_wildcard)
+    FileList = [os.path.abspath(FileName) for FileName in FileList]
+    stamps = _GetSourceStamps(FileList)
+
+    info_name = os.path.join(StackDirectory, STACK_INFO_NAME)
+    array_name = os.path.join(StackDirectory, STACK_ARRAY_NAME)
+
+    # Check if the stack is up to date
+    if not rebuild and _FilesExist([info_name, array_name]):
+        with open(info_name, "r") as info_file:
+            info = json.load(info_file)
+        if info["SourceFiles"] == FileList and info["SourceStamps"] == stamps:
+            print("The raster stack in "+StackDirectory+" is up to date")
+            return LSDMap_RasterStack(StackDirectory)
+
+    if not os.path.isdir(StackDirectory):
+        os.makedirs(StackDirectory)
+
+    # The old info is removed first so a stack that is interrupted while it is built isn't used
+    if os.path.isfile(info_name):
+        os.remove(info_name)
+
+    raster_info = LSDMap_IO.GetRasterInfo(FileList[0])
+    NRows = raster_info.ysize
+    NCols = raster_info.xsize
+    print("Building a stack of "+str(len(FileList))+" rasters of "+str(NRows)+" x "+str(NCols))
+
+    StackArray = np.lib.format.open_memmap(array_name, mode = "w+", dtype = np.float32,
+                                           shape = (len(FileList), NRows, NCols))
+    Timesteps = []
+    for index, FileName in enumerate(FileList):
+        this_info = LSDMap_IO.GetRasterInfo(FileName)
+        if this_info.xsize != NCols or this_info.ysize != NRows:
+            raise Exception("The raster "+FileName+" doesn't have the same dimensions as "+FileList[0])
+
+        data_array = LSDMap_IO.ReadRasterArrayWindow(FileName, raster_band, dtype = np.float32)
+        StackArray[index] = data_array.filled(np.nan)
+        Timesteps.append(_GetTimestep(FileName, index))
+    StackArray.flush()
+    del StackArray
+
+    info = {"SourceFiles": FileList, "SourceStamps": stamps, "Timesteps": Timesteps,
+            "GeoTransform": list(raster_info.GeoT), "ProjectionWkt": raster_info.ProjectionWkt}
+    with open(info_name, "w") as info_file:
+        json.dump(info, info_file, indent = 1)
+
+    return LSDMap_RasterStack(StackDirectory)
+#==============================================================================
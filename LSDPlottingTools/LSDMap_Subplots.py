@@ -309,40 +309,33 @@ def flood_maps_with_shapefile(DataDirectory):
 
 def findmaxval_multirasters(FileList):
     """
-    Loops through a list or array of rasters (np arrays)
-    and finds the maximum single value in the set of arrays.
+    Finds the maximum single value in a list of rasters. 
+    
+    The rasters are not read into memory: see LSDMap_IO.GetMultiRasterStatistics. 
     """
-    overall_max_val = 0
-
-    for i in range (len(FileList)):
-
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_max_val = np.nanmax(raster_as_array)
-
-        if this_max_val > overall_max_val:
-            overall_max_val = this_max_val
-            print(overall_max_val)
-
+    overall_max_val = LSDMap_IO.GetMultiRasterStatistics(FileList)["max"]
+    print(overall_max_val)
     return overall_max_val
 
 def findminval_multirasters(FileList):
     """
-    Loops through a list or array of rasters (np arrays)
-    and finds the minimum single value in the set of arrays.
+    Finds the minimum single value in a list of rasters. 
+    
+    The rasters are not read into memory: see LSDMap_IO.GetMultiRasterStatistics. 
     """
-    overall_min_val = 0
-
-    for i in range (len(FileList)):
-
-        raster_as_array = LSDMap_IO.ReadRasterArrayBlocks(FileList[i])
-        this_min_val = np.nanmin(raster_as_array)
-
-        if this_min_val > overall_min_val:
-            overall_min_val = this_min_val
-            print(overall_min_val)
-
+    overall_min_val = LSDMap_IO.GetMultiRasterStatistics(FileList)["min"]
+    print(overall_min_val)
     return overall_min_val
 
+def _get_drape_range(FileList):
+    """
+    Gets the maximum and minimum of all the drape rasters of a multi-panel 
+    figure from their (cached) statistics, so the rasters don't have to be in 
+    memory at the same time. Each drape is then read once, when it is plotted.
+    """
+    drape_stats = LSDMap_IO.GetMultiRasterStatistics(FileList)
+    return drape_stats["max"], drape_stats["min"]
+
 
 def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
                         drape_min_threshold=None, drape_max=None, cbar_label=None):
@@ -422,16 +415,13 @@ def MultiDrapeFloodMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     all plots when teh imshow is done later.
     """
 
-    try:
-        print("Calculating max drape raster value by scanning rasters...")
-        max_water_depth = findmaxval_multirasters(FPFiles)
+    # The range comes from the statistics of the drapes, and each of them is
+    # read when it is plotted
+    max_water_depth, min_water_depth = _get_drape_range(FPFiles)
+    if drape_max is None:
+        print("Calculating max drape raster value from the drape rasters...")
         drape_max = max_water_depth
-
-    except:
-        print("Something went wrong trying to obtain the max value in \
-                your drape raster file list.")
-    finally:
-        print("The drape(s) max value is set to: ", drape_max)
+    print("The drape(s) max value is set to: ", drape_max)
 
 
     #im = mpimg.AxesImage()
@@ -567,29 +557,18 @@ def MultiDrapeErodeDiffMaps(DataDir, ElevationRaster, DrapeRasterWild, cmap,
     You need this to normalize the colourscale accross
     all plots when teh imshow is done later.
     """
+    # The range comes from the statistics of the drapes, and each of them is
+    # read when it is plotted
+    max_water_depth, min_water_depth = _get_drape_range(FPFiles)
     if drape_max_threshold is None:
-        try:
-            print("Calculating max drape raster value by scanning rasters...")
-            max_water_depth = findmaxval_multirasters(FPFiles)
-            drape_max_threshold = max_water_depth
-
-        except ValueError:
-            print("Something went wrong trying to obtain the max value in \
-                    your drape raster file list.")
-        finally:
-            print("The drape(s) max value is set to: ", drape_max_threshold)
+        print("Calculating max drape raster value from the drape rasters...")
+        drape_max_threshold = max_water_depth
+    print("The drape(s) max value is set to: ", drape_max_threshold)
 
     if drape_min_threshold is None:
-        try:
-            print("Calculating min drape raster value by scanning rasters...")
-            min_water_depth = findminval_multirasters(FPFiles)
-            drape_min_threshold = min_water_depth
-
-        except ValueError:
-            print("Something went wrong trying to obtain the min value in \
-                    your drape raster file list.")
-        finally:
-            print("The drape(s) min value is set to: ", drape_min_threshold)
+        print("Calculating min drape raster value from the drape rasters...")
+        drape_min_threshold = min_water_depth
+    print("The drape(s) min value is set to: ", drape_min_threshold)
 
 
     for i in range(n_files):
@@ -0,0 +1,387 @@
+## LSDMap_ZonalStatistics.py
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+## Statistics of rasters within zones (e.g. basin averaged values). The zones
+## are a raster of zone ids (an LSDTopoTools basin raster, or polygons that are
+## rasterized once), and every zone is done in one pass over a strip of rows at
+## a time, rather than rasterizing and reading each polygon on its own.
+##=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal, ogr, osr
+import LSDPlottingTools.LSDMap_GDALIO as LSDMap_IO
+import LSDPlottingTools.LSDMap_OSystemTools as LSDOst
+
+# The statistics that can be asked for (percentiles are asked for separately)
+ZONAL_STATISTICS = ["count", "mean", "std", "min", "max", "sum"]
+
+#==============================================================================
+def _CreateZoneDataset(info, n_levels, new_raster_filename, driver_name, NoDataValue):
+    """This makes an Int32 raster on the grid of a template raster, with one band
+    for each level of zones, filled with nodata. It is in memory if there is no filename.
+    """
+    if new_raster_filename is None:
+        driver = gdal.GetDriverByName("MEM")
+        zone_dataset = driver.Create("", info.xsize, info.ysize, n_levels, gdal.GDT_Int32)
+    else:
+        driver = gdal.GetDriverByName(driver_name)
+        zone_dataset = driver.Create(new_raster_filename, info.xsize, info.ysize, n_levels, gdal.GDT_Int32)
+    zone_dataset.SetGeoTransform(info.GeoT)
+    zone_SRS = osr.SpatialReference()
+    zone_SRS.ImportFromWkt(info.ProjectionWkt)
+    zone_dataset.SetProjection(zone_SRS.ExportToWkt())
+    for level in range(n_levels):
+        zone_band = zone_dataset.GetRasterBand(level+1)
+        zone_band.SetNoDataValue(NoDataValue)
+        zone_band.Fill(NoDataValue)
+    return zone_dataset
+
+def _GetZoneBurns(zone_shapefiles, zone_field):
+    """This gets the (shapefile, zone id, attribute filter) of each zone to burn. If the
+    zone ids come from a field, each zone id is burnt on its own, through a filter.
+    """
+    if isinstance(zone_shapefiles, dict):
+        return [(shapefile, zone_id, None) for zone_id, shapefile in zone_shapefiles.items()]
+
+    if zone_field is None:
+        raise ValueError("I need a zone_field to get the zone ids from the shapefiles")
+    if not isinstance(zone_shapefiles, (list, tuple)):
+        zone_shapefiles = [zone_shapefiles]
+    burns = []
+    for shapefile in zone_shapefiles:
+        shape = ogr.Open(shapefile)
+        if shape is None:
+            raise Exception('[Errno 2] No such file or directory: \'' + shapefile + '\'')
+        zone_ids = sorted(set([int(feature.GetField(zone_field)) for feature in shape.GetLayer()]))
+        burns.extend([(shapefile, zone_id, zone_field+" = "+str(zone_id)) for zone_id in zone_ids])
+        shape = None
+    return burns
+
+def _RasterizeZoneWindow(shapefile, attribute_filter, info):
+    """This rasterizes one zone onto the window of the template grid that covers it.
+
+    Returns:
+        The pixel window (xoff, yoff, xsize, ysize) and a boolean array of the pixels in the zone, or None, None if it is off the grid
+    """
+    shape = ogr.Open(shapefile)
+    if shape is None:
+        raise Exception('[Errno 2] No such file or directory: \'' + shapefile + '\'')
+    layer = shape.GetLayer()
+    if attribute_filter is not None:
+        layer.SetAttributeFilter(attribute_filter)
+
+    # The extent of the features that pass the filter
+    envelopes = np.array([feature.GetGeometryRef().GetEnvelope() for feature in layer])
+    if len(envelopes) == 0:
+        return None, None
+    bbox = [envelopes[:,0].min(), envelopes[:,1].max(), envelopes[:,2].min(), envelopes[:,3].max()]
+    try:
+        window = LSDMap_IO._PixelWindow(info.xsize, info.ysize, info.GeoT, bbox = bbox)
+    except Exception:
+        return None, None
+    xoff, yoff, win_xsize, win_ysize = window
+    GeoT = info.GeoT
+
+    target = gdal.GetDriverByName("MEM").Create("", win_xsize, win_ysize, 1, gdal.GDT_Byte)
+    target.SetGeoTransform((GeoT[0]+xoff*GeoT[1], GeoT[1], GeoT[2],
+                            GeoT[3]+yoff*GeoT[5], GeoT[4], GeoT[5]))
+    target.SetProjection(info.ProjectionWkt)
+    layer.ResetReading()
+    gdal.RasterizeLayer(target, [1], layer, burn_values = [1])
+    in_zone = target.GetRasterBand(1).ReadAsArray() > 0
+    shape = None
+    return window, in_zone
+
+def RasterizeZones(zone_shapefiles, template_raster, new_raster_filename = None,
+                   zone_field = None, driver_name = "ENVI", NoDataValue = -9999, nested = False):
+    """This burns polygons into a raster of zone ids on the grid of a template raster,
+    so the zonal statistics of every polygon can be done in one pass (see ZonalStatistics).
+
+    If nested is False all the polygons go into the same raster, so they shouldn't
+    overlap: where they do the last one burnt wins. If nested is True (e.g. for basins
+    and their tributary basins) the zones are put into levels: each zone goes into the
+    first level where none of its pixels are taken yet, so there are as many levels as
+    the zones are deep, and each level is a band of the zone raster.
+
+    Args:
+        zone_shapefiles (str, list or dict): Either a dict of {zone id: shapefile} (e.g. {junction: "shape_<junction>.shp"}), where every polygon in a shapefile gets its zone id, or one or more shapefiles with an integer zone_field.
+        template_raster (str): The raster (with path and extension) whose grid the zones are burnt on, e.g. the raster the statistics are of
+        new_raster_filename (str): The name of the zone raster to write. If None, the zones are returned as an array.
+        zone_field (str): The field with the zone ids. Needed if zone_shapefiles isn't a dict.
+        driver_name (str): The raster format (see gdal documentation for options. LSDTopoTools used "ENVI" format.)
+        NoDataValue (int): The value of pixels outside all the zones
+        nested (bool): If True, zones can overlap and go into levels
+
+    Returns:
+        np.array: The zone ids (levels x rows x columns if nested) if new_raster_filename is None, otherwise None but prints a new raster to file.
+    """
+    info = LSDMap_IO.GetRasterInfo(template_raster)
+
+    if not nested:
+        zone_dataset = _CreateZoneDataset(info, 1, new_raster_filename, driver_name, NoDataValue)
+        if isinstance(zone_shapefiles, dict):
+            burns = [(shapefile, zone_id) for zone_id, shapefile in zone_shapefiles.items()]
+        else:
+            if zone_field is None:
+                raise ValueError("I need a zone_field to get the zone ids from the shapefiles")
+            if not isinstance(zone_shapefiles, (list, tuple)):
+                zone_shapefiles = [zone_shapefiles]
+            burns = [(shapefile, None) for shapefile in zone_shapefiles]
+
+        print("Rasterizing the zones in "+str(len(burns))+" shapefiles")
+        for shapefile, zone_id in burns:
+            shape = ogr.Open(shapefile)
+            if shape is None:
+                raise Exception('[Errno 2] No such file or directory: \'' + shapefile + '\'')
+            layer = shape.GetLayer()
+            if zone_id is None:
+                gdal.RasterizeLayer(zone_dataset, [1], layer, options = ["ATTRIBUTE="+zone_field])
+            else:
+                gdal.RasterizeLayer(zone_dataset, [1], layer, burn_values = [zone_id])
+            shape = None
+
+        if new_raster_filename is None:
+            return zone_dataset.GetRasterBand(1).ReadAsArray()
+        zone_dataset.FlushCache()
+        zone_dataset = None
+        print("Wrote raster "+new_raster_filename)
+        return
+
+    # Nested zones: each zone is rasterized over its own window and put in the first free level
+    burns = _GetZoneBurns(zone_shapefiles, zone_field)
+    print("Rasterizing "+str(len(burns))+" nested zones")
+    levels = []
+    for shapefile, zone_id, attribute_filter in burns:
+        window, in_zone = _RasterizeZoneWindow(shapefile, attribute_filter, info)
+        if window is None or not in_zone.any():
+            print("The zone "+str(zone_id)+" doesn't cover any pixels of "+template_raster)
+            continue
+        xoff, yoff, win_xsize, win_ysize = window
+        for level in levels:
+            level_window = level[yoff:yoff+win_ysize, xoff:xoff+win_xsize]
+            if np.all(level_window[in_zone] == NoDataValue):
+                break
+        else:
+            level = np.full((info.ysize, info.xsize), NoDataValue, dtype = np.int32)
+            levels.append(level)
+            level_window = level[yoff:yoff+win_ysize, xoff:xoff+win_xsize]
+        level_window[in_zone] = zone_id
+    print("The zones are in "+str(len(levels))+" levels")
+
+    if len(levels) == 0:
+        levels.append(np.full((info.ysize, info.xsize), NoDataValue, dtype = np.int32))
+    if new_raster_filename is None:
+        return np.array(levels)
+    zone_dataset = _CreateZoneDataset(info, len(levels), new_raster_filename, driver_name, NoDataValue)
+    for index, level in enumerate(levels):
+        zone_dataset.GetRasterBand(index+1).WriteArray(level)
+    zone_dataset.FlushCache()
+    zone_dataset = None
+    print("Wrote raster "+new_raster_filename)
+#==============================================================================
+
+#==============================================================================
+def _ValueNames(value_rasters):
+    """This gets the names used for the columns of each value raster: the keys if the
+    rasters are a dict, otherwise the file prefixes.
+    """
+    if isinstance(value_rasters, dict):
+        return list(value_rasters.keys()), list(value_rasters.values())
+    if not isinstance(value_rasters, (list, tuple)):
+        value_rasters = [value_rasters]
+    return [LSDOst.GetFilePrefix(FileName) for FileName in value_rasters], list(value_rasters)
+
+def _GroupBlock(zones, values):
+    """This groups the values of a block by zone by sorting them, and gets the count,
+    mean, sum of squared deviations from the mean, min and max of each zone.
+
+    Returns:
+        The zone ids in the block and an array of each of the statistics
+    """
+    order = np.argsort(zones, kind = "mergesort")
+    zones = zones[order]
+    values = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], zones[1:] != zones[:-1])))
+    counts = np.diff(np.append(starts, len(zones)))
+    means = np.add.reduceat(values, starts)/counts
+    deviations = values-np.repeat(means, counts)
+    squares = np.add.reduceat(deviations*deviations, starts)
+    return (zones[starts], counts, means, squares,
+            np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))
+
+def _MergeGroups(zone_ids, groups):
+    """This merges the statistics of the blocks into the statistics of each zone (the
+    means and squared deviations are merged with the pairwise formula, so the standard
+    deviation doesn't lose precision like the sum of squares would).
+
+    Returns:
+        dict: Arrays of the count, mean, std, min, max and sum of each of zone_ids (nan where a zone has no values)
+    """
+    n_zones = len(zone_ids)
+    if len(groups) == 0:
+        counts = np.zeros(n_zones, dtype = np.int64)
+        nans = np.full(n_zones, np.nan)
+        return {"count": counts, "mean": nans, "std": nans.copy(), "min": nans.copy(),
+                "max": nans.copy(), "sum": np.zeros(n_zones)}
+
+    block_zones, counts, means, squares, minimums, maximums = [np.concatenate(stat) for stat in zip(*groups)]
+    index = np.searchsorted(zone_ids, block_zones)
+
+    count = np.bincount(index, weights = counts, minlength = n_zones)
+    total = np.bincount(index, weights = counts*means, minlength = n_zones)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean = np.where(count > 0, total/count, np.nan)
+        spread = squares+counts*(means-mean[index])**2
+        std = np.sqrt(np.bincount(index, weights = spread, minlength = n_zones)/count)
+
+    minimum = np.full(n_zones, np.inf)
+    np.minimum.at(minimum, index, minimums)
+    maximum = np.full(n_zones, -np.inf)
+    np.maximum.at(maximum, index, maximums)
+    minimum[count == 0] = np.nan
+    maximum[count == 0] = np.nan
+    return {"count": count.astype(np.int64), "mean": mean, "std": std, "min": minimum,
+            "max": maximum, "sum": total}
+
+def _ZoneHistogramPercentiles(histograms, value_min, value_max, percentiles):
+    """This interpolates percentiles from the histogram of each zone (one row per zone, with
+    equal bins between the min and max of the zone), like LSDMap_GDALIO does for one histogram.
+    """
+    n_zones, n_bins = histograms.shape
+    bin_width = (value_max-value_min)/n_bins
+    cumulative = np.cumsum(histograms, axis = 1)
+    count = cumulative[:, -1]
+    rows = np.arange(n_zones)
+
+    values = {}
+    for percentile in percentiles:
+        rank = count*percentile/100.
+        h_bin = np.argmax(cumulative >= rank[:, np.newaxis], axis = 1)
+        below = cumulative[rows, h_bin]-histograms[rows, h_bin]
+        fraction = (rank-below)/np.maximum(histograms[rows, h_bin], 1)
+        percentile_values = np.clip(value_min+(h_bin+fraction)*bin_width, value_min, value_max)
+        percentile_values[count == 0] = np.nan
+        values["percentile_"+str(percentile)] = percentile_values
+    return values
+#==============================================================================
+
+#==============================================================================
+def ZonalStatistics(zone_raster, value_rasters, statistics = ("count", "mean", "std", "min", "max"),
+                    percentiles = None, raster_band = 1, block_rows = 1024, n_bins = 256,
+                    csv_filename = None, zone_NoDataValue = -9999):
+    """This gets statistics of one or more rasters within every zone of a zone raster
+    (e.g. the basin averaged erosion rate of every basin in an LSDTopoTools basin raster).
+    The rasters are read a strip of rows at a time and the pixels of each strip are
+    grouped by zone by sorting, so all the zones are done in one pass and the memory
+    used doesn't depend on the size of the rasters.
+
+    Percentiles need a second pass: they are interpolated from a histogram of each zone
+    with n_bins bins between the min and max of the zone.
+
+    Args:
+        zone_raster (str or np.array): The zone raster (with path and extension), e.g. from RasterizeZones or an LSDTopoTools basin raster, or an array of zone ids. Its nodata isn't a zone. Each band (or the first axis of a 3-D array) is a level of nested zones.
+        value_rasters (str, list or dict): The rasters to get statistics of. They have to be aligned with the zone raster. In a dict the keys are used for the column names, otherwise the file prefixes are.
+        statistics (list): The statistics, from ZONAL_STATISTICS
+        percentiles (list): Percentiles to get as well, e.g. [25, 50, 75]
+        raster_band (int): The band of the rasters
+        block_rows (int): The number of rows in each strip
+        n_bins (int): The number of histogram bins used for the percentiles of each zone
+        csv_filename (str): If given, the table is also written to this csv file
+        zone_NoDataValue (int): The nodata value of the zones if zone_raster is an array (a zone raster file uses its own)
+
+    Returns:
+        pandas.DataFrame: A row for each zone (indexed by zone id) with a column <name>_<statistic> for each raster and statistic. Zones with no values in a raster have a count of 0 and nan statistics.
+    """
+    for statistic in statistics:
+        if statistic not in ZONAL_STATISTICS:
+            raise ValueError("The statistic "+statistic+" isn't one of "+str(ZONAL_STATISTICS))
+    if percentiles is None:
+        percentiles = []
+    names, FileList = _ValueNames(value_rasters)
+
+    # The rasters have to be aligned with the zones
+    if isinstance(zone_raster, np.ndarray):
+        zone_levels = zone_raster if zone_raster.ndim == 3 else zone_raster[np.newaxis]
+        n_rows, n_cols = zone_levels.shape[1:]
+        first_info = None
+    else:
+        first_info = LSDMap_IO.GetRasterInfo(zone_raster)
+        n_rows, n_cols = first_info.ysize, first_info.xsize
+        zone_dataset = gdal.Open(zone_raster, gdal.GA_ReadOnly)
+        zone_bands = [zone_dataset.GetRasterBand(level+1) for level in range(zone_dataset.RasterCount)]
+        zone_NoDataValue = zone_bands[0].GetNoDataValue()
+    for FileName in FileList:
+        info = LSDMap_IO.GetRasterInfo(FileName)
+        if info.xsize != n_cols or info.ysize != n_rows:
+            raise Exception("The raster "+FileName+" isn't the same size as the zones")
+        if first_info is not None and not np.allclose(info.GeoT, first_info.GeoT):
+            raise Exception("The raster "+FileName+" isn't aligned with "+zone_raster)
+
+    datasets = [gdal.Open(FileName, gdal.GA_ReadOnly) for FileName in FileList]
+    bands = [dataset.GetRasterBand(raster_band) for dataset in datasets]
+    NoDataValues = [band.GetNoDataValue() for band in bands]
+    block_rows = max(int(block_rows), 1)
+
+    def IterateBlocks():
+        # This yields the zone ids and the values of each raster where they are valid, a strip
+        # at a time. Each raster is read once and its values are grouped by every level of zones.
+        for first_row in range(0, n_rows, block_rows):
+            strip_rows = min(block_rows, n_rows-first_row)
+            if first_info is None:
+                zones = [np.asarray(level[first_row:first_row+strip_rows], dtype = np.int64) for level in zone_levels]
+            else:
+                # GDAL before 3.5 can't read into int64, so the zones are read as int32 and cast
+                zones = [LSDMap_IO._ReadBandWindow(zone_band, 0, first_row, n_cols, strip_rows, dtype = np.int32).astype(np.int64)
+                         for zone_band in zone_bands]
+            in_zone = [np.ones(level.shape, dtype = bool) if zone_NoDataValue is None else level != zone_NoDataValue
+                       for level in zones]
+            zone_values = []
+            for band, NoDataValue in zip(bands, NoDataValues):
+                block = LSDMap_IO._ReadBandWindow(band, 0, first_row, n_cols, strip_rows, dtype = np.float64)
+                valid = np.isfinite(block)
+                if NoDataValue is not None:
+                    valid &= block != NoDataValue
+                zone_values.append((np.concatenate([level[valid & level_in] for level, level_in in zip(zones, in_zone)]),
+                                    np.concatenate([block[valid & level_in] for level_in in in_zone])))
+            yield np.concatenate([level[level_in] for level, level_in in zip(zones, in_zone)]), zone_values
+
+    print("Getting the zonal statistics of "+str(len(FileList))+" rasters in strips of "+str(block_rows)+" rows")
+    block_zone_ids = []
+    groups = [[] for FileName in FileList]
+    for zones, zone_values in IterateBlocks():
+        block_zone_ids.append(np.unique(zones))
+        for raster_groups, (value_zones, values) in zip(groups, zone_values):
+            if len(values) > 0:
+                raster_groups.append(_GroupBlock(value_zones, values))
+    zone_ids = np.unique(np.concatenate(block_zone_ids)) if len(block_zone_ids) > 0 else np.array([], dtype = np.int64)
+    print("There are "+str(len(zone_ids))+" zones")
+
+    merged = [_MergeGroups(zone_ids, raster_groups) for raster_groups in groups]
+
+    if len(percentiles) > 0:
+        n_bins = max(int(n_bins), 1)
+        histograms = [np.zeros((len(zone_ids), n_bins), dtype = np.int64) for FileName in FileList]
+        for zones, zone_values in IterateBlocks():
+            for histogram, stats, (value_zones, values) in zip(histograms, merged, zone_values):
+                index = np.searchsorted(zone_ids, value_zones)
+                value_min = stats["min"][index]
+                value_range = np.maximum(stats["max"][index]-value_min, np.finfo(np.float64).tiny)
+                h_bins = np.clip(((values-value_min)*(n_bins/value_range)).astype(np.int64), 0, n_bins-1)
+                histogram += np.bincount(index*n_bins+h_bins, minlength = histogram.size).reshape(histogram.shape)
+        for histogram, stats in zip(histograms, merged):
+            stats.update(_ZoneHistogramPercentiles(histogram, stats["min"], stats["max"], percentiles))
+
+    columns = {}
+    column_names = []
+    for name, stats in zip(names, merged):
+        for statistic in list(statistics)+["percentile_"+str(percentile) for percentile in percentiles]:
+            column_names.append(name+"_"+statistic)
+            columns[column_names[-1]] = stats[statistic]
+    table = pd.DataFrame(columns, index = pd.Index(zone_ids, name = "zone"), columns = column_names)
+
+    if csv_filename is not None:
+        table.to_csv(csv_filename)
+        print("Wrote the zonal statistics to "+csv_filename)
+    return table
+#==============================================================================
@@ -15,6 +15,10 @@ from .LSDMap_ChiPlotting import *
 from .LSDMap_Subplots import *
 from .LSDMap_OSystemTools import *
 from .LSDMap_PlottingDriver import *
+from .LSDMap_BatchDriver import *
+from .LSDMap_RasterStack import *
+from .LSDMap_RasterCalculator import *
+from .LSDMap_ZonalStatistics import *
 
 from . import colours as lsdcolours
 from . import labels as lsdlabels
@@ -4,6 +4,7 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 import sys
+import time
 from matplotlib import pyplot as plt
 from itertools import product
 import numpy as np
@@ -56,6 +57,246 @@ def overlap_bbox_and_point(bbox, xp, yp):
         dy = 0
     return dx, dy
 
+def get_bbox_arrays(objs, r, expand=(1.0, 1.0), ax=None):
+    """
+    Gets the bboxes of objects in data coordinates as an (n, 4) array of
+    xmin, ymin, xmax, ymax
+    """
+    bboxes = get_bboxes(objs, r, expand, ax)
+    return np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in bboxes],
+                    dtype=float).reshape(-1, 4)
+
+def get_text_offsets(texts, r, expand=(1.0, 1.0), ax=None):
+    """
+    Gets the bboxes of texts relative to their positions. On linear axes these
+    don't change when the texts are moved, so they only need the renderer once.
+    """
+    positions = get_positions(texts)
+    return get_bbox_arrays(texts, r, expand, ax) - positions[:, [0, 1, 0, 1]]
+
+def get_positions(texts):
+    return np.array([text.get_position() for text in texts],
+                    dtype=float).reshape(-1, 2)
+
+def set_positions(texts, positions):
+    for text, (x, y) in zip(texts, positions):
+        text.set_position((x, y))
+
+def ragged_arange(counts):
+    """
+    For groups of the given sizes, gets the index of each member within its
+    group, e.g. [2, 3] gives [0, 1, 0, 1, 2]
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends-counts, counts)
+
+# A box that covers more grid cells than this (one much bigger than the typical
+# box) is compared with every other box rather than put in the grid
+MAX_BOX_CELLS = 64
+
+def get_cell_size(boxes):
+    """
+    The cells of the spatial hash are the size of a typical box, so each box
+    only covers a few cells
+    """
+    sizes = np.maximum(boxes[:, 2]-boxes[:, 0], boxes[:, 3]-boxes[:, 1])
+    sizes = sizes[np.isfinite(sizes) & (sizes > 0)]
+    if len(sizes) == 0:
+        return 1.0
+    return float(np.median(sizes))
+
+def get_cell_ranges(boxes, cell_size, origin):
+    """
+    Gets the first and last columns and rows of the grid cells covered by the
+    boxes, and the number of cells each box covers (as floats, so a huge box
+    can't overflow)
+    """
+    c0 = np.floor((boxes[:, 0]-origin[0])/cell_size)
+    c1 = np.floor((boxes[:, 2]-origin[0])/cell_size)
+    r0 = np.floor((boxes[:, 1]-origin[1])/cell_size)
+    r1 = np.floor((boxes[:, 3]-origin[1])/cell_size)
+    return c0, c1, r0, r1, (c1-c0+1)*(r1-r0+1)
+
+def get_box_cells(boxes, cell_size, origin, n_cols):
+    """
+    Gets every (box index, cell key) pair of the grid cells covered by the boxes
+    """
+    c0, c1, r0, r1, _ = [v.astype(np.int64) for v in
+                         get_cell_ranges(boxes, cell_size, origin)]
+    n_x = c1-c0+1
+    n_cells = n_x*(r1-r0+1)
+    box_index = np.repeat(np.arange(len(boxes)), n_cells)
+    k = ragged_arange(n_cells)
+    cols = c0[box_index] + k % n_x[box_index]
+    rows = r0[box_index] + k // n_x[box_index]
+    return box_index, rows*n_cols+cols
+
+def get_grid(boxes, x=None, y=None, cell_size=None):
+    """
+    Gets the cell size, origin and number of columns of a grid covering the
+    boxes (and the points if there are any). The boxes and points must be finite.
+    """
+    if cell_size is None:
+        cell_size = get_cell_size(boxes)
+    xmin, ymin = boxes[:, 0].min(), boxes[:, 1].min()
+    xmax, ymax = boxes[:, 2].max(), boxes[:, 3].max()
+    if x is not None and len(x):
+        xmin, ymin = min(xmin, x.min()), min(ymin, y.min())
+        xmax, ymax = max(xmax, x.max()), max(ymax, y.max())
+    # keep the number of cells across the grid small enough that the cell keys fit
+    # in an int64
+    cell_size = max(cell_size, max(xmax-xmin, ymax-ymin)/1e6)
+    n_cols = int(np.floor((xmax-xmin)/cell_size))+1
+    return cell_size, (xmin, ymin), n_cols
+
+def split_boxes(boxes, cell_size, origin):
+    """
+    Splits the finite boxes into the ones that go in the grid and the ones that
+    cover too many cells, which are checked against everything by brute force
+    """
+    finite = np.all(np.isfinite(boxes), axis=1)
+    n_cells = np.full(len(boxes), np.inf)
+    n_cells[finite] = get_cell_ranges(boxes[finite], cell_size, origin)[4]
+    hashed = n_cells <= MAX_BOX_CELLS
+    return np.flatnonzero(hashed), np.flatnonzero(finite & ~hashed)
+
+def get_overlapping_pairs(boxes, cell_size=None):
+    """
+    Finds the pairs of boxes (i < j) that overlap. The boxes are put in a
+    uniform grid (a spatial hash) and only boxes that share a cell are compared,
+    rather than every box with every other box. Boxes that aren't finite
+    don't overlap anything.
+    Returns i, j and the widths and heights of the overlaps.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    finite = np.flatnonzero(np.all(np.isfinite(boxes), axis=1))
+    if len(finite) < 2:
+        return empty, empty, np.zeros(0), np.zeros(0)
+    cell_size, origin, n_cols = get_grid(boxes[finite], cell_size=cell_size)
+    hashed, big = split_boxes(boxes, cell_size, origin)
+
+    box_index, keys = get_box_cells(boxes[hashed], cell_size, origin, n_cols)
+    order = np.lexsort((box_index, keys))
+    box_index, keys = hashed[box_index[order]], keys[order]
+    _, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+
+    # every pair of boxes that share a cell
+    members = np.repeat(counts, counts)
+    first = np.repeat(np.arange(len(keys)), members)
+    second = np.repeat(np.repeat(starts, counts), members) + ragged_arange(members)
+    i, j = box_index[first], box_index[second]
+
+    # and every pair with a big box
+    i = np.concatenate((i, np.repeat(big, len(finite))))
+    j = np.concatenate((j, np.tile(finite, len(big))))
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    pairs = np.unique(i[i < j]*len(boxes) + j[i < j])
+    i, j = pairs // len(boxes), pairs % len(boxes)
+
+    overlap_x = (np.minimum(boxes[i, 2], boxes[j, 2]) -
+                 np.maximum(boxes[i, 0], boxes[j, 0]))
+    overlap_y = (np.minimum(boxes[i, 3], boxes[j, 3]) -
+                 np.maximum(boxes[i, 1], boxes[j, 1]))
+    overlapping = (overlap_x >= 0) & (overlap_y >= 0)
+    return (i[overlapping], j[overlapping], overlap_x[overlapping],
+            overlap_y[overlapping])
+
+def get_points_in_boxes(x, y, boxes, cell_size=None):
+    """
+    Finds the points strictly inside each box, using the same spatial hash as
+    get_overlapping_pairs. Points and boxes that aren't finite are skipped.
+    Returns (box index, point index) pairs.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    empty = np.zeros(0, dtype=np.int64)
+    finite_boxes = np.all(np.isfinite(boxes), axis=1) if len(boxes) else []
+    points = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if not np.any(finite_boxes) or len(points) == 0:
+        return empty, empty
+    cell_size, origin, n_cols = get_grid(boxes[finite_boxes], x[points], y[points],
+                                         cell_size)
+    hashed, big = split_boxes(boxes, cell_size, origin)
+
+    point_keys = (np.floor((y[points]-origin[1])/cell_size).astype(np.int64)*n_cols +
+                  np.floor((x[points]-origin[0])/cell_size).astype(np.int64))
+    point_order = np.argsort(point_keys, kind='mergesort')
+    sorted_keys = point_keys[point_order]
+
+    box_index, keys = get_box_cells(boxes[hashed], cell_size, origin, n_cols)
+    lo = np.searchsorted(sorted_keys, keys, side='left')
+    counts = np.searchsorted(sorted_keys, keys, side='right') - lo
+    b = hashed[np.repeat(box_index, counts)]
+    p = points[point_order[np.repeat(lo, counts) + ragged_arange(counts)]]
+
+    # the big boxes are checked against every point
+    b = np.concatenate((b, np.repeat(big, len(points))))
+    p = np.concatenate((p, np.tile(points, len(big))))
+
+    inside = ((x[p] > boxes[b, 0]) & (x[p] < boxes[b, 2]) &
+              (y[p] > boxes[b, 1]) & (y[p] < boxes[b, 3]))
+    return b[inside], p[inside]
+
+def get_text_repulsion(boxes):
+    """
+    Gets how far each box should move to get away from the boxes it overlaps:
+    the size of each overlap, away from the other box
+    """
+    n = len(boxes)
+    i, j, overlap_x, overlap_y = get_overlapping_pairs(boxes)
+    move_x = overlap_x*np.sign(boxes[i, 0] - boxes[j, 0])
+    move_y = overlap_y*np.sign(boxes[i, 1] - boxes[j, 1])
+    delta_x = np.bincount(i, move_x, n) - np.bincount(j, move_x, n)
+    delta_y = np.bincount(i, move_y, n) - np.bincount(j, move_y, n)
+    return delta_x, delta_y
+
+def get_point_repulsion(x, y, boxes):
+    """
+    Gets how far each box should move to get the points inside it out of it
+    """
+    n = len(boxes)
+    b, p = get_points_in_boxes(x, y, boxes)
+    xp = np.asarray(x, dtype=float)[p]
+    yp = np.asarray(y, dtype=float)[p]
+    dir_x = np.sign((boxes[b, 0]+boxes[b, 2])/2 - xp)
+    dir_y = np.sign((boxes[b, 1]+boxes[b, 3])/2 - yp)
+    move_x = np.where(dir_x == -1, xp - boxes[b, 2],
+                      np.where(dir_x == 1, xp - boxes[b, 0], 0))
+    move_y = np.where(dir_y == -1, yp - boxes[b, 3],
+                      np.where(dir_y == 1, yp - boxes[b, 1], 0))
+    return np.bincount(b, move_x, n), np.bincount(b, move_y, n)
+
+def get_object_repulsion(boxes, object_boxes):
+    """
+    Gets how far each box should move to get away from other objects. There
+    are usually only a few of these so every box is compared with every object.
+    """
+    if len(object_boxes) == 0:
+        return np.zeros(len(boxes)), np.zeros(len(boxes))
+    overlap_x = (np.minimum(boxes[:, None, 2], object_boxes[None, :, 2]) -
+                 np.maximum(boxes[:, None, 0], object_boxes[None, :, 0]))
+    overlap_y = (np.minimum(boxes[:, None, 3], object_boxes[None, :, 3]) -
+                 np.maximum(boxes[:, None, 1], object_boxes[None, :, 1]))
+    overlapping = (overlap_x >= 0) & (overlap_y >= 0)
+    move_x = np.where(overlapping, overlap_x*np.sign(boxes[:, None, 0] -
+                                                     object_boxes[None, :, 0]), 0)
+    move_y = np.where(overlapping, overlap_y*np.sign(boxes[:, None, 1] -
+                                                     object_boxes[None, :, 1]), 0)
+    return move_x.sum(axis=1), move_y.sum(axis=1)
+
+def limit_moves_to_axes(boxes, delta_x, delta_y, ax):
+    """
+    Cancels the moves that would take boxes out of the axes
+    """
+    xmin, xmax = sorted(ax.get_xlim())
+    ymin, ymax = sorted(ax.get_ylim())
+    delta_x = np.where((boxes[:, 0]+delta_x < xmin) | (boxes[:, 2]+delta_x > xmax),
+                       0, delta_x)
+    delta_y = np.where((boxes[:, 1]+delta_y < ymin) | (boxes[:, 3]+delta_y > ymax),
+                       0, delta_y)
+    return delta_x, delta_y
+
 def move_texts(texts, delta_x, delta_y, bboxes=None, renderer=None, ax=None):
     if ax is None:
         ax = plt.gca()
@@ -65,31 +306,24 @@ def move_texts(texts, delta_x, delta_y, bboxes=None, renderer=None, ax=None):
         else:
             r = renderer
         bboxes = get_bboxes(texts, r, (1, 1))
-    xmin, xmax = ax.get_xlim()
-    ymin, ymax = ax.get_ylim()
-    for i, (text, dx, dy) in enumerate(zip(texts, delta_x, delta_y)):
-        bbox = bboxes[i]
-        x1, y1, x2, y2 = bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax
-        if x1 + dx < xmin:
-            dx = 0
-        if x2 + dx > xmax:
-            dx = 0
-        if y1 + dy < ymin:
-            dy = 0
-        if y2 + dy > ymax:
-            dy = 0
-
-        x, y = text.get_position()
-        newx = x + dx
-        newy = y + dy
-        text.set_position((newx, newy))
+    boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in bboxes],
+                     dtype=float).reshape(-1, 4)
+    delta_x, delta_y = limit_moves_to_axes(boxes, np.asarray(delta_x, dtype=float),
+                                           np.asarray(delta_y, dtype=float), ax)
+    positions = get_positions(texts)
+    positions[:, 0] += delta_x
+    positions[:, 1] += delta_y
+    set_positions(texts, positions)
 
 def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
                          renderer=None, ax=None,
                          direction='xy'):
     """
     For all text objects find alignment that causes the least overlap with
-    points and other texts and apply it
+    points and other texts and apply it.
+    Each text is measured once; the boxes of the other alignments are that box
+    shifted by a fraction of its size. Only the texts and points near each text
+    (found with a spatial hash) are compared with it.
     """
     if ax is None:
         ax = plt.gca()
@@ -97,9 +331,19 @@ def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
         r = get_renderer(ax.get_figure())
     else:
         r = renderer
-    xmin, xmax = ax.get_xlim()
-    ymin, ymax = ax.get_ylim()
-    bboxes = get_bboxes(texts, r, expand)
+    if len(texts) == 0:
+        return texts
+    xmin, xmax = sorted(ax.get_xlim())
+    ymin, ymax = sorted(ax.get_ylim())
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    boxes = get_bbox_arrays(texts, r, expand, ax)
+    object_boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in add_bboxes],
+                            dtype=float).reshape(-1, 4)
+
+    # where the text's anchor is across its box for each alignment
+    ha_fraction = {'left': 0., 'center': 0.5, 'right': 1.}
+    va_fraction = {'bottom': 0., 'center': 0.5, 'top': 1.}
     if 'x' not in direction:
         ha = ['']
     else:
@@ -109,35 +353,70 @@ def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
     else:
         va = ['bottom', 'top', 'center']
     alignment = list(product(ha, va))
-    for i, text in enumerate(texts):
+
+    # the boxes of the texts when they are centred on their positions
+    for text in texts:
+        if 'x' in direction:
+            text.set_ha('center')
+        if 'y' in direction:
+            text.set_va('center')
+    centred = get_bbox_arrays(texts, r, (1, 1), ax)
+    width = centred[:, 2] - centred[:, 0]
+    height = centred[:, 3] - centred[:, 1]
+    expanded_width = width*expand[0]
+    expanded_height = height*expand[1]
+
+    # every alignment of a text is inside this box, so texts and points outside it can't overlap
+    reach = np.column_stack([centred[:, 0]-width, centred[:, 1]-height,
+                             centred[:, 2]+width, centred[:, 3]+height])
+    reach_expanded = np.column_stack([reach[:, 0]-expanded_width, reach[:, 1]-expanded_height,
+                                      reach[:, 2]+expanded_width, reach[:, 3]+expanded_height])
+    n = len(texts)
+    i, j, _, _ = get_overlapping_pairs(reach_expanded)
+    i, j = np.concatenate([i, j]), np.concatenate([j, i])
+    order = np.argsort(i, kind='mergesort')
+    text_neighbours = np.split(j[order], np.searchsorted(i[order], np.arange(1, n)))
+    b, p = get_points_in_boxes(x, y, reach_expanded)
+    order = np.argsort(b, kind='mergesort')
+    point_neighbours = np.split(p[order], np.searchsorted(b[order], np.arange(1, n)))
+
+    for k, text in enumerate(texts):
+        cx = (centred[k, 0]+centred[k, 2])/2
+        cy = (centred[k, 1]+centred[k, 3])/2
+        other_boxes = np.vstack([boxes[text_neighbours[k]], object_boxes])
+        these_x = x[point_neighbours[k]]
+        these_y = y[point_neighbours[k]]
         counts = []
         for h, v in alignment:
-            if h:
-                text.set_ha(h)
-            if v:
-                text.set_va(v)
-            bbox = text.get_window_extent(r).expanded(*expand).\
-                                       transformed(ax.transData.inverted())
-            c = len(get_points_inside_bbox(x, y, bbox))
-            intersections = [bbox.intersection(bbox, bbox2) for bbox2 in
-                             bboxes+add_bboxes]
-            intersections = sum([abs(b.width*b.height) if b is not None else 0
-                                 for b in intersections])
+            shift_x = (0.5 - ha_fraction[h])*width[k] if h else 0
+            shift_y = (0.5 - va_fraction[v])*height[k] if v else 0
+            x1 = cx + shift_x - expanded_width[k]/2
+            x2 = cx + shift_x + expanded_width[k]/2
+            y1 = cy + shift_y - expanded_height[k]/2
+            y2 = cy + shift_y + expanded_height[k]/2
+            c = np.count_nonzero((these_x > x1) & (these_x < x2) &
+                                 (these_y > y1) & (these_y < y2))
+            overlap_x = np.minimum(x2, other_boxes[:, 2]) - np.maximum(x1, other_boxes[:, 0])
+            overlap_y = np.minimum(y2, other_boxes[:, 3]) - np.maximum(y1, other_boxes[:, 1])
+            intersections = np.sum(np.where((overlap_x >= 0) & (overlap_y >= 0),
+                                            np.abs(overlap_x*overlap_y), 0))
             # Check for out-of-axes position
-            bbox = text.get_window_extent(r).transformed(ax.transData.inverted())
-            x1, y1, x2, y2 = bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax
-            if x1 < xmin or x2 > xmax or y1 < ymin or y2 > ymax:
+            if (cx + shift_x - width[k]/2 < xmin or cx + shift_x + width[k]/2 > xmax or
+                    cy + shift_y - height[k]/2 < ymin or cy + shift_y + height[k]/2 > ymax):
                 axout = 1
             else:
                 axout = 0
             counts.append((axout, c, intersections))
         a, value = min(enumerate(counts), key=itemgetter(1))
+        h, v = alignment[a]
         if 'x' in direction:
-            text.set_ha(alignment[a][0])
+            text.set_ha(h)
         if 'y' in direction:
-            text.set_va(alignment[a][1])
-        bboxes[i] = text.get_window_extent(r).expanded(*expand).\
-                                       transformed(ax.transData.inverted())
+            text.set_va(v)
+        shift_x = (0.5 - ha_fraction[h])*width[k] if h else 0
+        shift_y = (0.5 - va_fraction[v])*height[k] if v else 0
+        boxes[k] = [cx + shift_x - expanded_width[k]/2, cy + shift_y - expanded_height[k]/2,
+                    cx + shift_x + expanded_width[k]/2, cy + shift_y + expanded_height[k]/2]
     return texts
 
 def repel_text(texts, renderer=None, ax=None, expand=(1.2, 1.2),
@@ -156,33 +435,9 @@ def repel_text(texts, renderer=None, ax=None, expand=(1.2, 1.2),
     else:
         r = renderer
     bboxes = get_bboxes(texts, r, expand)
-    xmins = [bbox.xmin for bbox in bboxes]
-    xmaxs = [bbox.xmax for bbox in bboxes]
-    ymaxs = [bbox.ymax for bbox in bboxes]
-    ymins = [bbox.ymin for bbox in bboxes]
-
-    overlaps_x = np.zeros((len(bboxes), len(bboxes)))
-    overlaps_y = np.zeros_like(overlaps_x)
-    overlap_directions_x = np.zeros_like(overlaps_x)
-    overlap_directions_y = np.zeros_like(overlaps_y)
-    for i, bbox1 in enumerate(bboxes):
-        overlaps = get_points_inside_bbox(xmins*2+xmaxs*2, (ymins+ymaxs)*2,
-                                             bbox1) % len(bboxes)
-        overlaps = np.unique(overlaps)
-        for j in overlaps:
-            bbox2 = bboxes[j]
-            x, y = bbox1.intersection(bbox1, bbox2).size
-            overlaps_x[i, j] = x
-            overlaps_y[i, j] = y
-            direction = np.sign(bbox1.extents - bbox2.extents)[:2]
-            overlap_directions_x[i, j] = direction[0]
-            overlap_directions_y[i, j] = direction[1]
-
-    move_x = overlaps_x*overlap_directions_x
-    move_y = overlaps_y*overlap_directions_y
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
+    boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in bboxes],
+                     dtype=float).reshape(-1, 4)
+    delta_x, delta_y = get_text_repulsion(boxes)
 
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
@@ -208,29 +463,11 @@ def repel_text_from_bboxes(add_bboxes, texts, renderer=None, ax=None,
         r = renderer
 
     bboxes = get_bboxes(texts, r, expand)
-
-    overlaps_x = np.zeros((len(bboxes), len(add_bboxes)))
-    overlaps_y = np.zeros_like(overlaps_x)
-    overlap_directions_x = np.zeros_like(overlaps_x)
-    overlap_directions_y = np.zeros_like(overlaps_y)
-
-    for i, bbox1 in enumerate(bboxes):
-        for j, bbox2 in enumerate(add_bboxes):
-            try:
-                x, y = bbox1.intersection(bbox1, bbox2).size
-                direction = np.sign(bbox1.extents - bbox2.extents)[:2]
-                overlaps_x[i, j] = x
-                overlaps_y[i, j] = y
-                overlap_directions_x[i, j] = direction[0]
-                overlap_directions_y[i, j] = direction[1]
-            except AttributeError:
-                pass
-
-    move_x = overlaps_x*overlap_directions_x
-    move_y = overlaps_y*overlap_directions_y
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
+    boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in bboxes],
+                     dtype=float).reshape(-1, 4)
+    object_boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in add_bboxes],
+                            dtype=float).reshape(-1, 4)
+    delta_x, delta_y = get_object_repulsion(boxes, object_boxes)
 
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
@@ -257,20 +494,10 @@ def repel_text_from_points(x, y, texts, renderer=None, ax=None,
     else:
         r = renderer
     bboxes = get_bboxes(texts, r, expand)
+    boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in bboxes],
+                     dtype=float).reshape(-1, 4)
+    delta_x, delta_y = get_point_repulsion(x, y, boxes)
 
-    move_x = np.zeros((len(bboxes), len(x)))
-    move_y = np.zeros((len(bboxes), len(x)))
-    for i, bbox in enumerate(bboxes):
-        xy_in = get_points_inside_bbox(x, y, bbox)
-        for j in xy_in:
-            xp, yp = x[j], y[j]
-            dx, dy = overlap_bbox_and_point(bbox, xp, yp)
-
-            move_x[i, j] = dx
-            move_y[i, j] = dy
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
         move_texts(texts, delta_x, delta_y, bboxes, ax=ax)
@@ -288,8 +515,9 @@ def repel_text_from_axes(texts, ax=None, bboxes=None, renderer=None,
         expand = (1, 1)
     if bboxes is None:
         bboxes = get_bboxes(texts, r, expand=expand)
-    xmin, xmax = ax.get_xlim()
-    ymin, ymax = ax.get_ylim()
+    # sorted so that inverted axes (e.g. maps with the northing flipped) work
+    xmin, xmax = sorted(ax.get_xlim())
+    ymin, ymax = sorted(ax.get_ylim())
     for i, bbox in enumerate(bboxes):
         x1, y1, x2, y2 = bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax
         dx, dy = 0, 0
@@ -312,7 +540,7 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
                 expand_objects=(1.2, 1.2), expand_align=(0.9, 0.9),
                 autoalign='xy',  va='center', ha='center',
                 force_text=0.5, force_points=0.5, force_objects=0.5,
-                lim=100, precision=0,
+                lim=100, precision=0, time_lim=None,
                 only_move={}, text_from_text=True, text_from_points=True,
                 save_steps=False, save_prefix='', save_format='png',
                 add_step_numbers=True, draggable=True,
@@ -323,6 +551,11 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
     from each other and from points. In the end hides texts and substitutes
     them with annotations to link them to the respective points.
 
+    The sizes of the texts are got from the renderer once, after they are
+    aligned, and their boxes then follow their positions, so the axes should be
+    linear. Overlaps are found with a spatial hash and the moves of all the
+    texts are worked out together with numpy.
+
     Args:
         texts (list): a list of text.Text objects to adjust
         x (seq): x-coordinates of points to repel from; if not provided only
@@ -357,6 +590,9 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
         precision (float): up to which sum of all overlaps along both x and y
             to iterate; may need to increase for complicated situations;
             default 0, so no overlaps with anything.
+        time_lim (float): if not None, the iterations stop after this many
+            seconds even if lim hasn't been reached, so that big sets of
+            labels finish in a bounded time; default None
         only_move (dict): a dict to restrict movement of texts to only certain
             axis. Valid keys are 'points' and 'text', for each of them valid
             values are 'x', 'y' and 'xy'. This way you can forbid moving texts
@@ -427,66 +663,82 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
             plt.title('0b')
         plt.savefig(save_prefix+'0b.'+save_format, format=save_format)
     texts = repel_text_from_axes(texts, ax, renderer=r, expand=expand_points)
+    if len(texts) == 0:
+        return 0
+
+    # the boxes of the texts relative to their positions, which don't change as they move
+    positions = get_positions(texts)
+    offsets_text = get_text_offsets(texts, r, expand_text, ax)
+    offsets_points = get_text_offsets(texts, r, expand_points, ax)
+    offsets_objects = get_text_offsets(texts, r, expand_objects, ax)
+    offsets = get_text_offsets(texts, r, (1, 1), ax)
+    object_boxes = np.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in add_bboxes],
+                            dtype=float).reshape(-1, 4)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    zeros = np.zeros(len(texts))
+
+    start_time = time.time()
     history = [np.inf]*5
     for i in range(lim):
-        q1, q2 = np.inf, np.inf
+        corners = positions[:, [0, 1, 0, 1]]
 
         if text_from_text:
-            d_x_text, d_y_text, q1 = repel_text(texts, renderer=r, ax=ax,
-                                                expand=expand_text)
+            d_x_text, d_y_text = get_text_repulsion(corners + offsets_text)
         else:
-            d_x_text, d_y_text, q1 = [0]*len(texts), [0]*len(texts), 0
+            d_x_text, d_y_text = zeros, zeros
 
         if text_from_points:
-            d_x_points, d_y_points, q2 = repel_text_from_points(x, y, texts,
-                                                   ax=ax, renderer=r,
-                                                   expand=expand_points)
+            d_x_points, d_y_points = get_point_repulsion(x, y, corners + offsets_points)
         else:
-            d_x_points, d_y_points, q2 = [0]*len(texts), [0]*len(texts), 0
+            d_x_points, d_y_points = zeros, zeros
 
         if text_from_objects:
-            d_x_objects, d_y_objects, q3 = repel_text_from_bboxes(add_bboxes,
-                                                                  texts,
-                                                             ax=ax, renderer=r,
-                                                         expand=expand_objects)
+            d_x_objects, d_y_objects = get_object_repulsion(corners + offsets_objects,
+                                                            object_boxes)
         else:
-            d_x_objects, d_y_objects, q3 = [0]*len(texts), [0]*len(texts), 0
+            d_x_objects, d_y_objects = zeros, zeros
+        q = round(np.sum(np.abs(d_x_text) + np.abs(d_y_text)) +
+                  np.sum(np.abs(d_x_points) + np.abs(d_y_points)) +
+                  np.sum(np.abs(d_x_objects) + np.abs(d_y_objects)), 5)
 
         if only_move:
             if 'text' in only_move:
                 if 'x' not in only_move['text']:
-                    d_x_text = np.zeros_like(d_x_text)
+                    d_x_text = zeros
                 if 'y' not in only_move['text']:
-                    d_y_text = np.zeros_like(d_y_text)
+                    d_y_text = zeros
             if 'points' in only_move:
                 if 'x' not in only_move['points']:
-                    d_x_points = np.zeros_like(d_x_points)
+                    d_x_points = zeros
                 if 'y' not in only_move['points']:
-                    d_y_points = np.zeros_like(d_y_points)
+                    d_y_points = zeros
             if 'objects' in only_move:
                 if 'x' not in only_move['objects']:
-                    d_x_objects = np.zeros_like(d_x_objects)
+                    d_x_objects = zeros
                 if 'y' not in only_move['objects']:
-                    d_y_objects = np.zeros_like(d_y_objects)
-        dx = (np.array(d_x_text) * force_text +
-              np.array(d_x_points) * force_points +
-              np.array(d_x_objects) * force_objects)
-        dy = (np.array(d_y_text) * force_text +
-              np.array(d_y_points) * force_points +
-              np.array(d_y_objects) * force_objects)
-        q = round(q1+q2+q3, 5)
+                    d_y_objects = zeros
+        dx = (d_x_text * force_text + d_x_points * force_points +
+              d_x_objects * force_objects)
+        dy = (d_y_text * force_text + d_y_points * force_points +
+              d_y_objects * force_objects)
         if q > precision and q < np.max(history):
             history.pop(0)
             history.append(q)
-            move_texts(texts, dx, dy,
-                       bboxes = get_bboxes(texts, r, (1, 1)), ax=ax)
+            dx, dy = limit_moves_to_axes(corners + offsets, dx, dy, ax)
+            positions[:, 0] += dx
+            positions[:, 1] += dy
             if save_steps:
+                set_positions(texts, positions)
                 if add_step_numbers:
                     plt.title(i+1)
                 plt.savefig(save_prefix+str(i+1)+'.'+save_format,
                             format=save_format)
+            if time_lim is not None and time.time() - start_time > time_lim:
+                break
         else:
             break
+    set_positions(texts, positions)
 
     for j, text in enumerate(texts):
         a = ax.annotate(text.get_text(), xy = (orig_xy[j]),
@@ -8,10 +8,10 @@ ID algorithm, or in the Channel, using the channel network and measuring along
 this line. The mean, max, and total area wil be able to be calculated.)
 """
 
-import LSDMap_GDALIO as lsdgdal
+import LSDPlottingTools.LSDMap_GDALIO as lsdgdal
 import numpy as _np
-import matplotlib.pyplot as plt
 import glob
+import multiprocessing
 import os
 import re
 
@@ -28,7 +28,7 @@ def calculate_waterinundation_area(raster, cellsize, threshold):
     """Note: this will probably need some sort of threshold as Caesar maps 
     out very small water depths and so could give huge 'inundation' areas."""
     total_cells = _np.count_nonzero(raster > threshold)
-    area = DX * DX * total_cells  # metres
+    area = cellsize * cellsize * total_cells  # metres
     
     print("Inundation area is: ", area, " metres square")
     return area
@@ -95,79 +95,260 @@ def natural_key(string_):
     """
     return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', string_)]
 
-def simulation_inundation_timeseries(glob_wildcard, floodplain_mask, stream_mask,
-                                     threshold=0,
-                                     savefilename="inundation_metrics.txt"):
-    """Creates a timeseries of a given inundation metric. 
+class InundationMetric(object):
+    """A metric of the water depths in one zone of the domain. 
     
-    Options should be:
-        Inundation Area (Entire catchment)
-        Mean Water Depth (Entire catchment)
-        Mean Water Depth (Floodplain only)
-        Mean Water Depth (Channel)
+    Zones are given as flat indices into the water depth raster (worked out once
+    by zone_indices), so each metric only touches the cells of its zone. Subclasses
+    implement compute; write your own to add a metric to the time series.
     """
-    # Create an empty array with the correct number of columns
-    data_array = _np.empty((0,5), dtype=_np.float32)
-    print("Data array shape: ", data_array.shape)
-
-    for water_raster_file in sorted(glob.glob(glob_wildcard), key=natural_key):
-        print(water_raster_file)
-        water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
-        
-        timestep_row = [] # Empty list to store elements of the row
-        cur_timestep = timestep_string_from_filename(water_raster_file) # get the current timestep by parsing the filename
-
-        # Inundation area
-        this_inundation_area = calculate_waterinundation_area(water_raster, DX, 0.02)
-        this_mean_catchment_waterdepth = calculate_mean_waterdepth(water_raster)
-        this_mean_floodplain_waterdepth = floodplain_mean_depth(water_raster, floodplain_mask)
-        this_mean_mainchannel_waterdepth = main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
+    def __init__(self, zone="catchment", threshold=0.0, name=None):
+        self.zone = zone
+        self.threshold = threshold
+        self.name = name if name is not None else self.default_name()
         
-        # Append each value to the current row list object
-        timestep_row.append([cur_timestep,
-                             this_inundation_area,
-                             this_mean_catchment_waterdepth,
-                             this_mean_floodplain_waterdepth,
-                             this_mean_mainchannel_waterdepth])
-        # Convert the list into a numpy array
-        timestep_row = _np.asarray(timestep_row, dtype=_np.float32)
+    def default_name(self):
+        return self.__class__.__name__ + "_" + self.zone
         
-        # Now append (stack) that row onto the bottom of the array (axis=0)
-        data_array = _np.append(data_array, timestep_row, axis=0)
+    def __call__(self, water_raster, zones, cellsize):
+        indices = zones[self.zone]
+        if indices is None:
+            depths = water_raster.ravel()
+        else:
+            depths = water_raster.ravel()[indices]
+        return self.compute(depths, water_raster, indices, cellsize)
     
-    print(data_array)
-    print(data_array.shape)
+    def compute(self, depths, water_raster, indices, cellsize):
+        raise NotImplementedError
+
+
+class AreaAboveThreshold(InundationMetric):
+    """The area (in square metres) of the zone where the water is deeper than the threshold."""
+    def default_name(self):
+        return "area_" + self.zone
+    
+    def compute(self, depths, water_raster, indices, cellsize):
+        return cellsize * cellsize * _np.count_nonzero(depths > self.threshold)
+
+
+class MeanDepth(InundationMetric):
+    """The mean water depth in the zone (nodata is ignored). Only cells deeper 
+    than the threshold are counted if the threshold is above zero."""
+    def default_name(self):
+        return "mean_depth_" + self.zone
+    
+    def compute(self, depths, water_raster, indices, cellsize):
+        if self.threshold > 0:
+            depths = depths[depths > self.threshold]
+        if depths.size == 0 or _np.all(_np.isnan(depths)):
+            return _np.nan
+        return _np.nanmean(depths)
+
+
+class MaxDepth(InundationMetric):
+    """The maximum water depth in the zone (nodata is ignored)."""
+    def default_name(self):
+        return "max_depth_" + self.zone
     
-    with open(savefilename,'wb') as f:
-        _np.savetxt(f, data_array, fmt='%i %f %f %f %f')
+    def compute(self, depths, water_raster, indices, cellsize):
+        if depths.size == 0 or _np.all(_np.isnan(depths)):
+            return _np.nan
+        return _np.nanmax(depths)
+
+
+class WettedPerimeter(InundationMetric):
+    """A proxy of the wetted perimeter in the zone: the length (in metres) of the
+    edges between wet cells (deeper than the threshold) and dry cells."""
+    def default_name(self):
+        return "wetted_perimeter_" + self.zone
+    
+    def compute(self, depths, water_raster, indices, cellsize):
+        wet = water_raster > self.threshold
+        
+        # count the dry neighbours (in the four directions) of every wet cell
+        dry_edges = _np.zeros(wet.shape, dtype=_np.uint8)
+        dry_edges[1:,:] += wet[1:,:] & ~wet[:-1,:]
+        dry_edges[:-1,:] += wet[:-1,:] & ~wet[1:,:]
+        dry_edges[:,1:] += wet[:,1:] & ~wet[:,:-1]
+        dry_edges[:,:-1] += wet[:,:-1] & ~wet[:,1:]
+        
+        if indices is None:
+            n_edges = _np.sum(dry_edges, dtype=_np.int64)
+        else:
+            n_edges = _np.sum(dry_edges.ravel()[indices], dtype=_np.int64)
+        return cellsize * n_edges
+
+
+def default_inundation_metrics(area_threshold=0.02):
+    """The metrics of the original inundation time series: the inundated area, and the mean
+    water depth in the catchment, on the floodplain and in the main channel."""
+    return [AreaAboveThreshold("catchment", area_threshold),
+            MeanDepth("catchment"),
+            MeanDepth("floodplain"),
+            MeanDepth("main_channel")]
+
+
+def zone_indices(floodplain_mask=None, stream_mask=None, main_channel_order=5):
+    """Works out the flat indices of the cells in each zone, once for the whole time series.
+    
+    Returns a dict with the zones "catchment" (None, meaning every cell), "floodplain"
+    (cells flagged 1 in the floodplain mask), "channel" (any cell of the stream order
+    raster) and "main_channel" (cells of main_channel_order in the stream order raster).
+    """
+    zones = {"catchment": None}
+    if floodplain_mask is not None:
+        zones["floodplain"] = _np.flatnonzero(_np.asarray(floodplain_mask) == 1)
+    if stream_mask is not None:
+        stream_mask = _np.asarray(stream_mask)
+        zones["channel"] = _np.flatnonzero(_np.isfinite(stream_mask) & (stream_mask > 0))
+        zones["main_channel"] = _np.flatnonzero(stream_mask == main_channel_order)
+    return zones
 
 
+# The zones, metrics and cellsize used by the worker processes. They are set
+# once per worker (inherited if the worker is forked) rather than sent with every frame.
+_worker_setup = None
 
+def _init_timeseries_worker(zones, metrics, cellsize):
+    global _worker_setup
+    _worker_setup = (zones, metrics, cellsize)
     
-"""Get your rasters into arrays"""    
-water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
-water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
-#raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
-floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
-stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
+def _timestep_metrics(water_raster_file):
+    """Reads one water depth raster and computes its row of the time series."""
+    zones, metrics, cellsize = _worker_setup
+    water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
+    
+    row = _np.empty(len(metrics) + 1)
+    row[0] = float(timestep_string_from_filename(water_raster_file))
+    for i, metric in enumerate(metrics):
+        row[i + 1] = metric(water_raster, zones, cellsize)
+    return row
 
-water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
 
-floodplain_mask = lsdgdal.ReadRasterArrayBlocks(floodplain_file)
-stream_mask = lsdgdal.ReadRasterArrayBlocks(stream_raster_file)
-#print(stream_mask)
+def inundation_timeseries(glob_wildcard, floodplain_mask=None, stream_mask=None,
+                          metrics=None, cellsize=None, main_channel_order=5,
+                          savefilename="inundation_metrics.txt", n_processes=None):
+    """Creates a time series of inundation metrics from a set of water depth rasters 
+    (e.g. CAESAR-Lisflood WaterDepths*.asc files).
+    
+    The zones are worked out once, the rasters are read and measured by a pool of
+    processes, and each row is written to savefilename as soon as it is ready, so a 
+    long run can be watched (and isn't lost) while it goes. 
+    
+    Args:
+        glob_wildcard (str): The water depth rasters, e.g. "Hydro/WaterDepths*.asc"
+        floodplain_mask (array): The floodplain raster (1 on the floodplain)
+        stream_mask (array): The stream order raster
+        metrics (list): InundationMetric objects, one per column. If None, the
+            default_inundation_metrics are used.
+        cellsize (float): The cell size in metres. If None it is read from the first raster.
+        main_channel_order (int): The stream order of the main channel
+        savefilename (str): The text file the time series is written to. None to not write one.
+        n_processes (int): The number of processes. If None, one per cpu. 1 runs in this process.
+    
+    Returns:
+        numpy array: One row per time step: the time step and then one column per metric.
+    """
+    water_raster_files = sorted(glob.glob(glob_wildcard), key=natural_key)
+    if len(water_raster_files) == 0:
+        raise Exception("No water depth rasters match " + glob_wildcard)
+    
+    if metrics is None:
+        metrics = default_inundation_metrics()
+    if cellsize is None:
+        cellsize = lsdgdal.GetUTMMaxMin(water_raster_files[0])[0]
+    zones = zone_indices(floodplain_mask, stream_mask, main_channel_order)
+    for metric in metrics:
+        if metric.zone not in zones:
+            raise Exception("The metric " + metric.name + " needs the " + metric.zone + " zone, but there is no mask for it")
+    
+    # The whole table is allocated up front and filled as the rows come in
+    data_array = _np.full((len(water_raster_files), len(metrics) + 1), _np.nan)
+    print("Data array shape: ", data_array.shape)
+    
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = max(min(n_processes, len(water_raster_files)), 1)
+    
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes, initializer=_init_timeseries_worker,
+                                    initargs=(zones, metrics, cellsize))
+        rows = pool.imap(_timestep_metrics, water_raster_files, chunksize=4)
+    else:
+        pool = None
+        _init_timeseries_worker(zones, metrics, cellsize)
+        rows = (_timestep_metrics(f) for f in water_raster_files)
+    
+    save_file = None
+    if savefilename is not None:
+        save_file = open(savefilename, 'w')
+        save_file.write("# timestep " + " ".join([metric.name for metric in metrics]) + "\n")
+    
+    row_format = "%i" + " %f" * len(metrics)
+    try:
+        for i, row in enumerate(rows):
+            data_array[i] = row
+            if save_file is not None:
+                save_file.write(row_format % tuple(row) + "\n")
+                save_file.flush()
+    finally:
+        if save_file is not None:
+            save_file.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    return data_array
+
 
-DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
-print(DX)
+def simulation_inundation_timeseries(glob_wildcard, floodplain_mask, stream_mask,
+                                     threshold=0.02,
+                                     savefilename="inundation_metrics.txt", 
+                                     n_processes=None):
+    """Creates a timeseries of a given inundation metric. 
+    
+    Options should be:
+        Inundation Area (Entire catchment)
+        Mean Water Depth (Entire catchment)
+        Mean Water Depth (Floodplain only)
+        Mean Water Depth (Channel)
+        
+    The threshold is the water depth above which a cell counts as inundated.
+    See inundation_timeseries to choose other metrics.
+    """
+    data_array = inundation_timeseries(glob_wildcard, floodplain_mask, stream_mask,
+                                       metrics=default_inundation_metrics(threshold),
+                                       savefilename=savefilename,
+                                       n_processes=n_processes)
+    print(data_array.shape)
+    return data_array
 
-"""Calculate the depths and areas"""
-#calculate_mean_waterdepth(water_raster)
-#calcualte_max_waterdepth(water_raster)
-#calculate_waterinundation_area(water_raster, DX, 0.02)
-#floodplain_mean_depth(water_raster, floodplain_mask)
-#main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
 
-"""Make the timeseries file"""
-simulation_inundation_timeseries(water_raster_wildcard, floodplain_mask,
-                                 stream_mask,
-                                 savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
+if __name__ == "__main__":
+    """Get your rasters into arrays"""    
+    water_raster_wildcard = "/run/media/dav/SHETLAND/ModelRuns/Ryedale_storms/Gridded/Hydro/WaterDepths*.asc"
+    water_raster_file = "/mnt/SCRATCH/Analyses/HydrogeomorphPaper/peak_flood_maps/ryedale/WaterDepths2880_GRID_TLIM.asc"
+    #raster_file = "/run/media/dav/SHETLAND/Analyses/HydrogeomorphPaper/peak_flood_maps/boscastle/peak_flood/WaterDepths2400_GRID_HYDRO.asc"
+    floodplain_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_FP.bil"
+    stream_raster_file = "/mnt/SCRATCH/Analyses/ChannelMaskAnalysis/floodplain_ryedale/RyedaleElevations_SO.bil"
+    
+    water_raster = lsdgdal.ReadRasterArrayBlocks(water_raster_file)
+    
+    floodplain_mask = lsdgdal.ReadRasterArrayBlocks(floodplain_file)
+    stream_mask = lsdgdal.ReadRasterArrayBlocks(stream_raster_file)
+    #print(stream_mask)
+    
+    DX = lsdgdal.GetUTMMaxMin(water_raster_file)[0]   # I never realised you could do this!
+    print(DX)
+    
+    """Calculate the depths and areas"""
+    #calculate_mean_waterdepth(water_raster)
+    #calcualte_max_waterdepth(water_raster)
+    #calculate_waterinundation_area(water_raster, DX, 0.02)
+    #floodplain_mean_depth(water_raster, floodplain_mask)
+    #main_channel_mean_depth(water_raster, floodplain_mask, stream_mask)
+    
+    """Make the timeseries file"""
+    simulation_inundation_timeseries(water_raster_wildcard, floodplain_mask,
+                                     stream_mask,
+                                     savefilename="ryedale_inundation_GRIDDED_HYDRO.txt")
@@ -7,9 +7,7 @@ Created on Sat Feb 11 11:40:41 2017
 """
 
 import LSDPlottingTools.LSDMap_GDALIO as lsdio
-
-import numpy as np
-import scipy as sp
+import LSDPlottingTools.LSDMap_BasicManipulation as LSDMap_BM
 
 
 Zenith = 45
@@ -26,8 +24,4 @@ RasterData = lsdio.ReadRasterArrayBlocks(File)
 def Hillshade_Smooth(RasterData, altitude, azimuth, z_factor):
     """Plots a Hillshade a la LSDRaster"""
     
-    zenith_rad = sp.deg2rad(altitude)
-    azimuth_rad = sp.deg2rad(azimuth)
-    
-    
-    
\ No newline at end of file
+    return LSDMap_BM.HillshadeArray(RasterData, azimuth, altitude, z_factor)
@@ -19,6 +19,7 @@ import LSDPlottingTools as LSDPT
 def main(argv):
  
     # If there are no arguments, send to the welcome screen
+    force = False
     if not len(sys.argv) > 1:
         full_paramfile = print_welcome()
         #sys.exit()
@@ -27,11 +28,31 @@ def main(argv):
         # Get the arguments
         import argparse
         parser = argparse.ArgumentParser()
-        parser.add_argument("-pf", "--parameter_file",type=str, default="Params.param", 
-                            help="The name, with extension and path, of your parameter file.")    
+        parser.add_argument("-pf", "--parameter_file",type=str, nargs="+", default=["Params.param"], 
+                            help="The name, with extension and path, of your parameter file. Give several files (or a pattern like \"*/Params.param\") to run a batch.")    
+        parser.add_argument("-f", "--force", action="store_true", default=False,
+                            help="Remake all the figures, even the ones that are up to date.")
+        
+        # These are for running a batch of parameter files
+        parser.add_argument("-t", "--template", type=str, default=None,
+                            help="A template parameter file. With --catchment_table, a parameter file is made for each catchment and they are run as a batch.")
+        parser.add_argument("-ct", "--catchment_table", type=str, default=None,
+                            help="A csv file with one row per catchment, whose columns fill in the $names in the template.")
+        parser.add_argument("-np", "--n_workers", type=int, default=None,
+                            help="The number of parameter files run at the same time in a batch. The default is one per cpu.")
+        parser.add_argument("-to", "--timeout", type=float, default=None,
+                            help="The time limit of each job in a batch, in seconds.")
+        parser.add_argument("-mem", "--memory_MB", type=float, default=None,
+                            help="The memory cap of each job in a batch, in megabytes.")
+        parser.add_argument("-jl", "--job_log", type=str, default="MappingBatch_joblog.txt",
+                            help="The job log of the batch. Run the batch again with the same log to pick up where it stopped.")
         args = parser.parse_args()
 
-        full_paramfile = args.parameter_file
+        force = args.force
+        if args.template is not None or len(args.parameter_file) > 1 or any(c in args.parameter_file[0] for c in "*?["):
+            run_batch(args)
+            return
+        full_paramfile = args.parameter_file[0]
     
     print("The full parameter file is: "+full_paramfile)
     
@@ -45,11 +66,33 @@ def main(argv):
     print(PD.plotting_switches)
     
     # Now make some plots!!
-    PD.plot_data()
+    PD.plot_data(force = force)
     
 #=============================================================================
     
     
+#=============================================================================
+# This runs a batch of parameter files 
+#=============================================================================
+def run_batch(args):
+
+    if args.template is not None:
+        if args.catchment_table is None:
+            print("You need to give a catchment table (-ct) to go with the template.")
+            sys.exit()
+        param_files = LSDPT.WriteParameterFilesFromTemplate(args.template, args.catchment_table)
+    else:
+        param_files = LSDPT.ExpandParameterFiles(args.parameter_file)
+    
+    statuses = LSDPT.RunBatch(param_files, args.job_log, n_workers = args.n_workers, 
+                              timeout = args.timeout, memory_MB = args.memory_MB, 
+                              force = args.force)
+    
+    for param_file in param_files:
+        print(statuses[os.path.abspath(param_file)]+": "+param_file)
+#=============================================================================
+    
+
 #=============================================================================    
 # This is just a welcome screen that is displayed if no arguments are provided.
 #=============================================================================
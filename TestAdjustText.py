@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the spatial hash that adjust_text uses to find overlapping labels against
+a brute force search of every pair.
+"""
+
+import numpy as np
+from LSDPlottingTools import adjust_text
+
+def BruteForcePairs(boxes):
+    """Every pair of finite boxes (i < j) that overlap."""
+    pairs = set()
+    for i in range(len(boxes)):
+        for j in range(i+1, len(boxes)):
+            if not (np.all(np.isfinite(boxes[i])) and np.all(np.isfinite(boxes[j]))):
+                continue
+            if (min(boxes[i, 2], boxes[j, 2]) >= max(boxes[i, 0], boxes[j, 0]) and
+                    min(boxes[i, 3], boxes[j, 3]) >= max(boxes[i, 1], boxes[j, 1])):
+                pairs.add((i, j))
+    return pairs
+
+def BruteForcePoints(x, y, boxes):
+    """Every (box, point) pair with the point strictly inside a finite box."""
+    pairs = set()
+    for b in range(len(boxes)):
+        if not np.all(np.isfinite(boxes[b])):
+            continue
+        for p in range(len(x)):
+            if boxes[b, 0] < x[p] < boxes[b, 2] and boxes[b, 1] < y[p] < boxes[b, 3]:
+                pairs.add((b, p))
+    return pairs
+
+def RandomBoxes(rng, n, size):
+    corners = rng.uniform(0, 100, size = (n, 2))
+    sizes = rng.uniform(0.5, 1.5, size = (n, 2))*size
+    return np.column_stack([corners, corners+sizes])
+
+def CheckBoxes(boxes, x, y):
+    i, j, overlap_x, overlap_y = adjust_text.get_overlapping_pairs(boxes)
+    assert set(zip(i, j)) == BruteForcePairs(boxes)
+    assert len(set(zip(i, j))) == len(i)
+    assert np.all(overlap_x >= 0) and np.all(overlap_y >= 0)
+    b, p = adjust_text.get_points_in_boxes(x, y, boxes)
+    assert set(zip(b, p)) == BruteForcePoints(x, y, boxes)
+    assert len(set(zip(b, p))) == len(b)
+
+def TestSpatialHash():
+
+    rng = np.random.RandomState(3)
+    for n, size in [(50, 5.), (200, 10.), (20, 60.)]:
+        boxes = RandomBoxes(rng, n, size)
+        x, y = rng.uniform(0, 100, 300), rng.uniform(0, 100, 300)
+        CheckBoxes(boxes, x, y)
+    print("Overlaps match the brute force search")
+
+    # one box far bigger than the others is checked against everything rather
+    # than put in a grid of cells the size of the small boxes
+    boxes = np.array([[0., 0., 0.001, 0.001], [0.0005, 0.0005, 0.0015, 0.0015],
+                      [5., 5., 5.001, 5.001], [10., 10., 10.001, 10.001],
+                      [20., 20., 20.001, 20.001], [-5000., -5000., 5000., 5000.]])
+    x, y = np.array([0.0006, 5.0005, 7000.]), np.array([0.0006, 5.0005, 0.])
+    CheckBoxes(boxes, x, y)
+    print("A huge box doesn't blow up the grid")
+
+    # boxes and points that aren't finite are skipped
+    boxes = RandomBoxes(rng, 30, 10.)
+    boxes[4, 0] = np.nan
+    boxes[7, 3] = np.inf
+    x, y = rng.uniform(0, 100, 50), rng.uniform(0, 100, 50)
+    x[3] = np.nan
+    y[9] = -np.inf
+    CheckBoxes(boxes, x, y)
+    print("Boxes and points that aren't finite are skipped")
+
+if __name__ == "__main__":
+    TestSpatialHash()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the grids LSDMap_PointTools.AggregatePointsToGrid makes from a few
+points whose cells are known.
+"""
+
+import numpy as np
+from LSDPlottingTools import LSDMap_PointTools as LSDMap_PT
+
+def TestAggregatePointsToGrid():
+
+    # a 4 x 2 grid of unit cells. The fourth point is on the far corner so it goes
+    # in the last cell, the fifth is outside and the sixth has no value
+    x = np.array([0.5, 0.2, 3.5, 4.0, 5.0, 2.5])
+    y = np.array([1.5, 1.9, 0.5, 0.0, 1.0, 1.5])
+    values = np.array([1., 3., 10., 7., 100., np.nan])
+    extent = [0, 4, 0, 2]
+
+    expected = {"count": (2., 2.), "mean": (2., 8.5), "max": (3., 10.),
+                "min": (1., 7.), "last": (3., 7.)}
+
+    for method in LSDMap_PT.AGGREGATION_METHODS:
+        grid = LSDMap_PT.AggregatePointsToGrid(x, y, extent, 4, values = values, method = method)
+        assert grid.shape == (2, 4)
+        # row 0 is at the top of the extent
+        assert grid[0, 0] == expected[method][0], method
+        assert grid[1, 3] == expected[method][1], method
+        empty = np.ones(grid.shape, dtype = bool)
+        empty[0, 0] = empty[1, 3] = False
+        assert np.all(np.isnan(grid[empty])), method
+        print("The "+method+" grid is right")
+
+    # the count doesn't need values, so the point with no value is counted
+    grid = LSDMap_PT.AggregatePointsToGrid(x, y, extent, 4, method = "count")
+    assert grid[0, 2] == 1 and np.nansum(grid) == 5
+    print("The count without values is right")
+
+    try:
+        LSDMap_PT.AggregatePointsToGrid(x, y, extent, 4, values = values, method = "median")
+    except ValueError:
+        print("Unknown methods are rejected")
+    else:
+        raise Exception("The median method should have been rejected")
+
+if __name__ == "__main__":
+    TestAggregatePointsToGrid()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Checks how LSDMap_BatchDriver.RunBatch resumes a batch from its job log. The
+plotting driver is swapped for a stub job, so this doesn't need GDAL or data.
+
+Each stub parameter file says what its job does: "exit N" exits with code N and
+"sleep S" starts a child process that makes a marker file after S seconds, then
+waits for it (to check that a timeout stops the whole process group).
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from LSDPlottingTools import LSDMap_BatchDriver as LSDMap_BD
+
+def StubJob(param_file, force, plot_processes, memory_MB):
+    """This stands in for _RunBatchJob. It records that it ran, then does what
+    the parameter file says."""
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    with open(param_file+".ran", "a") as ran_file:
+        ran_file.write("ran\n")
+    with open(param_file, "r") as this_file:
+        action, value = this_file.read().split()
+    if action == "sleep":
+        marker = param_file+".marker"
+        child = subprocess.Popen([sys.executable, "-c",
+                                  "import time; time.sleep("+value+"); open('"+marker+"', 'w').close()"])
+        child.wait()
+        sys.exit(0)
+    sys.exit(int(value))
+
+def WriteParameterFile(directory, name, contents):
+    param_file = os.path.join(directory, name+".param")
+    with open(param_file, "w") as this_file:
+        this_file.write(contents)
+    return param_file
+
+def TimesRun(param_file):
+    if not os.path.isfile(param_file+".ran"):
+        return 0
+    with open(param_file+".ran", "r") as ran_file:
+        return len(ran_file.readlines())
+
+def TestResume():
+
+    directory = tempfile.mkdtemp()
+    LSDMap_BD._RunBatchJob = StubJob
+    try:
+        job_log = os.path.join(directory, "jobs.log")
+        done = WriteParameterFile(directory, "done", "exit 0")
+        changed = WriteParameterFile(directory, "changed", "exit 0")
+        failed = WriteParameterFile(directory, "failed", "exit 0")
+        killed = WriteParameterFile(directory, "killed", "exit 0")
+        new = WriteParameterFile(directory, "new", "exit 3")
+        bad_params = WriteParameterFile(directory, "bad_params", "exit 2")
+        crashed = WriteParameterFile(directory, "crashed", "exit 7")
+
+        # A log left by an earlier run, which was killed while "killed" was running
+        # and before "changed" had its parameter file edited
+        LSDMap_BD._AppendJobLog(job_log, {"job": done, "status": "done",
+                                          "param_hash": LSDMap_BD.GetParameterFileHash(done)})
+        LSDMap_BD._AppendJobLog(job_log, {"job": changed, "status": "done", "param_hash": "an old hash"})
+        LSDMap_BD._AppendJobLog(job_log, {"job": failed, "status": "failed",
+                                          "param_hash": LSDMap_BD.GetParameterFileHash(failed)})
+        LSDMap_BD._AppendJobLog(job_log, {"job": killed, "status": "started",
+                                          "param_hash": LSDMap_BD.GetParameterFileHash(killed)})
+
+        jobs = [done, changed, failed, killed, new, bad_params, crashed]
+        statuses = LSDMap_BD.RunBatch(jobs, job_log, n_workers = 3, retry_failed = False)
+        assert statuses == {done: "skipped", changed: "done", failed: "failed", killed: "done",
+                            new: "out_of_memory", bad_params: "failed", crashed: "failed"}, statuses
+        assert [TimesRun(job) for job in jobs] == [0, 1, 0, 1, 1, 1, 1]
+        print("Finished jobs are skipped, changed and killed jobs run again, exit codes are mapped")
+
+        # the failed jobs are retried by default, and the finished ones still skipped
+        statuses = LSDMap_BD.RunBatch(jobs, job_log, n_workers = 3)
+        assert statuses == {done: "skipped", changed: "skipped", failed: "done", killed: "skipped",
+                            new: "out_of_memory", bad_params: "failed", crashed: "failed"}, statuses
+        assert [TimesRun(job) for job in jobs] == [0, 1, 1, 1, 2, 2, 2]
+        print("Failed jobs are retried")
+
+        # force runs everything again
+        statuses = LSDMap_BD.RunBatch([done, changed], job_log, force = True)
+        assert statuses == {done: "done", changed: "done"}, statuses
+        assert TimesRun(done) == 1 and TimesRun(changed) == 2
+        print("Force runs finished jobs again")
+
+        # a job past its time limit is stopped with the processes it started
+        slow = WriteParameterFile(directory, "slow", "sleep 2")
+        start_time = time.time()
+        statuses = LSDMap_BD.RunBatch([slow], job_log, timeout = 0.5)
+        assert statuses == {slow: "timeout"}, statuses
+        assert time.time()-start_time < 2
+        time.sleep(3)
+        if hasattr(os, "killpg"):
+            assert not os.path.isfile(slow+".marker")
+        assert LSDMap_BD.ReadJobLog(job_log)[slow]["status"] == "timeout"
+        print("A job past its time limit is stopped with its children")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    TestResume()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the binary cache of a csv file is used while it is up to date and
+rebuilt when the csv file changes.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from LSDPlottingTools import LSDMap_PointTools as LSDMap_PT
+
+def WriteCSV(FileName, elevations):
+    with open(FileName, "w") as csv_file:
+        csv_file.write("latitude,longitude,elevation\n")
+        for row, elevation in enumerate(elevations):
+            csv_file.write(str(55.+0.01*row)+","+str(-3.+0.01*row)+","+str(elevation)+"\n")
+
+def TestColumnarCache():
+
+    directory = tempfile.mkdtemp()
+    try:
+        FileName = os.path.join(directory, "points.csv")
+        WriteCSV(FileName, [10., 20., 30., 40.])
+
+        # read the csv and write its cache
+        data = LSDMap_PT.ReadFilteredCSV(FileName)
+        VariableList = list(data.columns)
+        DataDict = dict([(name, data[name].values) for name in VariableList])
+        LSDMap_PT.WriteColumnarCache(FileName, VariableList, DataDict)
+        CachedList, CachedDict = LSDMap_PT.ReadColumnarCache(FileName, columns = ["elevation"])
+        assert CachedList == ["elevation"]
+        np.testing.assert_array_equal(CachedDict["elevation"], [10., 20., 30., 40.])
+        print("The cache has the columns of the csv")
+
+        # the cache is used while it is up to date: the filtered rows come from it
+        data = LSDMap_PT.ReadFilteredCSV(FileName, columns = ["elevation"], ranges = {"elevation": (15., 35.)})
+        np.testing.assert_array_equal(data["elevation"].values, [20., 30.])
+
+        # change the csv, with a different modification time
+        WriteCSV(FileName, [11., 21., 31., 41., 51.])
+        stat = os.stat(FileName)
+        os.utime(FileName, (stat.st_atime, stat.st_mtime+10))
+        assert LSDMap_PT.ReadColumnarCache(FileName) == (None, None)
+        data = LSDMap_PT.ReadFilteredCSV(FileName, columns = ["elevation"], ranges = {"elevation": (15., 35.)})
+        np.testing.assert_array_equal(data["elevation"].values, [21., 31.])
+        print("The cache is out of date when the csv changes, and the csv is read instead")
+
+        # rebuild it
+        data = LSDMap_PT.ReadFilteredCSV(FileName)
+        LSDMap_PT.WriteColumnarCache(FileName, list(data.columns),
+                                     dict([(name, data[name].values) for name in data.columns]))
+        np.testing.assert_array_equal(LSDMap_PT.ReadColumnarCache(FileName)[1]["elevation"],
+                                      [11., 21., 31., 41., 51.])
+        print("The rebuilt cache has the new data")
+
+        # a broken cache is ignored rather than read
+        with open(LSDMap_PT.GetColumnarCacheName(FileName), "wb") as cache_file:
+            cache_file.write(b"PK\x03\x04 this is not a zip file")
+        assert LSDMap_PT.ReadColumnarCache(FileName) == (None, None)
+        data = LSDMap_PT.ReadFilteredCSV(FileName, columns = ["elevation"])
+        np.testing.assert_array_equal(data["elevation"].values, [11., 21., 31., 41., 51.])
+        print("A broken cache is ignored")
+
+        # no temporary files are left behind
+        assert sorted(os.listdir(directory)) == sorted(["points.csv", os.path.basename(LSDMap_PT.GetColumnarCacheName(FileName))])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    TestColumnarCache()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the key and the least recently used trimming of the derived raster cache
+of LSDMap_BasicManipulation. The derived rasters are made by a counting function,
+so no real raster is needed.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from LSDPlottingTools import LSDMap_BasicManipulation as LSDMap_BM
+
+def TestDerivedRasterCache():
+
+    directory = tempfile.mkdtemp()
+    old_settings = dict(LSDMap_BM.DerivedRasterCacheSettings)
+    LSDMap_BM.SetDerivedRasterCache(directory = os.path.join(directory, "cache"), enabled = True)
+    try:
+        raster_file = os.path.join(directory, "dem.bil")
+        with open(raster_file, "wb") as this_file:
+            this_file.write(b"\0"*400)
+        with open(os.path.join(directory, "dem.hdr"), "w") as this_file:
+            this_file.write("samples = 10\n")
+
+        calls = []
+        def ComputeDerived():
+            calls.append(1)
+            return np.full((100, 100), float(len(calls)))
+
+        def GetDerived(parameters):
+            return LSDMap_BM.GetCachedDerivedRaster(raster_file, "hillshade", ComputeDerived, parameters)
+
+        first = GetDerived({"azimuth": 315})
+        again = GetDerived({"azimuth": 315})
+        assert len(calls) == 1
+        np.testing.assert_array_equal(first, again)
+        print("A derived raster is computed once and then read from the cache")
+
+        GetDerived({"azimuth": 270})
+        assert len(calls) == 2
+        print("Different parameters are a different key")
+
+        # editing the header changes the key even though the raster file is the same
+        with open(os.path.join(directory, "dem.hdr"), "w") as this_file:
+            this_file.write("samples = 10\nlines = 10\n")
+        GetDerived({"azimuth": 315})
+        assert len(calls) == 3
+        print("Changing a sidecar file changes the key")
+
+        with open(raster_file, "wb") as this_file:
+            this_file.write(b"\1"*800)
+        GetDerived({"azimuth": 315})
+        assert len(calls) == 4
+        print("Changing the raster changes the key")
+
+        # The cached rasters are filled with the number of the call that made them.
+        # Make the current one (call 4) the oldest, then use it
+        cache_directory = LSDMap_BM.DerivedRasterCacheSettings["directory"]
+        def CachedRasters():
+            rasters = {}
+            for name in os.listdir(cache_directory):
+                assert name.endswith(".npy"), name
+                rasters[int(np.load(os.path.join(cache_directory, name))[0, 0])] = name
+            return rasters
+        cached = CachedRasters()
+        assert sorted(cached.keys()) == [1, 2, 3, 4]
+        now = time.time()
+        for call, age in [(4, 4000), (1, 3000), (2, 2000), (3, 1000)]:
+            os.utime(os.path.join(cache_directory, cached[call]), (now-age, now-age))
+        GetDerived({"azimuth": 315})
+        assert len(calls) == 4
+
+        # there is room for two and a half rasters, so the two used last are kept
+        file_size = os.path.getsize(os.path.join(cache_directory, cached[4]))
+        LSDMap_BM.TrimDerivedRasterCache(2.5*file_size/(1024.*1024.))
+        assert sorted(CachedRasters().keys()) == [3, 4]
+        print("Trimming deletes the least recently used rasters")
+
+        LSDMap_BM.ClearDerivedRasterCache()
+        assert os.listdir(cache_directory) == []
+        print("Clearing the cache deletes everything")
+    finally:
+        LSDMap_BM.DerivedRasterCacheSettings.update(old_settings)
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    TestDerivedRasterCache()
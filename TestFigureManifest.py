@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the plotting driver only remakes the figures that are out of date.
+The plots are swapped for stub plots that write an empty figure, so this doesn't
+need GDAL or any real data.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from LSDPlottingTools.LSDMap_PlottingDriver import LSDMap_PlottingDriver
+import MappingDriver
+
+# The plots that have been made
+PlotsMade = []
+
+def StubPlot(switch):
+    def plot(self, FigFileName):
+        PlotsMade.append(switch)
+        with open(FigFileName, "w") as fig_file:
+            fig_file.write(switch)
+    return plot
+
+def WriteFile(FileName, contents):
+    with open(FileName, "w") as this_file:
+        this_file.write(contents)
+
+def WriteParameterFile(directory, base_cmap = "gray"):
+    param_file = os.path.join(directory, "Params.param")
+    WriteFile(param_file, "file_prefix: test\nBasicDensityPlot: true\nChiProfiles: true\n"
+                          "n_processes: 1\nbase_cmap: "+base_cmap+"\n")
+    return param_file
+
+def MakePlots(param_file, force = False):
+    del PlotsMade[:]
+    LSDMap_PlottingDriver(param_file).plot_data(force = force)
+    return sorted(PlotsMade)
+
+def TestFigureManifest():
+
+    LSDMap_PlottingDriver.plot_BasicDensityPlot = StubPlot("BasicDensityPlot")
+    LSDMap_PlottingDriver.plot_ChiProfiles = StubPlot("ChiProfiles")
+    PlottingDriverModule = sys.modules[LSDMap_PlottingDriver.__module__]
+
+    directory = tempfile.mkdtemp()
+    try:
+        # the inputs of the two plots: the base raster and the chi csv
+        WriteFile(os.path.join(directory, "test.bil"), "raster")
+        WriteFile(os.path.join(directory, "test.hdr"), "header")
+        WriteFile(os.path.join(directory, "test_MChiSegmented.csv"), "chi")
+        param_file = WriteParameterFile(directory)
+        both = ["BasicDensityPlot", "ChiProfiles"]
+
+        assert MakePlots(param_file) == both
+        assert MakePlots(param_file) == []
+        print("Up to date figures are skipped")
+
+        # the size of the header changes, so the fingerprint of the raster changes
+        WriteFile(os.path.join(directory, "test.hdr"), "a longer header")
+        assert MakePlots(param_file) == ["BasicDensityPlot"]
+        WriteFile(os.path.join(directory, "test_MChiSegmented.csv"), "more chi")
+        assert MakePlots(param_file) == ["ChiProfiles"]
+        print("Figures are remade when their inputs change")
+
+        # only the density plot uses the base colourmap
+        param_file = WriteParameterFile(directory, base_cmap = "jet")
+        assert MakePlots(param_file) == ["BasicDensityPlot"]
+        print("Figures are remade when their parameters change")
+
+        os.remove(os.path.join(directory, "testChiProfile.png"))
+        assert MakePlots(param_file) == ["ChiProfiles"]
+        print("Missing figures are remade")
+
+        code_version = PlottingDriverModule.GetPlottingCodeVersion()
+        PlottingDriverModule._PlottingCodeVersion = "a different version"
+        try:
+            assert MakePlots(param_file) == both
+            assert MakePlots(param_file) == []
+        finally:
+            PlottingDriverModule._PlottingCodeVersion = code_version
+        assert MakePlots(param_file) == both
+        print("Figures are remade when the plotting code changes")
+
+        assert MakePlots(param_file, force = True) == both
+        print("Force remakes up to date figures")
+
+        # the same through the command line
+        argv = sys.argv
+        try:
+            for arguments, expected in [([], []), (["-f"], both)]:
+                sys.argv = ["MappingDriver.py", "-pf", param_file]+arguments
+                del PlotsMade[:]
+                MappingDriver.main(sys.argv[1:])
+                assert sorted(PlotsMade) == expected
+        finally:
+            sys.argv = argv
+        print("The -f flag of MappingDriver remakes the figures")
+
+        # the manifest is replaced in one step, so no temporary files are left
+        assert sorted(os.listdir(directory)) == sorted(["Params.param", "test.bil", "test.hdr",
+                                                        "test_MChiSegmented.csv", "testBDP.png",
+                                                        "testChiProfile.png", "test_FigureManifest.json"])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    TestFigureManifest()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that LSDMap_RasterCalculator only evaluates the expressions it should,
+and that it gets the right numbers for the ones it does.
+"""
+
+import numpy as np
+from LSDPlottingTools import LSDMap_RasterCalculator as LSDMap_RC
+
+def TestExpressionWhitelist():
+
+    names = ["a", "b", "c"]
+    for expression in ["(a - b) * (c > 0)", "where(a > 0, a, 0)", "-a ** 2 + sqrt(abs(b)) / 3.5",
+                       "logical_and(a > 1, b < 2) * pi"]:
+        LSDMap_RC._CompileExpression(expression, names)
+        print("Allowed: "+expression)
+
+    for expression in ["a.__class__", "d + 1", "__import__('os')", "(lambda x: x)(a)",
+                       "a[0]", "[a, b]", "a(b)", "'text'", "open('file')"]:
+        try:
+            LSDMap_RC._CompileExpression(expression, names)
+        except ValueError:
+            print("Rejected: "+expression)
+        else:
+            raise Exception("The expression "+expression+" should have been rejected")
+
+def TestEvaluateBlock():
+
+    names = ["a", "b"]
+    a = np.array([[1., -2., np.nan], [4., 0., 6.]])
+    b = np.array([[2., 2., 2.], [np.nan, 1., 3.]])
+
+    code = LSDMap_RC._CompileExpression("where(a > 0, a * b + k, 0)", names+["k"])
+    result = LSDMap_RC._EvaluateBlock(code, names, [a, b], {"k": 1.}, True)
+    expected = np.array([[3., 0., np.nan], [np.nan, 0., 19.]])
+    np.testing.assert_array_equal(result, expected)
+    print("The nodata of the inputs is propagated")
+
+    # without propagation only the pixels where the result isn't finite are nodata
+    code = LSDMap_RC._CompileExpression("a / b", names)
+    result = LSDMap_RC._EvaluateBlock(code, names, [a, np.zeros_like(b)], {}, False)
+    assert np.all(np.isnan(result))
+    result = LSDMap_RC._EvaluateBlock(code, names, [a, b], {}, False)
+    np.testing.assert_array_equal(result, a/b)
+    print("Division by zero is nodata")
+
+if __name__ == "__main__":
+    TestExpressionWhitelist()
+    TestEvaluateBlock()
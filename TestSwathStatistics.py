@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the swath statistics of LSDMap_BasicManipulation.SwathStatistics against
+numpy, for the exact percentiles and the ones interpolated from histograms.
+"""
+
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+from osgeo import gdal
+from LSDPlottingTools import LSDMap_BasicManipulation as LSDMap_BM
+
+def WriteTestRaster(raster_file, data, NoDataValue = -9999):
+    """This writes an array to an ENVI raster with 10 m cells."""
+    driver = gdal.GetDriverByName("ENVI")
+    dataset = driver.Create(raster_file, data.shape[1], data.shape[0], 1, gdal.GDT_Float64)
+    dataset.SetGeoTransform((500000., 10., 0., 4200000., 0., -10.))
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(NoDataValue)
+    band.WriteArray(data)
+    band.FlushCache()
+    dataset = None
+
+def TestSwathPercentiles():
+
+    rng = np.random.RandomState(7)
+    data = rng.gamma(2., 30., size = (45, 32))
+    data[3, :] = -9999
+    data[10:20, 5] = -9999
+    data[:, 9] = -9999
+    nan_data = np.where(data == -9999, np.nan, data)
+
+    directory = tempfile.mkdtemp()
+    try:
+        raster_file = os.path.join(directory, "swath_test.bil")
+        WriteTestRaster(raster_file, data)
+
+        for axis in [0, 1]:
+            exact = LSDMap_BM.SwathStatistics(raster_file, axis = axis, percentiles = [10, 50, 90],
+                                              exact_percentiles = True, block_rows = 8)
+            approximate = LSDMap_BM.SwathStatistics(raster_file, axis = axis, percentiles = [10, 50, 90],
+                                                    block_rows = 8)
+
+            # column 9 has no data at all, so its statistics are nan (numpy warns about it)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                for statistic, function in [("mean", np.nanmean), ("std", np.nanstd),
+                                            ("min", np.nanmin), ("max", np.nanmax)]:
+                    np.testing.assert_allclose(exact[statistic], function(nan_data, axis = axis))
+                    np.testing.assert_allclose(approximate[statistic], function(nan_data, axis = axis))
+                for percentile in [10, 50, 90]:
+                    key = "percentile_"+str(percentile)
+                    expected = np.nanpercentile(nan_data, percentile, axis = axis)
+                    np.testing.assert_allclose(exact[key], expected)
+
+                    # The histogram percentiles interpolate the cumulative count rather than
+                    # the ranks, so they should be between the values either side of the rank,
+                    # give or take one of the 1024 histogram bins of the swath bin
+                    values = nan_data if axis == 0 else nan_data.T
+                    tolerance = (approximate["max"]-approximate["min"])/1024.
+                    for i in range(values.shape[1]):
+                        bin_values = np.sort(values[:, i][np.isfinite(values[:, i])])
+                        if len(bin_values) == 0:
+                            assert np.isnan(approximate[key][i]), key
+                            continue
+                        rank = len(bin_values)*percentile/100.
+                        lower = bin_values[max(int(np.floor(rank)), 1)-1]
+                        upper = bin_values[min(int(np.ceil(rank)), len(bin_values))-1]
+                        assert lower-tolerance[i] <= approximate[key][i] <= upper+tolerance[i], key
+            print("Swath statistics along axis "+str(axis)+" match numpy")
+
+        # SimpleSwath gives the exact medians by default
+        medians = LSDMap_BM.SimpleSwath(directory, "swath_test.bil", 0)[1]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            np.testing.assert_allclose(np.ma.filled(medians, np.nan), np.nanmedian(nan_data, axis = 0))
+        print("SimpleSwath medians match numpy")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    TestSwathPercentiles()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the block statistics of LSDMap_ZonalStatistics merge to the
+statistics numpy gets from all the values of each zone at once.
+"""
+
+import numpy as np
+from LSDPlottingTools import LSDMap_ZonalStatistics as LSDMap_ZS
+
+def TestZonalMerges():
+
+    rng = np.random.RandomState(42)
+    zones = rng.randint(1, 8, size = (60, 50))
+    values = rng.normal(1000., 50., size = zones.shape)
+    zone_ids = np.array([1, 2, 3, 4, 5, 6, 7, 9])
+
+    # group the raster in strips of rows, like ZonalStatistics reads it
+    groups = []
+    for row in range(0, zones.shape[0], 7):
+        groups.append(LSDMap_ZS._GroupBlock(zones[row:row+7].ravel(), values[row:row+7].ravel()))
+    stats = LSDMap_ZS._MergeGroups(zone_ids, groups)
+
+    for i, zone in enumerate(zone_ids):
+        zone_values = values[zones == zone]
+        if len(zone_values) == 0:
+            assert stats["count"][i] == 0
+            assert np.isnan(stats["mean"][i]) and np.isnan(stats["min"][i])
+            continue
+        assert stats["count"][i] == len(zone_values)
+        np.testing.assert_allclose(stats["mean"][i], np.mean(zone_values))
+        np.testing.assert_allclose(stats["std"][i], np.std(zone_values))
+        np.testing.assert_allclose(stats["sum"][i], np.sum(zone_values))
+        assert stats["min"][i] == np.min(zone_values)
+        assert stats["max"][i] == np.max(zone_values)
+    print("Merged block statistics match numpy")
+
+    # a raster with no values in any zone
+    empty = LSDMap_ZS._MergeGroups(zone_ids, [])
+    assert np.all(empty["count"] == 0) and np.all(np.isnan(empty["mean"]))
+    print("Empty zones are nan")
+
+if __name__ == "__main__":
+    TestZonalMerges()